@@ -0,0 +1,203 @@
+"""A local stand-in for the OpenAI chat completions API, for benchmarks and for exercising retries.
+
+Answers `POST /v1/chat/completions` (plain and streamed) with deterministic content that the dbtai
+commands can parse, after a configurable latency. It can enforce a requests per minute limit, answering
+429 with `Retry-After` and rate limit headers like the real API, and fail a share of requests with 500.
+For tests, it can also answer the first requests with a fixed sequence of error statuses.
+
+Point dbtai at it with `base_url: http://127.0.0.1:8765/v1` in the config file (or the
+`OPENAI_BASE_URL` environment variable), and any `api_key`.
+
+Usage:
+    python benchmarks/fake_llm_server.py [--port 8765] [--latency-ms 50] [--rpm 600] [--error-rate 0.1]
+        [--failures 429,500]
+"""
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The model name, when the prompt quotes it in backticks
+MODEL_NAME = re.compile(r'`(\w+)`')
+
+TEXT_RESPONSE = "This model selects columns from its upstream models and joins them on their keys. "
+
+ERROR_MESSAGES = {
+    400: ('Invalid request', 'invalid_request_error'),
+    429: ('Rate limit reached', 'requests'),
+}
+
+
+def make_content(body):
+    """Make a response the dbtai commands can parse: JSON with the fields of every command, or text."""
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        match = MODEL_NAME.search(body['messages'][-1]['content'])
+        return json.dumps({
+            'name': match.group(1) if match else 'model',
+            'description': 'A generated description.',
+            'columns': [{'name': 'id', 'description': 'A generated column description.'}],
+            'unit_test': 'unit_tests: []',
+            'explanation': 'A generated explanation.',
+            'code': 'select 1 as id',
+            'diff': [],
+        })
+    return TEXT_RESPONSE * 3
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, port=8765, latency_ms=50, rpm=None, error_rate=0.0, seed=0, failures=(), retry_after=1.0):
+        """Create the server.
+
+        Args:
+            port (int, optional): The port, 0 for any free port. Defaults to 8765.
+            latency_ms (float, optional): The latency of every response. Defaults to 50.
+            rpm (int, optional): The requests per minute before answering 429. Defaults to None, for no limit.
+            error_rate (float, optional): The share of requests answered with 500. Defaults to 0.
+            seed (int, optional): The seed for the random errors. Defaults to 0.
+            failures (Iterable[int], optional): Statuses to answer the first requests with, in order,
+                e.g. `[429, 500]`. Defaults to none.
+            retry_after (float, optional): The `Retry-After` seconds of the 429s in `failures`. Defaults to 1.
+        """
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency_ms / 1000
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.failures = collections.deque(failures)
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.window = collections.deque()
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """Decide the status of the response to a request, and the seconds until the rate limit resets."""
+        now = time.monotonic()
+        with self.lock:
+            if self.failures:
+                status = self.failures.popleft()
+                self.counts['throttled' if status == 429 else 'error'] += 1
+                return status, self.retry_after
+            while self.window and self.window[0] <= now - 60:
+                self.window.popleft()
+            if self.rpm and len(self.window) >= self.rpm:
+                self.counts['throttled'] += 1
+                return 429, self.window[0] + 60 - now
+            self.window.append(now)
+            if self.random.random() < self.error_rate:
+                self.counts['error'] += 1
+                return 500, 0
+            self.counts['ok'] += 1
+            return 200, 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=()):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, dict(self.server.counts))
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        status, reset = self.server.admit()
+        if status == 429:
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, [
+                ('Retry-After', f'{reset:.3f}'),
+                ('x-ratelimit-limit-requests', str(self.server.rpm or 0)),
+                ('x-ratelimit-remaining-requests', '0'),
+                ('x-ratelimit-reset-requests', f'{reset:.3f}s'),
+            ])
+            return
+        if status != 200:
+            message, error_type = ERROR_MESSAGES.get(status, ('Internal server error', 'server_error'))
+            self._send_json(status, {'error': {'message': message, 'type': error_type}})
+            return
+
+        time.sleep(self.server.latency)
+        content = make_content(body)
+        prompt_tokens = len(json.dumps(body['messages'])) // 4
+
+        if not body.get('stream'):
+            self._send_json(200, {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', 'fake'),
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(content) // 4,
+                    'total_tokens': prompt_tokens + len(content) // 4,
+                },
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for word in content.split(' '):
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body.get('model', 'fake'),
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            self._send_chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+        self._send_chunk(b'data: [DONE]\n\n')
+        self._send_chunk(b'')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Latency of every response')
+    parser.add_argument('--rpm', type=int, default=None, help='Requests per minute before answering 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 500')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random errors')
+    parser.add_argument('--failures', default='', help='Comma separated statuses to answer the first requests with, e.g. 429,500')
+    args = parser.parse_args()
+
+    failures = [int(status) for status in args.failures.split(',') if status]
+    server = FakeLLMServer(args.port, args.latency_ms, args.rpm, args.error_rate, args.seed, failures)
+    print(f"Fake LLM API on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(dict(server.counts)))
+
+
+if __name__ == '__main__':
+    main()
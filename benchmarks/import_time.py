@@ -0,0 +1,133 @@
+"""Import time regression check for the lightweight dbtai commands.
+
+Runs the non-LLM commands under `python -X importtime`, and fails if their startup
+import time exceeds the budget, or if they import any of the heavy LLM/linting
+dependencies that should only be loaded by the commands that use them. The commands
+run with a temporary dbtai data dir, so they don't depend on the user's config.
+The same check runs in the test suite, see `tests/test_import_time.py`.
+
+Usage:
+    python benchmarks/import_time.py [--budget-ms 300]
+"""
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+# Commands that should start without loading any heavy dependency
+LIGHT_COMMANDS = [
+    ['--help'],
+    ['hello'],
+    ['show'],
+]
+
+# The default import time budget per command, in ms
+BUDGET_MS = 300
+
+# Modules that only the LLM and linting commands should import
+HEAVY_MODULES = [
+    'openai',
+    'mistralai',
+    'sqlfluff',
+    'ruamel.yaml',
+    'inquirer',
+    'difflib',
+]
+
+
+@contextlib.contextmanager
+def temporary_data_dir():
+    """Point the dbtai data dir (config, caches) at a temporary directory, with the default config.
+
+    Yields:
+        dict: The environment variables to run the commands with.
+    """
+    import appdirs
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, XDG_DATA_HOME=os.path.join(home, 'data'), APPDATA=home)
+        # appdirs reads the environment, so the data dir of the commands is found the same way
+        with mock.patch.dict(os.environ, env):
+            config_dir = appdirs.user_data_dir('dbtai', 'dbtai')
+
+        os.makedirs(config_dir)
+        with open(os.path.join(config_dir, 'config.yaml'), 'w') as f:
+            f.write("language: english\nbackend: Fake\n")
+        yield env
+
+
+def measure(args, env=None):
+    """Run a dbtai command under `-X importtime`.
+
+    Args:
+        args (list[str]): The command line arguments for dbtai.
+        env (dict, optional): The environment to run the command with. Defaults to None, for the current one.
+
+    Returns:
+        tuple[float, dict, list]: The total import time in ms, the cumulative import time
+            in ms per top level imported module, and the names of all imported modules.
+    """
+    code = f"from dbtai.cli import dbtai; dbtai({args!r})"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"dbtai {' '.join(args)} failed:\n{result.stderr}")
+
+    top_level = {}
+    imported = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.append(name.strip())
+        # Nested imports are indented, only count the top level ones towards the total
+        if not name.startswith('  '):
+            top_level[name.strip()] = int(cumulative) / 1000
+
+    return sum(top_level.values()), top_level, imported
+
+
+def heavy_modules(imported):
+    """The heavy modules among the imported modules."""
+    return [
+        module for module in imported
+        if any(module == heavy or module.startswith(heavy + '.') for heavy in HEAVY_MODULES)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='Import time budget per command, in ms')
+    args = parser.parse_args()
+
+    failures = []
+    with temporary_data_dir() as env:
+        measured = [(command, *measure(command, env)) for command in LIGHT_COMMANDS]
+
+    for command, total, modules, imported in measured:
+        heavy = heavy_modules(imported)
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:3]
+
+        print(f"dbtai {' '.join(command)}: {total:.0f} ms (slowest: {', '.join(f'{m} {t:.0f} ms' for m, t in slowest)})")
+
+        if total > args.budget_ms:
+            failures.append(f"dbtai {' '.join(command)} imports take {total:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+        if heavy:
+            failures.append(f"dbtai {' '.join(command)} imports heavy modules: {', '.join(heavy)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
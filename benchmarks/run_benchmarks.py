@@ -0,0 +1,315 @@
+"""Benchmark the hot paths of dbtai on synthetic projects of growing size.
+
+For each project size, generates a synthetic project (see synthetic_manifest.py) and times
+loading the manifest, model lookups, upstream context and docs formatting, and end to end
+commands against the fake LLM server (see fake_llm_server.py). Each benchmark reports the
+median and minimum time per operation, and its peak traced memory.
+
+The results are written as JSON, and can be compared with the results of another commit:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --output before.json
+    git checkout my-branch
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --compare before.json
+
+which fails if any benchmark got slower than the threshold (default 1.25x). Comparisons use the
+minimum time of the runs, which is less sensitive to noise from other processes than the median.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 1000 10000 100000] [--repeats 5] [--output results.json]
+        [--compare baseline.json] [--threshold 1.25]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm_server import FakeLLMServer
+from synthetic_manifest import generate_project
+
+# Lookups and context building are timed over this many random models per repeat
+SAMPLE_MODELS = 200
+
+
+@contextlib.contextmanager
+def project(directory, server_port):
+    """Run in a project directory, with dbtai configured to use the fake LLM server, and its data
+    dir (where the manifest caches are kept) inside the project directory."""
+    config = {
+        'language': 'english',
+        'backend': 'OpenAI',
+        'api_key': 'benchmark',
+        'openai_model_name': 'fake',
+        'base_url': f'http://127.0.0.1:{server_port}/v1',
+        'response_cache': False,
+        'usage_tracking': False,
+    }
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        with mock.patch.dict(os.environ, {'XDG_DATA_HOME': os.path.join(directory, 'data')}), \
+                mock.patch('dbtai.utils.get_config', return_value=config), \
+                mock.patch('dbtai.manifest.get_config', return_value=config), \
+                mock.patch('dbtai.chatbot.get_config', return_value=config):
+            yield
+    finally:
+        os.chdir(cwd)
+
+
+def dict_walk(edges, start):
+    """Breadth first walk over a map of unique_ids to neighbours, the way graph queries were done before the DAG index."""
+    distances = {}
+    frontier = [start]
+    distance = 0
+    while frontier:
+        distance += 1
+        next_frontier = []
+        for node in frontier:
+            for neighbour in edges.get(node, ()):
+                if neighbour not in distances and neighbour != start:
+                    distances[neighbour] = distance
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return distances
+
+
+def dict_levels(parent_map, child_map):
+    """Topological levels with Kahn's algorithm over the parent and child maps."""
+    waiting = {node: len(parents) for node, parents in parent_map.items()}
+    levels = {node: 0 for node in parent_map}
+    ready = [node for node, count in waiting.items() if count == 0]
+    while ready:
+        node = ready.pop()
+        for child in child_map.get(node, ()):
+            levels[child] = max(levels[child], levels[node] + 1)
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                ready.append(child)
+    return levels
+
+
+def measure(function, repeats, operations=1, setup=None):
+    """Time a function, and measure its peak memory in a separate traced run.
+
+    Args:
+        function (Callable[[], None]): The function to benchmark.
+        repeats (int): The number of timed runs.
+        operations (int, optional): The number of operations per run, to report the time per operation.
+        setup (Callable[[], None], optional): Run before every run, untimed.
+
+    Returns:
+        dict: The median and minimum seconds per operation, and the peak memory in MB.
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) / operations)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'repeats': repeats,
+        'operations': operations,
+        'peak_mb': peak / 1e6,
+    }
+
+
+def benchmarks(directory, repeats):
+    """Run the benchmarks in a project directory, yielding the name and the measurements of each."""
+    from click.testing import CliRunner
+    from dbtai import manifest_cache
+    from dbtai.cli import dbtai
+    from dbtai.graph import DagIndex
+    from dbtai.manifest import Manifest
+
+    cache_path = manifest_cache.get_cache_path('target/manifest.json')
+
+    def remove_cache():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+    yield 'manifest_load', measure(lambda: Manifest(cache=False), repeats)
+    yield 'manifest_load_streaming', measure(lambda: Manifest(cache=False, streaming=True), repeats)
+    yield 'manifest_load_cache_miss', measure(lambda: Manifest(cache=True), repeats, setup=remove_cache)
+    yield 'manifest_load_cache_hit', measure(lambda: Manifest(cache=True), repeats)
+
+    manifest = Manifest()
+    rng = random.Random(0)
+    models = [node['name'] for node in manifest.nodes_by_id.values() if node['resource_type'] == 'model']
+    sample = rng.sample(models, min(SAMPLE_MODELS, len(models)))
+
+    def lookups():
+        for name in sample:
+            manifest.get_model_from_name(name)
+
+    def upstream():
+        for name in sample:
+            manifest.get_upstream_models(name)
+
+    def context():
+        for name in sample:
+            manifest.compile_upstream_description_markdown(name, manifest._context_budget('doc'))
+
+    docs = {
+        'name': 'model',
+        'description': 'A model.',
+        'columns': [{'name': f'column_{index}', 'description': f'Column {index}.'} for index in range(40)],
+    }
+
+    def format_docs():
+        for _ in sample:
+            manifest.format_docs(docs)
+
+    yield 'get_model_from_name', measure(lookups, repeats, len(sample))
+    yield 'get_upstream_models', measure(upstream, repeats, len(sample))
+    # The first run parses the model code for column usage, later runs hit the usage cache
+    yield 'compile_upstream_description_markdown_cold', measure(context, 1, len(sample))
+    yield 'compile_upstream_description_markdown', measure(context, repeats, len(sample))
+    yield 'format_docs', measure(format_docs, repeats, len(sample))
+
+    # Graph queries on the DAG index, against walking the parent and child maps of the manifest
+    with open('target/manifest.json', 'r') as f:
+        raw_manifest = json.load(f)
+    parent_map, child_map = raw_manifest['parent_map'], raw_manifest['child_map']
+    del raw_manifest
+    graph = manifest.graph
+    sample_ids = [manifest.get_model_from_name(name)['unique_id'] for name in sample]
+    upstream_ids = [parent for unique_id in sample_ids for parent in parent_map[unique_id][:1]]
+
+    def reset_levels():
+        graph._levels = None
+
+    yield 'graph_build', measure(lambda: DagIndex.build(manifest.nodes_by_id, parent_map), repeats)
+    yield 'ancestors_dict_walk', measure(lambda: [dict_walk(parent_map, unique_id) for unique_id in sample_ids], repeats, len(sample_ids))
+    yield 'ancestors_dag_index', measure(lambda: [graph.ancestors(unique_id) for unique_id in sample_ids], repeats, len(sample_ids))
+    yield 'descendants_dict_walk', measure(lambda: [dict_walk(child_map, unique_id) for unique_id in upstream_ids], repeats, len(upstream_ids))
+    yield 'descendants_dag_index', measure(lambda: [graph.descendants(unique_id) for unique_id in upstream_ids], repeats, len(upstream_ids))
+    yield 'topological_levels_dict_walk', measure(lambda: dict_levels(parent_map, child_map), repeats)
+    yield 'topological_levels_dag_index', measure(graph.levels, repeats, setup=reset_levels)
+
+    # The commands below run in this process, so write the column usage cache like a finished command would
+    manifest.sql_usage_cache.save()
+
+    runner = CliRunner()
+    bulk = sample[:50]
+
+    def run(*args):
+        result = runner.invoke(dbtai, list(args), catch_exceptions=False)
+        if result.exit_code != 0:
+            raise RuntimeError(f"dbtai {' '.join(args)} failed: {result.output}")
+
+    yield 'cli_doc', measure(lambda: run('doc', sample[0]), repeats)
+    yield 'cli_explain', measure(lambda: run('explain', sample[0], '--no-stream'), repeats)
+    yield 'cli_doc_bulk_50', measure(lambda: run('doc', *bulk, '--concurrency', '8'), repeats)
+
+
+def format_time(seconds):
+    if seconds < 0.001:
+        return f"{seconds * 1e6:10.2f} us"
+    return f"{seconds * 1000:10.2f} ms"
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every benchmark against a baseline, and return the regressions."""
+    previous = {(result['size'], result['name']): result for result in baseline['results']}
+    regressions = []
+
+    print(f"\nCompared with {baseline['meta'].get('commit')}:")
+    for result in results:
+        before = previous.get((result['size'], result['name']))
+        if before is None:
+            continue
+        ratio = result['min_s'] / before['min_s'] if before['min_s'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(result)
+        print(f"{result['size']:>7} {result['name']:<45} {ratio:6.2f}x time  {result['peak_mb'] - before['peak_mb']:+8.1f} MB{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='Project sizes, in nodes')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic projects')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    server = FakeLLMServer(port=0, latency_ms=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            generate_project(directory, size, args.seed)
+            with project(directory, server.server_address[1]):
+                for name, measurement in benchmarks(directory, args.repeats):
+                    result = {'size': size, 'name': name, **measurement}
+                    results.append(result)
+                    print(
+                        f"{size:>7} {name:<45} {format_time(result['median_s'])} "
+                        f"(min {format_time(result['min_s'])})  peak {result['peak_mb']:8.1f} MB",
+                        flush=True
+                    )
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    server.shutdown()
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Generate a synthetic dbt project, with a manifest shaped like the manifests of real projects.
+
+The DAG is layered like a typical dbt project: sources, staging models reading one source each,
+intermediate models joining a few staging models, and marts joining many upstream models. Some
+models are far more popular than others, like the customer or date dimensions of a real project,
+so the fan-in is skewed. Column counts vary from a handful to over a hundred, and most columns
+are documented. The manifest also carries the sections dbtai skips (macros, docs, compiled code).
+
+Usage:
+    python benchmarks/synthetic_manifest.py 10000 /tmp/project_10k [--seed 0] [--write-models]
+"""
+import argparse
+import json
+import os
+import random
+
+# The share of each layer in the DAG
+LAYERS = [
+    ('source', 0.05),
+    ('stg', 0.35),
+    ('int', 0.35),
+    ('fct', 0.25),
+]
+
+MACROS_PER_NODE = 0.2
+
+
+def _column_count(rng):
+    """Column counts are skewed: most models are narrow, some are very wide."""
+    return max(3, min(150, int(rng.lognormvariate(2.8, 0.6))))
+
+
+def _pick_parents(rng, candidates, count):
+    """Pick the parents of a model, preferring the popular candidates at the start of the list."""
+    parents = []
+    while len(parents) < min(count, len(candidates)):
+        parent = candidates[int(len(candidates) * rng.random() ** 2.5)]
+        if parent not in parents:
+            parents.append(parent)
+    return parents
+
+
+def _columns(rng, names, documented_share=0.8):
+    return {
+        name: {
+            'name': name,
+            'description': f'The {name.replace("_", " ")} of the record.' if rng.random() < documented_share else '',
+            'meta': {},
+            'data_type': None,
+            'tags': [],
+        }
+        for name in names
+    }
+
+
+def _model_code(rng, parents, parent_columns, own_columns):
+    """Write model code in the usual dbt style: one CTE per upstream relation, joined in the final select."""
+    ctes = []
+    selects = []
+    for index, (parent, relation) in enumerate(parents):
+        alias = f'r{index}'
+        ctes.append(f'{alias} as (\n    select * from {relation}\n)')
+        available = parent_columns[parent]
+        for column in rng.sample(available, min(len(available), max(1, len(own_columns) // len(parents)))):
+            selects.append(f'{alias}.{column}')
+
+    joins = '\n'.join(f'left join r{index} on r0.id = r{index}.id' for index in range(1, len(parents)))
+    return (
+        "{{ config(materialized='table') }}\n\n"
+        'with ' + ',\n\n'.join(ctes) + '\n\n'
+        'select\n    ' + ',\n    '.join(selects or ['r0.id']) + '\n'
+        'from r0\n' + (joins + '\n' if joins else '')
+    )
+
+
+def generate_manifest(node_count, seed=0):
+    """Generate a synthetic manifest.
+
+    Args:
+        node_count (int): The number of nodes (sources and models).
+        seed (int, optional): The random seed, the same seed gives the same manifest. Defaults to 0.
+
+    Returns:
+        dict: The manifest.
+    """
+    rng = random.Random(seed)
+    nodes = {}
+    sources = {}
+    parent_map = {}
+    layers = {}
+    parent_columns = {}
+
+    counts = [max(1, int(node_count * share)) for _, share in LAYERS]
+    counts[-1] += node_count - sum(counts)
+
+    for (layer, _), count in zip(LAYERS, counts):
+        layers[layer] = []
+        for index in range(count):
+            column_names = ['id'] + [f'{layer}_col_{index % 97}_{column}' for column in range(_column_count(rng) - 1)]
+
+            if layer == 'source':
+                unique_id = f'source.synthetic.raw.src_{index}'
+                sources[unique_id] = {
+                    'unique_id': unique_id,
+                    'resource_type': 'source',
+                    'package_name': 'synthetic',
+                    'source_name': 'raw',
+                    'name': f'src_{index}',
+                    'identifier': f'src_{index}',
+                    'description': f'Raw table {index}, loaded from the source system.',
+                    'columns': _columns(rng, column_names),
+                    'original_file_path': 'models/staging/sources.yml',
+                    'fqn': ['synthetic', 'raw', f'src_{index}'],
+                    'config': {'enabled': True},
+                }
+                parent_map[unique_id] = []
+            else:
+                name = f'{layer}_{index}'
+                unique_id = f'model.synthetic.{name}'
+                if layer == 'stg':
+                    parent_ids = _pick_parents(rng, layers['source'], 1)
+                elif layer == 'int':
+                    parent_ids = _pick_parents(rng, layers['stg'], rng.randint(2, 4))
+                else:
+                    parent_ids = _pick_parents(rng, layers['int'] + layers['stg'], rng.randint(3, 8))
+
+                relations = [
+                    (parent, "{{ source('raw', '%s') }}" % sources[parent]['name'] if parent in sources
+                        else "{{ ref('%s') }}" % nodes[parent]['name'])
+                    for parent in parent_ids
+                ]
+                raw_code = _model_code(rng, relations, parent_columns, column_names)
+                directory = {'stg': 'staging', 'int': 'intermediate', 'fct': 'marts'}[layer]
+
+                nodes[unique_id] = {
+                    'unique_id': unique_id,
+                    'resource_type': 'model',
+                    'package_name': 'synthetic',
+                    'name': name,
+                    'alias': name,
+                    'description': f'The {name} model.' if rng.random() < 0.8 else '',
+                    'columns': _columns(rng, column_names),
+                    'raw_code': raw_code,
+                    'compiled_code': raw_code.replace('{{', '').replace('}}', '') * 2,
+                    'language': 'sql',
+                    'depends_on': {'nodes': parent_ids, 'macros': []},
+                    'original_file_path': f'models/{directory}/{name}.sql',
+                    'path': f'{directory}/{name}.sql',
+                    'fqn': ['synthetic', directory, name],
+                    'checksum': {'name': 'sha256', 'checksum': f'{seed:08x}{index:056x}'},
+                    'config': {'enabled': True, 'materialized': 'table', 'tags': [], 'meta': {}},
+                    'tags': [],
+                    'meta': {},
+                    'refs': [{'name': nodes[parent]['name']} for parent in parent_ids if parent in nodes],
+                    'sources': [['raw', sources[parent]['name']] for parent in parent_ids if parent in sources],
+                }
+                parent_map[unique_id] = parent_ids
+
+            layers[layer].append(unique_id)
+            parent_columns[unique_id] = column_names
+
+    child_map = {unique_id: [] for unique_id in parent_map}
+    for unique_id, parents in parent_map.items():
+        for parent in parents:
+            child_map[parent].append(unique_id)
+
+    macros = {
+        f'macro.synthetic.macro_{index}': {
+            'unique_id': f'macro.synthetic.macro_{index}',
+            'name': f'macro_{index}',
+            'macro_sql': '{% macro macro_' + str(index) + '(column) %}\n' + '    coalesce({{ column }}, 0)\n' * 20 + '{% endmacro %}',
+            'arguments': [{'name': 'column', 'type': None, 'description': ''}],
+        }
+        for index in range(int(node_count * MACROS_PER_NODE))
+    }
+
+    return {
+        'metadata': {'dbt_schema_version': 'https://schemas.getdbt.com/dbt/manifest/v11.json', 'dbt_version': '1.7.0'},
+        'nodes': nodes,
+        'sources': sources,
+        'macros': macros,
+        'docs': {},
+        'exposures': {},
+        'metrics': {},
+        'groups': {},
+        'selectors': {},
+        'disabled': {},
+        'parent_map': parent_map,
+        'child_map': child_map,
+        'group_map': {},
+        'semantic_models': {},
+    }
+
+
+def generate_project(directory, node_count, seed=0, write_models=False):
+    """Write a synthetic dbt project: dbt_project.yml and target/manifest.json, and optionally the model files.
+
+    Args:
+        directory (str): The project directory, created if it doesn't exist.
+        node_count (int): The number of nodes (sources and models).
+        seed (int, optional): The random seed. Defaults to 0.
+        write_models (bool, optional): Also write the model SQL files. Defaults to False.
+
+    Returns:
+        dict: The manifest.
+    """
+    manifest = generate_manifest(node_count, seed)
+
+    os.makedirs(os.path.join(directory, 'target'), exist_ok=True)
+    with open(os.path.join(directory, 'dbt_project.yml'), 'w') as f:
+        f.write("name: synthetic\nversion: '1.0.0'\nconfig-version: 2\nprofile: synthetic\n")
+    with open(os.path.join(directory, 'target', 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    if write_models:
+        for node in manifest['nodes'].values():
+            path = os.path.join(directory, node['original_file_path'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(node['raw_code'])
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('nodes', type=int, help='Number of nodes')
+    parser.add_argument('directory', help='Project directory')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--write-models', action='store_true', help='Also write the model SQL files')
+    args = parser.parse_args()
+
+    generate_project(args.directory, args.nodes, args.seed, args.write_models)
+    size = os.path.getsize(os.path.join(args.directory, 'target', 'manifest.json'))
+    print(f"Wrote a {args.nodes} node project to {args.directory} ({size / 1e6:.1f} MB manifest)")
+
+
+if __name__ == '__main__':
+    main()
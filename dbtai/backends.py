@@ -0,0 +1,340 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import re
+import time
+from dbtai import tracing, usage
+from dbtai.clients import get_async_client, get_client
+from dbtai.scheduler import get_scheduler
+from dbtai.utils import estimate_message_tokens, estimate_tokens
+
+
+class Completion():
+    """The content of a chat completion, and its token usage when the backend reports it."""
+
+    def __init__(self, content, prompt_tokens=None, completion_tokens=None):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    @property
+    def total_tokens(self):
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            return None
+        return self.prompt_tokens + self.completion_tokens
+
+    @classmethod
+    def from_response(cls, response):
+        """Make a completion from an OpenAI or Mistral chat completion response."""
+        usage = getattr(response, 'usage', None)
+        return cls(
+            response.choices[0].message.content,
+            getattr(usage, 'prompt_tokens', None),
+            getattr(usage, 'completion_tokens', None),
+        )
+
+
+def _chunk_text(chunk):
+    """The text of a streamed OpenAI or Mistral chat completion chunk."""
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+
+class Backend():
+    """An LLM chat completion backend.
+
+    Requests go through the shared request scheduler of the backend, which applies the rate limits
+    and retries. Subclasses implement `_complete`, `_stream` and `_acomplete` for their API.
+    """
+
+    name = None
+
+    def __init__(self, config):
+        self.config = config
+        self.scheduler = get_scheduler(config)
+
+    @property
+    def model_name(self):
+        """The name of the LLM model."""
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def _call(self, **attributes):
+        """Trace an LLM call, and record its token usage and latency in the usage store.
+
+        Yields:
+            dict: Filled in by the caller with the `prompt_tokens` and `completion_tokens` of the call,
+                and `estimated` if they are estimates.
+        """
+        start = time.perf_counter()
+        tokens = {}
+        with tracing.span('llm.chat_completion', backend=self.name, model=self.model_name, **attributes) as span:
+            try:
+                yield tokens
+            except Exception:
+                self._record(start, tokens, ok=False)
+                raise
+            span.set(**tokens)
+        self._record(start, tokens)
+
+    def _record(self, start, tokens, ok=True):
+        if not self.config.get('usage_tracking', True):
+            return
+        usage.record(
+            self.name,
+            self.model_name,
+            tokens.get('prompt_tokens'),
+            tokens.get('completion_tokens'),
+            time.perf_counter() - start,
+            estimated=tokens.get('estimated', False),
+            ok=ok
+        )
+
+    def complete(self, messages, response_format_type=None):
+        """Get a chat completion.
+
+        Args:
+            messages (list): The chat messages.
+            response_format_type (str, optional): The response format, e.g. "json_object". Defaults to None,
+                for the default format of the backend.
+
+        Returns:
+            Completion: The completion.
+        """
+        with self._call() as tokens:
+            completion = self.scheduler.run(
+                lambda: self._complete(messages, response_format_type),
+                estimate_message_tokens(messages)
+            )
+            tokens.update(prompt_tokens=completion.prompt_tokens, completion_tokens=completion.completion_tokens)
+        return completion
+
+    def stream(self, messages, response_format_type=None):
+        """Stream a chat completion.
+
+        Args:
+            messages (list): The chat messages.
+            response_format_type (str, optional): The response format. Defaults to None.
+
+        Yields:
+            str: The text of the completion, piece by piece as it arrives.
+        """
+        estimated_tokens = estimate_message_tokens(messages)
+        with self._call(stream=True) as tokens:
+            pieces = []
+            for piece in self.scheduler.run(
+                lambda: self._stream(messages, response_format_type),
+                estimated_tokens,
+                stream=True
+            ):
+                pieces.append(piece)
+                yield piece
+            # Streamed responses don't report their usage, so the token counts are estimates
+            tokens.update(prompt_tokens=estimated_tokens, completion_tokens=estimate_tokens(''.join(pieces)), estimated=True)
+
+    async def acomplete(self, messages, response_format_type=None):
+        """Get a chat completion, asynchronously.
+
+        Args:
+            messages (list): The chat messages.
+            response_format_type (str, optional): The response format. Defaults to None.
+
+        Returns:
+            Completion: The completion.
+        """
+        with self._call() as tokens:
+            completion = await self.scheduler.arun(
+                lambda: self._acomplete(messages, response_format_type),
+                estimate_message_tokens(messages)
+            )
+            tokens.update(prompt_tokens=completion.prompt_tokens, completion_tokens=completion.completion_tokens)
+        return completion
+
+    def _complete(self, messages, response_format_type):
+        raise NotImplementedError
+
+    def _stream(self, messages, response_format_type):
+        raise NotImplementedError
+
+    async def _acomplete(self, messages, response_format_type):
+        raise NotImplementedError
+
+
+class OpenAIBackend(Backend):
+    """The OpenAI chat completions API."""
+
+    name = "OpenAI"
+
+    @property
+    def model_name(self):
+        if not self.config.get("openai_model_name"):
+            raise ValueError("OpenAI model name not set in config")
+        return self.config["openai_model_name"]
+
+    def _arguments(self, messages, response_format_type):
+        arguments = {'model': self.model_name, 'messages': messages}
+        if response_format_type is not None:
+            arguments['response_format'] = {"type": response_format_type}
+        return arguments
+
+    def _complete(self, messages, response_format_type):
+        response = get_client(self.config).chat.completions.create(**self._arguments(messages, response_format_type))
+        return Completion.from_response(response)
+
+    def _stream(self, messages, response_format_type):
+        chunks = get_client(self.config).chat.completions.create(
+            **self._arguments(messages, response_format_type),
+            stream=True
+        )
+        for chunk in chunks:
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+
+    async def _acomplete(self, messages, response_format_type):
+        response = await get_async_client(self.config).chat.completions.create(
+            **self._arguments(messages, response_format_type)
+        )
+        return Completion.from_response(response)
+
+
+class AzureOpenAIBackend(OpenAIBackend):
+    """The Azure OpenAI chat completions API, where the model is chosen by the deployment."""
+
+    name = "Azure OpenAI"
+
+    @property
+    def model_name(self):
+        if not self.config.get("azure_openai_deployment"):
+            raise ValueError("Azure OpenAI deployment not set in config")
+        return self.config["azure_openai_deployment"]
+
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    """Any API compatible with the OpenAI chat completions API, like vLLM, Ollama or LiteLLM, at `base_url`."""
+
+    name = "OpenAI compatible"
+
+    def __init__(self, config):
+        if not config.get('base_url'):
+            raise ValueError("base_url not set in config, required for OpenAI compatible backends")
+        super().__init__(config)
+
+    @property
+    def model_name(self):
+        if not self.config.get("model_name"):
+            raise ValueError("Model name not set in config")
+        return self.config["model_name"]
+
+    def _arguments(self, messages, response_format_type):
+        # Not every compatible server supports JSON mode
+        if not self.config.get('json_mode', True):
+            response_format_type = None
+        return super()._arguments(messages, response_format_type)
+
+
+class MistralBackend(Backend):
+    """The Mistral chat completions API."""
+
+    name = "Mistral"
+
+    @property
+    def model_name(self):
+        return self.config.get("mistral_model_name", "mistral-large-latest")
+
+    def _arguments(self, messages, response_format_type):
+        arguments = {'model': self.model_name, 'messages': messages}
+        if response_format_type is not None:
+            arguments['response_format'] = {"type": response_format_type}
+        return arguments
+
+    def _complete(self, messages, response_format_type):
+        response = get_client(self.config).chat(**self._arguments(messages, response_format_type))
+        return Completion.from_response(response)
+
+    def _stream(self, messages, response_format_type):
+        for chunk in get_client(self.config).chat_stream(**self._arguments(messages, response_format_type)):
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+
+    async def _acomplete(self, messages, response_format_type):
+        response = await get_async_client(self.config).chat(**self._arguments(messages, response_format_type))
+        return Completion.from_response(response)
+
+
+# The model name, when the prompt quotes it in backticks
+MODEL_NAME = re.compile(r'`(\w+)`')
+
+
+class FakeBackend(Backend):
+    """A deterministic local backend, for trying out dbtai and for benchmarks, without network or API key.
+
+    The same messages always give the same response. JSON responses have the fields every dbtai
+    command expects. Responses take `fake_latency_ms` milliseconds (default 0).
+    """
+
+    name = "Fake"
+
+    @property
+    def model_name(self):
+        return self.config.get("fake_model_name", "fake")
+
+    def _content(self, messages, response_format_type):
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        if response_format_type == "json_object":
+            match = MODEL_NAME.search(messages[-1]['content'])
+            return json.dumps({
+                'name': match.group(1) if match else 'model',
+                'description': f'A generated description ({digest}).',
+                'columns': [{'name': 'id', 'description': 'A generated column description.'}],
+                'unit_test': 'unit_tests: []',
+                'explanation': f'A generated explanation ({digest}).',
+                'code': 'select 1 as id',
+                'diff': [],
+            })
+        return f"A generated reply ({digest}). This model selects columns from its upstream models."
+
+    def _completion(self, messages, response_format_type):
+        content = self._content(messages, response_format_type)
+        return Completion(content, estimate_message_tokens(messages), estimate_tokens(content))
+
+    @property
+    def _latency(self):
+        return self.config.get('fake_latency_ms', 0) / 1000
+
+    def _complete(self, messages, response_format_type):
+        time.sleep(self._latency)
+        return self._completion(messages, response_format_type)
+
+    def _stream(self, messages, response_format_type):
+        time.sleep(self._latency)
+        for word in self._content(messages, response_format_type).split(' '):
+            yield word + ' '
+
+    async def _acomplete(self, messages, response_format_type):
+        await asyncio.sleep(self._latency)
+        return self._completion(messages, response_format_type)
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in [OpenAIBackend, AzureOpenAIBackend, OpenAICompatibleBackend, MistralBackend, FakeBackend]
+}
+
+
+def get_backend(config):
+    """Get the backend configured by the `backend` config setting.
+
+    Args:
+        config (dict): The dbtai config.
+
+    Returns:
+        Backend: The backend.
+    """
+    name = config.get('backend', 'OpenAI')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, use one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](config)
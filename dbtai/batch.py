@@ -0,0 +1,112 @@
+import json
+import logging
+from dbtai.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# The tasks that can run as batch jobs, and the response format they request
+BATCH_TASKS = {
+    'doc': 'json_object',
+    'unit': 'json_object',
+}
+
+OPENAI_BATCH_URL = '/v1/chat/completions'
+
+
+def make_custom_id(task, unique_id):
+    """The id of a batch request, which identifies the task and the model, e.g. `doc:model.jaffle_shop.orders`."""
+    return f'{task}:{unique_id}'
+
+
+def parse_custom_id(custom_id):
+    """Split the id of a batch request into the task and the unique id of the model."""
+    task, _, unique_id = custom_id.partition(':')
+    if task not in BATCH_TASKS or not unique_id:
+        raise ValueError(f"Not a dbtai batch request id: {custom_id}")
+    return task, unique_id
+
+
+def make_request(custom_id, messages, backend, model_name, response_format_type):
+    """Render a chat completion request as a line in the batch input format of the backend.
+
+    OpenAI requests carry the endpoint and the model name. Mistral requests only carry the
+    body, as the model is chosen when the batch job is created.
+    """
+    body = {
+        'messages': messages,
+        'response_format': {'type': response_format_type},
+    }
+    if backend == 'Mistral':
+        return {'custom_id': custom_id, 'body': body}
+
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': OPENAI_BATCH_URL,
+        'body': {'model': model_name, **body},
+    }
+
+
+def export_batch(manifest, task, model_names, path):
+    """Write the requests of a task for many models to a JSONL batch input file.
+
+    Args:
+        manifest (Manifest): The manifest, which renders the prompts.
+        task (str): The task, one of `BATCH_TASKS`.
+        model_names (list[str]): The names of the models.
+        path (str): The path of the batch input file.
+
+    Returns:
+        int: The number of requests written.
+    """
+    render_messages = {
+        'doc': manifest.docs_messages,
+        'unit': manifest.unittest_messages,
+    }[task]
+
+    lines = []
+    for model_name in model_names:
+        model = manifest.get_model_from_name(model_name)
+        request = make_request(
+            make_custom_id(task, model['unique_id']),
+            render_messages(model_name),
+            manifest.config['backend'],
+            manifest.backend.model_name,
+            BATCH_TASKS[task],
+        )
+        lines.append(json.dumps(request, ensure_ascii=False))
+
+    atomic_write(path, ''.join(line + '\n' for line in lines))
+    return len(lines)
+
+
+def read_results(path):
+    """Read a batch output file, as downloaded from the OpenAI or Mistral batch API.
+
+    Args:
+        path (str): The path of the batch output file.
+
+    Yields:
+        tuple[str, str | None, str | None]: The request id, and either the content of the
+            response message or a description of the error.
+    """
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            custom_id = result.get('custom_id')
+
+            if result.get('error'):
+                yield custom_id, None, str(result['error'])
+                continue
+
+            response = result.get('response') or {}
+            if response.get('status_code', 200) != 200:
+                yield custom_id, None, f"status code {response['status_code']}: {response.get('body')}"
+                continue
+
+            try:
+                yield custom_id, response['body']['choices'][0]['message']['content'], None
+            except (KeyError, IndexError, TypeError):
+                yield custom_id, None, "no response message in the result"
@@ -0,0 +1,67 @@
+from dbtai.utils import estimate_message_tokens
+
+
+class ChatHistory():
+    """Chat history that stays within a token budget.
+
+    The system prompt (with the model code and upstream docs) and the last `keep_turns`
+    turns are always sent verbatim. When the prompt grows beyond `token_budget`, the
+    older turns are folded into a running summary, so the prompt stops growing with
+    every turn.
+    """
+
+    def __init__(self, system_prompt, token_budget=None, keep_turns=4):
+        """Start a chat history.
+
+        Args:
+            system_prompt (str): The system prompt, always kept verbatim.
+            token_budget (int, optional): The prompt size (in estimated tokens) above which older
+                turns are summarized. Defaults to None, for no limit.
+            keep_turns (int, optional): The number of most recent turns (a user message and a reply)
+                that are never summarized. Defaults to 4.
+        """
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary = None
+        self.turns = []
+        self.transcript = [{"role": "system", "content": system_prompt}]
+
+    def add(self, role, content):
+        """Add a message ("user" or "assistant") to the history."""
+        message = {"role": role, "content": content}
+        self.turns.append(message)
+        self.transcript.append(message)
+
+    def messages(self):
+        """The messages to send to the chat API: the system prompt, the summary of older turns and the recent turns."""
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return messages + self.turns
+
+    def prompt_tokens(self):
+        """The estimated number of tokens of the messages sent to the chat API."""
+        return estimate_message_tokens(self.messages())
+
+    def needs_compaction(self):
+        """Whether the history is over budget, and has turns that can be summarized."""
+        return (
+            self.token_budget is not None
+            and self.prompt_tokens() > self.token_budget
+            and len(self.turns) > 2 * self.keep_turns
+        )
+
+    def compact(self, summarize):
+        """Fold the turns before the last `keep_turns` into the running summary.
+
+        Args:
+            summarize (Callable[[str | None, list], str]): Makes a new summary from the previous
+                summary (or None) and the messages to fold into it.
+        """
+        cut = len(self.turns) - 2 * self.keep_turns
+        if cut <= 0:
+            return
+
+        self.summary = summarize(self.summary, self.turns[:cut])
+        self.turns = self.turns[cut:]
@@ -1,67 +1,99 @@
-import openai
-import os
-import appdirs
-import yaml
 import click
 import datetime
-from mistralai.client import MistralClient
+import logging
+import time
+from dbtai.chat_history import ChatHistory
+from dbtai.backends import get_backend
+from dbtai.streaming import iter_content
+from dbtai.utils import get_config
+from dbtai.templates.prompts import SUMMARIZE_CHAT_PROMPT
+
+logger = logging.getLogger(__name__)
 
 class ModelChatBot:
     def __init__(
             self,
             model_name,
-            system_prompt
+            system_prompt,
+            stream=True,
+            token_budget=None,
+            keep_turns=None
         ):
+        """Start a chat about a dbt model.
 
-        self.config = self._load_config()
+        Args:
+            model_name (str): The name of the model.
+            system_prompt (str): The system prompt, with the model code and upstream docs.
+            stream (bool, optional): Print the replies as they are generated. Defaults to True.
+            token_budget (int, optional): Summarize older turns when the prompt grows beyond this many
+                tokens. Defaults to the `chat_token_budget` config setting, or 8000.
+            keep_turns (int, optional): The number of most recent turns that are always sent verbatim.
+                Defaults to the `chat_keep_turns` config setting, or 4.
+        """
+        self.config = get_config()
         self.model_name = model_name
-        self.chat_history = [
-            {"role": "system", "content": system_prompt}
-        ]
-
-        if self.config["backend"] == "Mistral":
-            self.client = MistralClient(api_key=self.config["api_key"])
-        else:
-            self.client = openai.OpenAI(api_key=self.config["api_key"] or os.getenv("OPENAI_API_KEY"))
+        self.stream = stream
+        self.chat_history = ChatHistory(
+            system_prompt,
+            token_budget=token_budget or self.config.get("chat_token_budget", 8000),
+            keep_turns=keep_turns or self.config.get("chat_keep_turns", 4)
+        )
 
-    def _load_config(self):
-        """Convenience function to load the user config from the config file."""
-        configdir = appdirs.user_data_dir("dbtai", "dbtai")
+        self.backend = get_backend(self.config)
 
-        if os.path.exists(os.path.join(configdir, "config.yaml")):
-            with open(os.path.join(configdir, "config.yaml"), "r") as f:
-                return yaml.load(f, Loader=yaml.FullLoader)
+    def chat_completion(self, messages, stream=False):
+        """Convenience method to call the chat completion endpoint.
+        
+        Args:
+            messages (list): A list of messages to send to the chat API
+            stream (bool, optional): Stream the response. Defaults to False.
 
-        return {'language': 'english', "backend": "OpenAI"}
+        Returns:
+            Completion: The response from the chat API, or an iterator over the text of the response if streaming.
+        """
+        if stream:
+            return self.backend.stream(messages)
+        return self.backend.complete(messages)
 
-    def chat_completion(self, messages):
-        """Convenience method to call the chat completion endpoint.
+    def reply(self, messages):
+        """Get the reply to the chat, printing it as it arrives when streaming.
         
         Args:
             messages (list): A list of messages to send to the chat API
-            response_format_type (str, optional): The response format. Defaults to "json_object".
 
         Returns:
-            openai.ChatCompletion: The response from the chat API
+            str: The full reply.
         """
-        if self.config["backend"] == "OpenAI":
-            return self.client.chat.completions.create(
-                model=self.config["openai_model_name"], 
-                messages=messages
-            )
-        if self.config["backend"] == "Mistral":
-            return self.client.chat.completions.create(
-                model=self.config["mistral_model_name"], 
-                messages=messages
-            )
-        else:
-            return self.client.chat.completions.create(
-                model=self.config["azure_openai_model"], 
-                messages=messages,
-                deployment=self.config["azure_openai_deployment"],
-                endpoint=self.config["azure_endpoint"]
-            )
+        if not self.stream:
+            content = self.chat_completion(messages).content
+            click.echo(click.style(content, fg='blue'))
+            return content
+
+        start = time.perf_counter()
+        pieces = []
+        for piece in iter_content(self.chat_completion(messages, stream=True), start):
+            click.echo(click.style(piece, fg='blue'), nl=False)
+            pieces.append(piece)
+        click.echo()
+        return ''.join(pieces)
+
+
+    def summarize(self, summary, messages):
+        """Fold chat messages into the running summary of the conversation.
+        
+        Args:
+            summary (str | None): The summary so far.
+            messages (list): The messages to add to the summary.
 
+        Returns:
+            str: The new summary.
+        """
+        prompt = SUMMARIZE_CHAT_PROMPT.format(
+            model_name=self.model_name,
+            summary=summary or "(nothing yet)",
+            messages="\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        )
+        return self.chat_completion([{"role": "user", "content": prompt}]).content
 
     def run(self):
         print(f"""
@@ -78,13 +110,20 @@ Type 'quit' or hit Ctrl-C to exit)
             if user_input == r"\save":
                 with open('chat_history.txt', 'a') as f:
                     f.write(f"Chat history for the dbt model: {self.model_name}, on {datetime.datetime.now().isoformat()}\n\n")
-                    for item in self.chat_history:
+                    for item in self.chat_history.transcript:
                         f.write("%s\n" % item)
-                click.echo(click.style(response.choices[0].message.content, fg='blue'))
                 print("Chat history saved to chat_history.txt")
                 continue
 
-            self.chat_history.append({"role": "user", "content": user_input})
-            response = self.chat_completion(self.chat_history)
-            click.echo(click.style(response.choices[0].message.content, fg='blue'))
-            self.chat_history.append({"role": "system", "content": response.choices[0].message.content})
+            if self.chat_history.needs_compaction():
+                self.chat_history.compact(self.summarize)
+                logger.info("Summarized older turns, %d turns kept verbatim", len(self.chat_history.turns) // 2)
+
+            self.chat_history.add("user", user_input)
+            logger.info(
+                "Prompt: ~%d tokens (budget %s)",
+                self.chat_history.prompt_tokens(),
+                self.chat_history.token_budget
+            )
+            content = self.reply(self.chat_history.messages())
+            self.chat_history.add("assistant", content)
@@ -1,47 +1,182 @@
 import click
-import inquirer
 import appdirs
 import json
+import logging
 import os
 import yaml
 from dbtai.templates.prompts import languages, GENERATE_MODEL
-from dbtai.manifest import Manifest
+from dbtai.manifest import Manifest, is_pattern
 from dbtai.chatbot import ModelChatBot
+from dbtai.batch import BATCH_TASKS, export_batch, read_results, parse_custom_id
+from dbtai.response_cache import ResponseCache
+from dbtai.sidecar import Sidecar, SidecarWriter
+from dbtai.utils import atomic_write
+from dbtai import tracing, usage
 
 APPNAME = "dbtai"
 APPAUTHOR = "dbtai"
 
 @click.group()
-def dbtai():
-    pass
+@click.option('--verbose', '-v', is_flag=True, help='Print diagnostics, such as manifest cache hits and timings', default=False)
+@click.option('--cache/--no-cache', default=None, help='Reuse cached LLM responses for identical requests. Defaults to the response_cache config setting')
+@click.option('--server/--no-server', default=True, help='Run commands on a running `dbtai serve` server', show_default=True)
+@click.option('--profile', is_flag=True, help='Time the phases of the command and print a summary. Also enabled by DBTAI_TRACE=1', default=False)
+@click.option('--trace-file', help='Write the timed phases to this Chrome trace JSON file. Also set by DBTAI_TRACE=<file>')
+@click.pass_context
+def dbtai(ctx, verbose, cache, server, profile, trace_file):
+    if verbose:
+        logging.basicConfig(format='%(message)s')
+        logging.getLogger('dbtai').setLevel(logging.INFO)
 
+    trace_env = os.getenv(tracing.TRACE_ENV, '')
+    if trace_env and trace_env not in ('0', '1'):
+        trace_file = trace_file or trace_env
+    if profile or trace_file or trace_env == '1':
+        tracer = tracing.enable()
+        ctx.call_on_close(lambda: _report_trace(tracer, trace_file))
 
-@dbtai.command(help="Generate documentation for a dbt model")
-@click.argument('model', required=True)
+    usage.set_command(ctx.invoked_subcommand, default=True)
+
+    # Options passed on to every Manifest created by the commands
+    ctx.obj = {'response_cache': cache}
+
+
+def _report_trace(tracer, trace_file):
+    click.echo("\n" + tracer.format_summary(), err=True)
+    if trace_file:
+        tracer.write_chrome_trace(trace_file)
+        click.echo(f"Wrote the trace to {trace_file}", err=True)
+
+
+def _written_sidecars(writer, paths, failures):
+    """Check which results made it to their sidecar file, once the sidecar writer is flushed.
+
+    Results whose file could not be written are moved to the failures.
+
+    Args:
+        writer (SidecarWriter): The flushed sidecar writer.
+        paths (dict): The sidecar file of each merged result, by model name or batch request id.
+        failures (dict): The failed results, by the same keys.
+
+    Returns:
+        list: The keys of the results that were written.
+    """
+    written = []
+    for key, path in paths.items():
+        if path in writer.errors:
+            failures[key] = writer.errors[path]
+            click.echo(click.style(f"Failed to write {key} to {path}: {writer.errors[path]}", fg='red'), err=True)
+        else:
+            written.append(key)
+    return written
+
+
+def _manifest(served=False):
+    """Create a Manifest with the global command line options.
+
+    Args:
+        served (bool, optional): The command only uses methods the server runs, so it can use a running
+            `dbtai serve` server instead. Defaults to False.
+    """
+    root = click.get_current_context().find_root()
+
+    # The server has its own cache setting, so an explicit --cache/--no-cache runs locally, and so does profiling
+    if served and root.params['server'] and root.params['cache'] is None and not tracing.enabled():
+        from dbtai.server import RemoteManifest
+
+        remote = RemoteManifest.connect()
+        if remote is not None:
+            return remote
+
+    return Manifest(**root.obj)
+
+
+@dbtai.command(help="Generate documentation for one or more dbt models")
+@click.argument('models', nargs=-1)
+@click.option('--select', '-s', multiple=True, help='Model name or glob pattern (e.g. "stg_*") to document. Can be passed multiple times')
+@click.option('--concurrency', '-c', type=int, help='Maximum number of concurrent LLM requests when documenting several models', default=4, show_default=True)
+@click.option('--incremental', '-i', is_flag=True, help='Only document models whose SQL or upstream columns changed, or that are missing descriptions', default=False)
+@click.option('--dag-order', is_flag=True, help='Document upstream models first, and describe them with their new documentation in the prompts of the models downstream', default=False)
 @click.option('--write', '-w', is_flag=True, help='Write the generated documentation to file', default=False)
 @click.option('--print', '-p', is_flag=True, help='Print the generated documentation', default=False)
-def doc(model, write, print):
-    """Generate documentation for a dbt model.
+def doc(models, select, concurrency, incremental, dag_order, write, print):
+    """Generate documentation for one or more dbt models.
     
     Args:
-        model (str): The name of the dbt model
+        models (tuple[str]): The names of the dbt models
+        select (tuple[str]): Model names or glob patterns to document
+        concurrency (int): Maximum number of concurrent LLM requests
+        incremental (bool): Only document models that changed or are missing descriptions
+        dag_order (bool): Document upstream models first, in waves of one DAG level
         write (bool): Write the generated documentation to file
         print (bool): Print the generated documentation
     """
-    manifest = Manifest()
-    docs_json = manifest.generate_docs(model)
-    docs_yaml = manifest.format_docs(docs_json)
-
-    if write:
-        doc_path = manifest.get_doc_location(model)
-        with open(doc_path, "w") as f:
-            f.write(docs_yaml)
-    else:
-        click.echo(docs_yaml)
+    if not models and not select:
+        raise click.UsageError("Give at least one model, or a --select pattern")
+
+    if len(models) == 1 and not is_pattern(models[0]) and not select and not incremental:
+        manifest = _manifest(served=True)
+        docs_json = manifest.generate_docs(models[0])
+
+        if write:
+            doc_file = Sidecar(manifest.get_doc_location(models[0]))
+            doc_file.merge_docs(docs_json)
+            doc_file.save()
+        else:
+            click.echo(manifest.format_docs(docs_json))
+        return
+
+    manifest = _manifest()
+    model_names = manifest.select_models(list(models) + list(select))
+
+    if incremental:
+        planned, skipped = manifest.plan_incremental_docs(model_names)
+        for model_name, reason in skipped.items():
+            click.echo(f"Skipped {model_name}: {reason}", err=True)
+        for model_name, reason in planned.items():
+            click.echo(f"Documenting {model_name}: {reason}", err=True)
+        click.echo(f"Skipped {len(skipped)} of {len(model_names)} models", err=True)
+        model_names = list(planned)
+
+    failures = {}
+    doc_paths = {}
+    # The sidecar files are written together at the end of the run, also if it is interrupted
+    with SidecarWriter() as writer:
+        for model_name, docs_json, error in manifest.generate_docs_bulk(model_names, concurrency=concurrency, dag_order=dag_order):
+            if error is None and write:
+                try:
+                    doc_path = manifest.get_doc_location(model_name)
+                    writer.merge_docs(doc_path, docs_json)
+                    doc_paths[model_name] = doc_path
+                except Exception as e:
+                    error = e
+
+            if error is not None:
+                failures[model_name] = error
+                click.echo(click.style(f"Failed to document {model_name}: {error}", fg='red'), err=True)
+            elif write:
+                click.echo(f"Generated documentation for {model_name}", err=True)
+            else:
+                click.echo(manifest.format_docs(docs_json))
+
+    documented = _written_sidecars(writer, doc_paths, failures)
+    for model_name in documented:
+        click.echo(f"Documented {model_name} in {doc_paths[model_name]}", err=True)
+
+    # Only written docs count as documented, printed docs may never make it to the project
+    if incremental and documented:
+        manifest.record_documented(documented)
+
+    click.echo(f"\nDocumented {len(model_names) - len(failures)} of {len(model_names)} models", err=True)
+    for model_name, error in failures.items():
+        click.echo(click.style(f"  {model_name}: {error}", fg='red'), err=True)
+    if failures:
+        raise SystemExit(1)
 
 
 @dbtai.command(help="Configure dbtai with preferred language, backend etc.")
 def setup():
+    import inquirer
 
     language_choices = list(languages.keys())
     question = [
@@ -52,18 +187,18 @@ def setup():
                     ),
         inquirer.List('backend',
                         message ="LLM Backend",
-                        choices = ["OpenAI", "Azure OpenAI", "Mistral"],
+                        choices = ["OpenAI", "Azure OpenAI", "Mistral", "OpenAI compatible", "Fake"],
                         default = "OpenAI"
                         ),
         inquirer.List("auth_type",
                     message = "Authentication Type",
                     choices = ["API Key", "Native Authentication (DefaultAzureCredential)"],
                     default = "API Key",
-                    ignore = lambda answers: answers['backend'] in ["OpenAI", "Mistral"]
+                    ignore = lambda answers: answers['backend'] != "Azure OpenAI"
                     ),
         inquirer.Text('api_key',
                     message='API Key',
-                    ignore = lambda answers: answers['auth_type'] == "Native Authentication (DefaultAzureCredential)"
+                    ignore = lambda answers: answers['backend'] == "Fake" or answers.get('auth_type') == "Native Authentication (DefaultAzureCredential)"
                     ),
         inquirer.List("openai_model_name",
                     message = "Model Name",
@@ -77,6 +212,14 @@ def setup():
                     default = "mistral-large-latest",
                     ignore = lambda answers: answers['backend'] != "Mistral"
                     ),
+        inquirer.Text("base_url",
+                    message = "API base URL, e.g. http://localhost:8000/v1",
+                    ignore = lambda answers: answers['backend'] != "OpenAI compatible"
+                    ),
+        inquirer.Text("model_name",
+                    message = "Model Name",
+                    ignore = lambda answers: answers['backend'] != "OpenAI compatible"
+                    ),
         inquirer.Text("azure_endpoint",
                     message = "Azure OpenAI Endpoint",
                     ignore = lambda answers: answers['backend'] != "Azure OpenAI"
@@ -113,24 +256,153 @@ def show():
         click.echo(f.read())
 
 
+@dbtai.command(help="Show the LLM response cache statistics, or clear the cache")
+@click.option('--clear', is_flag=True, help='Remove all cached responses', default=False)
+def cache(clear):
+    response_cache = ResponseCache()
+    if clear:
+        response_cache.clear()
+        click.echo("Response cache cleared")
+        return
+
+    stats = response_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
+    click.echo(f"Cache: {stats['path']}")
+    click.echo(f"Entries: {stats['entries']} ({stats['size'] / 1024 / 1024:.1f} MB)")
+    click.echo(f"Hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {hit_rate}")
+
+
+@dbtai.command(help="Show the token usage and latency of the LLM calls, by command, model and day")
+@click.option('--by', type=click.Choice(sorted(usage.GROUPS)), multiple=True, help='Group by command, model or day. Can be passed multiple times. Defaults to all three')
+@click.option('--days', type=float, help='Only include the calls of the last days', default=30, show_default=True)
+@click.option('--clear', is_flag=True, help='Remove all recorded calls', default=False)
+def stats(by, days, clear):
+    store = usage.UsageStore()
+    if clear:
+        store.clear()
+        click.echo("Usage statistics cleared")
+        return
+
+    click.echo(f"Usage: {store.path}, last {days:g} days")
+    for group in by or ['command', 'model', 'day']:
+        rows = store.stats(by=group, days=days)
+        click.echo(f"\n{group.capitalize():<32} {'Calls':>7} {'Errors':>7} {'Prompt tok':>12} {'Compl. tok':>12} {'p50 ms':>9} {'p95 ms':>9}")
+        for row in rows:
+            click.echo(
+                f"{str(row[group]):<32} {row['calls']:>7} {row['errors']:>7} {row['prompt_tokens']:>12} "
+                f"{row['completion_tokens']:>12} {row['p50_ms']:>9.0f} {row['p95_ms']:>9.0f}"
+            )
+        if not rows:
+            click.echo("(no calls)")
+
+
 @dbtai.command(help="Create a dbt unit test for a given model")
 @click.argument('model', required=True)
 @click.argument('instructions', required=False)
 @click.option('--write', '-w', is_flag=True, help='Write the generated test to file', default=False)
 def unit(model, instructions, write):
-    manifest = Manifest()
+    manifest = _manifest(served=True)
     test, explanation = manifest.generate_unittest(model, instructions)
 
     if write:
-        doc_path = manifest.get_doc_location(model)
-    # Append test to file, fail if file not exists
-        with open(doc_path, "a") as f:
-            f.write("\n\n")
-            f.write(test)
+        doc_file = Sidecar(manifest.get_doc_location(model))
+        doc_file.merge_unit_tests(test)
+        doc_file.save()
     else:
         click.echo(test)
         click.echo(explanation)
 
+@dbtai.group(help="Run documentation and unit tests as provider batch jobs")
+def batch():
+    pass
+
+
+@batch.command("export", help="Write the LLM requests for many models to a JSONL batch input file")
+@click.argument("task", type=click.Choice(sorted(BATCH_TASKS)))
+@click.argument("models", nargs=-1)
+@click.option('--select', '-s', multiple=True, help='Model names or glob patterns to include. Can be passed multiple times')
+@click.option('--output', '-o', help='The batch input file', default='dbtai_batch.jsonl', show_default=True)
+def batch_export(task, models, select, output):
+    """Render the prompts of a task for the selected models into a batch input file.
+    
+    Args:
+        task (str): The task, `doc` or `unit`
+        models (tuple[str]): The names of the dbt models
+        select (tuple[str]): Model names or glob patterns to include
+        output (str): The path of the batch input file
+    """
+    if not models and not select:
+        raise click.UsageError("Give at least one model, or a --select pattern")
+
+    manifest = _manifest()
+    model_names = manifest.select_models(list(models) + list(select))
+    count = export_batch(manifest, task, model_names, output)
+    click.echo(f"Wrote {count} {task} requests to {output}", err=True)
+
+
+@batch.command("import", help="Read a batch output file and write or print the results")
+@click.argument("results", type=click.Path(exists=True, dir_okay=False))
+@click.option('--write', '-w', is_flag=True, help='Write the results to the sidecar files', default=False)
+def batch_import(results, write):
+    """Parse the results of a batch job, like the results of the `doc` and `unit` commands.
+    
+    Args:
+        results (str): The path of the batch output file
+        write (bool): Write the documentation and unit tests to the sidecar files
+    """
+    manifest = _manifest()
+    failures = {}
+    doc_paths = {}
+    imported = {}
+    total = 0
+
+    # Each sidecar file is loaded once and written once, with all the results for its models
+    with SidecarWriter() as writer:
+        for custom_id, content, error in read_results(results):
+            total += 1
+            try:
+                if error is not None:
+                    raise RuntimeError(error)
+                task, unique_id = parse_custom_id(custom_id)
+                # Checks the model is in the manifest, the unique_id is used for every lookup
+                manifest.get_model_from_name(unique_id)
+
+                if task == 'doc':
+                    output = manifest.parse_docs(content)
+                else:
+                    output, explanation = manifest.parse_unittest(content)
+
+                if not write:
+                    click.echo(manifest.format_docs(output) if task == 'doc' else output)
+                    continue
+
+                doc_path = manifest.get_doc_location(unique_id)
+                if task == 'doc':
+                    writer.merge_docs(doc_path, output)
+                else:
+                    writer.merge_unit_tests(doc_path, output)
+                doc_paths[custom_id] = doc_path
+                imported[custom_id] = (task, unique_id)
+            except Exception as e:
+                failures[custom_id] = e
+                click.echo(click.style(f"Failed to import {custom_id}: {e}", fg='red'), err=True)
+
+    documented = []
+    for custom_id in _written_sidecars(writer, doc_paths, failures):
+        task, unique_id = imported[custom_id]
+        if task == 'doc':
+            documented.append(unique_id)
+        click.echo(f"Wrote {task} for {unique_id} to {doc_paths[custom_id]}", err=True)
+
+    if documented:
+        manifest.record_documented(documented)
+
+    click.echo(f"\nImported {total - len(failures)} of {total} results", err=True)
+    if failures:
+        raise SystemExit(1)
+
+
 @dbtai.command(help="Not yet implemented. Write dbt constraints given the uniqueness tests in the model")
 def constraints():
     raise NotImplementedError("Not yet implemented")
@@ -141,7 +413,7 @@ def constraints():
 @click.argument("description", required=True)
 @click.option("--input", "-i", required=False, help="Name of Input model. Can be passed multiple times to reference several models", multiple=True)
 def gen(model_name, description, input):
-    manifest = Manifest()
+    manifest = _manifest()
     model = manifest.generate_model(model_name, description, input)
     click.echo(model["code"])
     click.echo(f"\n\n{model['explanation']}")
@@ -152,7 +424,7 @@ def gen(model_name, description, input):
 @click.argument("description", required=True)
 @click.option("--diff", "-d", is_flag=True, help="Show the diff between existing and suggested code", default=False)
 def fix(model_name, description, diff):
-    manifest = Manifest()
+    manifest = _manifest()
 
     model = manifest.fix(model_name, description)
 
@@ -168,38 +440,127 @@ def fix(model_name, description, diff):
         click.echo(f"\n\n{model['explanation']}")
 
 
-@dbtai.command(help="Fluff the code")
-@click.argument("model", required=True)
+@dbtai.command(help="Fluff the code of one or more models")
+@click.argument("models", nargs=-1)
+@click.option("--select", "-s", multiple=True, help='Model name or glob pattern (e.g. "stg_*") to fluff. Can be passed multiple times')
+@click.option("--path", multiple=True, help="Fluff all models under this directory. Can be passed multiple times")
+@click.option("--workers", "-j", type=int, help="Number of worker processes when fluffing several models. Defaults to the number of cores")
+@click.option("--incremental/--full", default=True, help="When fluffing several models, skip models whose code hasn't changed since the last run", show_default=True)
 @click.option("--write", "-w", is_flag=True, help="Write the fluffed code to file", default=False)
 @click.option("--rewrite", is_flag=True, help="Write the fluffed code to file and overwrite the original", default=False)
-def fluff(model, write, rewrite):
-    manifest = Manifest()
-    result = manifest.fluff(model, rewrite=rewrite)
-
-    if not write:
-        click.echo(result['code'])
-    else:
-        write_path = manifest.get_model_location(model)
-        with open(write_path, "w") as f:
-            f.write(result['code'])
+def fluff(models, select, path, workers, incremental, write, rewrite):
+    if not models and not select and not path:
+        raise click.UsageError("Give at least one model, or a --select pattern or --path")
+
+    manifest = _manifest()
+
+    if len(models) == 1 and not is_pattern(models[0]) and not select and not path:
+        model = models[0]
+        result = manifest.fluff(model, rewrite=rewrite)
+
+        if not write:
+            click.echo(result['code'])
+        else:
+            write_path = manifest.get_model_location(model)
+            atomic_write(write_path, result['code'])
+        return
+
+    if rewrite:
+        raise click.UsageError("--rewrite only works with a single model")
+
+    model_names = manifest.select_models(list(models) + list(select), paths=path)
+    changed = []
+    failures = {}
+    skipped = 0
+    results = manifest.fluff_bulk(model_names, write=write, workers=workers, incremental=incremental)
+    for model_name, result, error in results:
+        if result is not None and result['skipped']:
+            skipped += 1
+
+        if error is not None:
+            failures[model_name] = error
+            click.echo(click.style(f"Failed to fluff {model_name}: {error}", fg='red'), err=True)
+        elif result['changed']:
+            changed.append(model_name)
+            click.echo(f"{'Fixed' if write else 'Would fix'} {model_name}", err=True)
+
+    unchanged = len(model_names) - len(changed) - len(failures)
+    click.echo(
+        f"\nFluffed {len(model_names)} models: {len(changed)} {'fixed' if write else 'to fix'}, "
+        f"{unchanged} already clean, {len(failures)} failed ({skipped} unchanged since the last run)",
+        err=True
+    )
+    for model_name, error in failures.items():
+        click.echo(click.style(f"  {model_name}: {error}", fg='red'), err=True)
+    if failures:
+        raise SystemExit(1)
+
+
+@dbtai.command(help="Keep the manifest and LLM client loaded in a local server, used by the other commands")
+@click.option('--port', type=int, default=0, help='The port to listen on on localhost. Defaults to any free port')
+@click.option('--status', is_flag=True, help='Show the status of the running server', default=False)
+@click.option('--stop', is_flag=True, help='Stop the running server', default=False)
+def serve(port, status, stop):
+    """Serve the manifest to the `doc`, `unit` and `explain` commands, reloading it when dbt rewrites it.
+    
+    Args:
+        port (int): The port to listen on
+        status (bool): Show the status of the running server
+        stop (bool): Stop the running server
+    """
+    from dbtai.server import RemoteManifest, serve as run_server
+
+    remote = RemoteManifest.connect()
+    if status or stop:
+        if remote is None:
+            raise click.ClickException("No dbtai server is running")
+        if stop:
+            remote.shutdown()
+            click.echo("Stopped the dbtai server", err=True)
+        else:
+            click.echo(yaml.dump(remote.status(), sort_keys=False))
+        return
+
+    if remote is not None:
+        raise click.ClickException(f"A dbtai server is already running on port {remote.port}")
+
+    obj = click.get_current_context().find_root().obj
+    run_server(
+        lambda: Manifest(**obj),
+        'target/manifest.json',
+        port=port,
+        ready=lambda server: click.echo(f"Serving dbtai on http://127.0.0.1:{server.server_address[1]}, stop with Ctrl-C or `dbtai serve --stop`", err=True)
+    )
 
 
 @dbtai.command(help="Explain the dbt code")
 @click.argument("model", required=True)
-def explain(model):
-    manifest = Manifest()
-    result = manifest.explain(model)
-    click.echo(result)
+@click.option("--stream/--no-stream", default=True, help="Print the explanation as it is generated", show_default=True)
+def explain(model, stream):
+    manifest = _manifest(served=True)
+    if not stream:
+        click.echo(manifest.explain(model))
+        return
+
+    for piece in manifest.explain(model, stream=True):
+        click.echo(piece, nl=False)
+    click.echo()
 
 
 @dbtai.command(help="Chat with a dbt model")
 @click.argument("model", required=True)
-def chat(model):
-    manifest = Manifest()
+@click.option("--stream/--no-stream", default=True, help="Print the replies as they are generated", show_default=True)
+@click.option("--token-budget", type=int, help="Summarize older turns when the prompt grows beyond this many tokens. Defaults to the chat_token_budget config setting, or 8000")
+@click.option("--keep-turns", type=int, help="Number of recent turns always sent verbatim. Defaults to the chat_keep_turns config setting, or 4")
+def chat(model, stream, token_budget, keep_turns):
+    manifest = _manifest()
     chatbot_prompt = manifest.generate_chatbot_prompt(model)
     chatbot = ModelChatBot(
         model_name=model,
-        system_prompt=chatbot_prompt
+        system_prompt=chatbot_prompt,
+        stream=stream,
+        token_budget=token_budget,
+        keep_turns=keep_turns
     )
     chatbot.run()
 
@@ -223,6 +584,6 @@ def hello():
 @click.argument("description", required=True)
 def test(model, description):
     raise NotImplementedError("Not yet implemented")
-    manifest = Manifest()
+    manifest = _manifest()
     test = manifest.generate_test(model, description)
     click.echo(test)
\ No newline at end of file
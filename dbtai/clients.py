@@ -0,0 +1,248 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Connection pool and timeout settings, overridable in the config file
+HTTP_DEFAULTS = {
+    'http_max_connections': 20,
+    'http_max_keepalive_connections': 20,
+    'http_keepalive_expiry': 60,
+    'http_timeout': 120,
+    'http_connect_timeout': 10,
+}
+
+AZURE_API_VERSION = '2024-02-01'
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_transports = {}
+_lock = threading.Lock()
+
+
+class _PoolStats():
+    """Counts the requests a transport sends and the connections its pool opens."""
+
+    def _init_stats(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self._seen = weakref.WeakSet()
+        self._stats_lock = threading.Lock()
+
+    def _count_request(self):
+        with self._stats_lock:
+            self.requests += 1
+            for connection in self._pool.connections:
+                if connection not in self._seen:
+                    self._seen.add(connection)
+                    self.connections_opened += 1
+
+    def stats(self):
+        connections = list(self._pool.connections)
+        return {
+            'requests': self.requests,
+            'connections_opened': self.connections_opened,
+            'open': len(connections),
+            'idle': sum(1 for connection in connections if connection.is_idle()),
+        }
+
+
+def _make_transport(limits, retries=0, asynchronous=False):
+    """Make an httpx transport that counts the requests it sends and the connections it opens."""
+    import httpx
+
+    if asynchronous:
+        class PooledTransport(_PoolStats, httpx.AsyncHTTPTransport):
+
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                self._init_stats()
+
+            async def handle_async_request(self, request):
+                response = await super().handle_async_request(request)
+                self._count_request()
+                return response
+    else:
+        class PooledTransport(_PoolStats, httpx.HTTPTransport):
+
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                self._init_stats()
+
+            def handle_request(self, request):
+                response = super().handle_request(request)
+                self._count_request()
+                return response
+
+    return PooledTransport(retries=retries, limits=limits)
+
+
+def _http_client(config, retries=0, asynchronous=False):
+    """Make a keep-alive, connection pooled httpx client with the pool and timeout settings of the config."""
+    import httpx
+
+    settings = {**HTTP_DEFAULTS, **{key: config[key] for key in HTTP_DEFAULTS if config.get(key) is not None}}
+
+    limits = httpx.Limits(
+        max_connections=settings['http_max_connections'],
+        max_keepalive_connections=settings['http_max_keepalive_connections'],
+        keepalive_expiry=settings['http_keepalive_expiry'],
+    )
+    transport = _make_transport(limits, retries, asynchronous)
+    client_class = httpx.AsyncClient if asynchronous else httpx.Client
+    client = client_class(
+        transport=transport,
+        timeout=httpx.Timeout(settings['http_timeout'], connect=settings['http_connect_timeout']),
+        follow_redirects=True,
+    )
+    return client, transport
+
+
+def _client_key(config):
+    return (
+        config.get('backend', 'OpenAI'),
+        config.get('api_key'),
+        config.get('base_url'),
+        *(config.get(setting) for setting in HTTP_DEFAULTS)
+    )
+
+
+def get_client(config):
+    """Get the shared client of the configured backend, creating it on first use.
+
+    The client is shared by everything in the process that talks to the same backend with the same
+    credentials, so concurrent and consecutive requests reuse pooled keep-alive connections instead
+    of opening a new connection (and TLS session) each.
+
+    Args:
+        config (dict): The dbtai config.
+
+    Returns:
+        openai.OpenAI | openai.AzureOpenAI | mistralai.client.MistralClient: The client.
+    """
+    key = _client_key(config)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _make_client(config)
+        return _clients[key]
+
+
+def get_async_client(config):
+    """Get the shared asynchronous client of the configured backend for the running event loop.
+
+    Asynchronous clients can't be shared between event loops, so each event loop gets its own,
+    which is shared by all requests on that loop.
+
+    Args:
+        config (dict): The dbtai config.
+
+    Returns:
+        openai.AsyncOpenAI | openai.AsyncAzureOpenAI | mistralai.async_client.MistralAsyncClient: The client.
+    """
+    loop = asyncio.get_running_loop()
+    key = _client_key(config)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = _make_client(config, asynchronous=True)
+        return clients[key]
+
+
+async def close_async_clients():
+    """Close the asynchronous clients of the running event loop, before the loop is closed."""
+    with _lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def _make_client(config, asynchronous=False):
+    backend = config.get('backend', 'OpenAI')
+
+    # The backend SDKs are slow to import, so only import the one that is used
+    if backend == "Mistral":
+        if asynchronous:
+            from mistralai.async_client import MistralAsyncClient as MistralClient
+        else:
+            from mistralai.client import MistralClient
+
+        kwargs = {'endpoint': config['base_url']} if config.get('base_url') else {}
+        client = MistralClient(api_key=config.get('api_key'), **kwargs)
+        # Swap the SDK's own httpx client for a pooled one, keeping its retries of failed connections
+        client._client, transport = _http_client(config, client._max_retries, asynchronous)
+    elif backend == "Azure OpenAI":
+        import openai
+
+        kwargs = {}
+        if (config.get('auth_type') or '').startswith('Native'):
+            try:
+                from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+            except ImportError as e:
+                raise ImportError(
+                    "Native Authentication needs the azure-identity package, install it with "
+                    "`pip install azure-identity` (or the `dbtai[azure]` extra)"
+                ) from e
+
+            kwargs['azure_ad_token_provider'] = get_bearer_token_provider(
+                DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+            )
+        else:
+            kwargs['api_key'] = config.get('api_key') or os.getenv("AZURE_OPENAI_API_KEY")
+
+        http_client, transport = _http_client(config, asynchronous=asynchronous)
+        client_class = openai.AsyncAzureOpenAI if asynchronous else openai.AzureOpenAI
+        client = client_class(
+            azure_endpoint=config['azure_endpoint'],
+            api_version=config.get('azure_api_version', AZURE_API_VERSION),
+            http_client=http_client,
+            **kwargs
+        )
+    else:
+        import openai
+
+        api_key = config.get('api_key') or os.getenv("OPENAI_API_KEY")
+        if backend == "OpenAI compatible" and not api_key:
+            # Local OpenAI compatible servers often need no key, but the SDK requires one
+            api_key = 'none'
+
+        http_client, transport = _http_client(config, asynchronous=asynchronous)
+        client_class = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+        client = client_class(
+            api_key=api_key,
+            base_url=config.get('base_url'),
+            http_client=http_client,
+        )
+
+    # Failed requests are retried by the request scheduler, not the SDK. The Mistral SDK counts the
+    # first attempt as one, so 1 turns its retries off.
+    if backend == "Mistral":
+        client._max_retries = 1
+    else:
+        client.max_retries = 0
+
+    _transports[f"{backend} (async)" if asynchronous else backend] = transport
+    return client
+
+
+def pool_stats():
+    """Get the connection pool statistics of the clients created so far.
+
+    Returns:
+        dict: Per backend, the number of requests sent, connections opened, and connections open and idle now.
+    """
+    return {backend: transport.stats() for backend, transport in _transports.items()}
+
+
+def _log_pool_stats():
+    for backend, stats in pool_stats().items():
+        logger.info(
+            "%s connection pool: %d requests over %d connections (%d open, %d idle)",
+            backend, stats['requests'], stats['connections_opened'], stats['open'], stats['idle']
+        )
+
+
+atexit.register(_log_pool_stats)
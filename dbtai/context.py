@@ -0,0 +1,130 @@
+from dbtai.utils import estimate_tokens
+
+# Descriptions are cut to this many characters when the full context is over budget
+TRUNCATED_DESCRIPTION_LENGTH = 80
+
+# Descriptions of ancestors further upstream than the direct parents are always cut to this many characters
+ANCESTOR_DESCRIPTION_LENGTH = 120
+
+
+def _truncate(text, length):
+    if length is None or len(text) <= length:
+        return text
+    return text[:length].rstrip() + '...'
+
+
+def _render_model(model, columns, description_length=None, omitted=0):
+    """Render the documentation of an upstream model, for the given subset of its columns."""
+    description = _truncate(model.get("description") or "(no description)", description_length)
+    column_descriptions = '\n'.join(
+        [f'* {column}: {_truncate(content.get("description") or "(no description)", description_length)}'
+        for column, content in columns]
+        ) or '(no columns defined)'
+    if omitted:
+        column_descriptions += f'\n* ... and {omitted} more columns not used by the model'
+    return f'{model["name"]}: {description}\nColumns:\n{column_descriptions}'
+
+
+def _render_summary(model, referenced_columns):
+    """Render a one paragraph summary of an upstream model."""
+    description = _truncate(model.get("description") or "(no description)", TRUNCATED_DESCRIPTION_LENGTH)
+    used = ', '.join(column for column, _ in referenced_columns) or 'none identified'
+    return f'{model["name"]}: {description}\n{len(model.get("columns") or {})} columns, used by the model: {used}'
+
+
+def _render_ancestor(distance, model):
+    """Render a one line summary of a model further upstream."""
+    description = _truncate(model.get("description") or "(no description)", ANCESTOR_DESCRIPTION_LENGTH)
+    return f'* {model["name"]} ({distance} levels up, {len(model.get("columns") or {})} columns): {description}'
+
+
+def compile_lineage_context(ancestors, token_budget=None):
+    """Compile one line summaries of the models further upstream than the direct parents, within a token budget.
+
+    The ancestors furthest upstream are dropped first when the summaries are over budget.
+
+    Args:
+        ancestors (list[tuple[int, dict]]): The distance and the node of each ancestor, nearest first.
+        token_budget (int, optional): The maximum estimated number of tokens. Defaults to None, for no limit.
+
+    Returns:
+        str: A markdown list, or an empty string if there are no ancestors or none of them fit.
+    """
+    lines = [_render_ancestor(distance, model) for distance, model in ancestors]
+    if token_budget is not None:
+        tokens = 0
+        for index, line in enumerate(lines):
+            tokens += estimate_tokens(line) + 1
+            if tokens > token_budget:
+                omitted = len(lines) - index
+                lines = lines[:index] + [f'* ... and {omitted} more models further upstream'] if index else []
+                break
+    return '\n'.join(lines)
+
+
+def compile_upstream_context(upstream_models, is_referenced, token_budget=None, prune=False):
+    """Compile the documentation of upstream models into markdown, within a token budget.
+
+    The full documentation is used if it fits. Otherwise the context degrades step by step
+    until it fits: first descriptions are truncated, then the columns the model does not
+    reference are dropped, and finally whole models are summarized in a single paragraph,
+    starting with the models with the fewest referenced columns.
+
+    Args:
+        upstream_models (list[dict]): The upstream models (manifest nodes).
+        is_referenced (Callable[[dict, str], bool]): Whether the model uses a column of an upstream model.
+        token_budget (int, optional): The maximum estimated number of tokens. Defaults to None, for no limit.
+        prune (bool, optional): Always drop the columns the model does not reference. Defaults to False.
+
+    Returns:
+        str: A markdown string with the documentation for the upstream models.
+    """
+    columns = []
+    referenced = []
+    for model in upstream_models:
+        model_columns = list((model.get('columns') or {}).items())
+        columns.append(model_columns)
+        referenced.append([(column, content) for column, content in model_columns if is_referenced(model, column)])
+
+    def render(sections):
+        return '\n\n'.join(sections)
+
+    def fits(text):
+        return token_budget is None or estimate_tokens(text) <= token_budget
+
+    if prune:
+        # 1. Only the referenced columns, with full descriptions
+        sections = [
+            _render_model(model, model_referenced, omitted=len(model_columns) - len(model_referenced))
+            for model, model_columns, model_referenced in zip(upstream_models, columns, referenced)
+        ]
+    else:
+        # 1. The full documentation
+        sections = [_render_model(model, model_columns) for model, model_columns in zip(upstream_models, columns)]
+    if fits(render(sections)):
+        return render(sections)
+
+    # 2. Truncated descriptions
+    if not prune:
+        sections = [
+            _render_model(model, model_columns, TRUNCATED_DESCRIPTION_LENGTH)
+            for model, model_columns in zip(upstream_models, columns)
+        ]
+        if fits(render(sections)):
+            return render(sections)
+
+    # 3. Only the referenced columns, with truncated descriptions
+    sections = [
+        _render_model(model, model_referenced, TRUNCATED_DESCRIPTION_LENGTH, omitted=len(model_columns) - len(model_referenced))
+        for model, model_columns, model_referenced in zip(upstream_models, columns, referenced)
+    ]
+    if fits(render(sections)):
+        return render(sections)
+
+    # 4. Summarize whole models, the least used ones first, until it fits
+    for index in sorted(range(len(upstream_models)), key=lambda index: len(referenced[index])):
+        sections[index] = _render_summary(upstream_models[index], referenced[index])
+        if fits(render(sections)):
+            break
+
+    return render(sections)
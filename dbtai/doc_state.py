@@ -0,0 +1,43 @@
+import hashlib
+import json
+from dbtai.utils import JsonState
+
+STATE_FILENAME = 'dbtai_doc_state.json'
+
+# Bump when the layout of the state file changes
+STATE_VERSION = 1
+
+
+def upstream_columns_checksum(upstream_models):
+    """Checksum the set of columns of the upstream models, to detect upstream changes that affect the docs."""
+    columns = sorted(
+        [model.get('unique_id') or model['name'], sorted(model.get('columns') or {})]
+        for model in upstream_models
+    )
+    return hashlib.sha256(json.dumps(columns).encode('utf-8')).hexdigest()
+
+
+def missing_descriptions(model):
+    """Whether a model lacks a description, or has no documented columns or columns without a description."""
+    columns = model.get('columns') or {}
+    return (
+        not model.get('description')
+        or not columns
+        or any(not column.get('description') for column in columns.values())
+    )
+
+
+class DocState(JsonState):
+    """The model checksum and upstream columns each model was last documented for."""
+
+    description = 'documentation state'
+
+    def __init__(self, path):
+        super().__init__(path, {'version': STATE_VERSION})
+
+    def get(self, unique_id):
+        """Get the `checksum` and `upstream` columns checksum a model was last documented for."""
+        return self.entries.get(unique_id)
+
+    def record(self, unique_id, checksum, upstream):
+        self.entries[unique_id] = {'checksum': checksum, 'upstream': upstream}
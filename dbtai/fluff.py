@@ -0,0 +1,135 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import PackageNotFoundError, version
+from dbtai.utils import JsonState, atomic_write
+
+STATE_FILENAME = 'dbtai_fluff_state.json'
+
+# Bump when the layout of the state file changes
+STATE_VERSION = 3
+
+
+def code_checksum(code):
+    """The sha256 checksum of model code, the same checksum dbt records for the node in the manifest."""
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def _sqlfluff_version():
+    try:
+        return version('sqlfluff')
+    except PackageNotFoundError:
+        return None
+
+
+class FluffState(JsonState):
+    """The last fluff result for each model file, and the checksum of the code it is for, so unchanged
+    models can be skipped. Only the latest result for each file is kept, so the state doesn't grow as
+    the code changes.
+
+    The state is discarded when the sqlfluff version or dialect changes, since they change the results.
+    """
+
+    description = 'fluff state'
+
+    def __init__(self, path, dialect):
+        """Load the fluff state.
+
+        Args:
+            path (str): The path to the state file.
+            dialect (str): The sqlfluff dialect used for fixing.
+        """
+        super().__init__(path, {'version': STATE_VERSION, 'dialect': dialect, 'sqlfluff': _sqlfluff_version()})
+
+    def get(self, path, code_checksum):
+        """Get the last result for a model file, if it was for the code with the given checksum:
+        whether the code was `clean`, and the fixed `code` if not."""
+        entry = self.entries.get(path)
+        if entry is None or entry['checksum'] != code_checksum:
+            return None
+        return entry
+
+    def record(self, path, result, written=False):
+        """Record the result of fixing the code of a model file, replacing the result for earlier code.
+
+        Args:
+            path (str): The path to the model file.
+            result (dict): The result of `fluff_file`.
+            written (bool, optional): The fixed code was written to the file, so the file now holds
+                clean code. Defaults to False.
+        """
+        if written and result['changed']:
+            self.record_clean(path, result['code'])
+            return
+        self.entries[path] = {
+            'checksum': result['checksum'],
+            'clean': not result['changed'],
+            'code': result['code'] if result['changed'] else None,
+        }
+
+    def record_clean(self, path, code):
+        """Record that the code of a model file needs no fixing, e.g. after the fixed code was written to it."""
+        self.entries[path] = {'checksum': code_checksum(code), 'clean': True, 'code': None}
+
+
+def fluff_file(path, dialect='ansi', write=False):
+    """Run `sqlfluff fix` on a model file.
+
+    This runs in a worker process, so it only takes and returns plain data.
+
+    Args:
+        path (str): The path to the model file.
+        dialect (str, optional): The sqlfluff dialect. Defaults to 'ansi'.
+        write (bool, optional): Write the fixed code back to the file (atomically). Defaults to False.
+
+    Returns:
+        dict: The fixed `code`, whether it `changed`, and the `checksum` of the original code.
+    """
+    import sqlfluff
+
+    with open(path, 'r') as f:
+        code = f.read()
+
+    fixed = sqlfluff.fix(code, dialect=dialect)
+    changed = fixed != code
+
+    if write and changed:
+        atomic_write(path, fixed)
+
+    return {"code": fixed, "changed": changed, "checksum": code_checksum(code)}
+
+
+def fluff_files(paths, dialect='ansi', write=False, workers=None):
+    """Run `sqlfluff fix` on many model files in parallel, on a pool of processes.
+
+    sqlfluff is CPU bound pure Python, so processes rather than threads are used.
+    Results are yielded as they complete, and a failing file does not stop the others.
+
+    Args:
+        paths (dict): The model file paths to fix, keyed by model name.
+        dialect (str, optional): The sqlfluff dialect. Defaults to 'ansi'.
+        write (bool, optional): Write the fixed code back to the files. Defaults to False.
+        workers (int, optional): The number of worker processes. Defaults to the number of available cores.
+
+    Yields:
+        tuple[str, dict | None, Exception | None]: The model name, and either the result of
+            `fluff_file` or the error raised while fixing it.
+    """
+    if not paths:
+        return
+
+    if workers is None:
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = max(1, min(workers, len(paths)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fluff_file, path, dialect, write): model_name
+            for model_name, path in paths.items()
+        }
+        for future in as_completed(futures):
+            model_name = futures[future]
+            try:
+                yield model_name, future.result(), None
+            except Exception as e:
+                yield model_name, None, e
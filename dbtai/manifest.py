@@ -1,5 +1,25 @@
 import os
+import asyncio
 import json
+import functools
+import logging
+import queue
+import threading
+import time
+from fnmatch import fnmatch
+from dbtai.context import compile_lineage_context, compile_upstream_context
+from dbtai import doc_state
+from dbtai import tracing
+from dbtai.manifest_cache import get_cache_path, load_cache, manifest_fingerprint, save_cache
+from dbtai.manifest_parser import select_sections, stream_manifest
+from dbtai.response_cache import ResponseCache
+from dbtai import sql_usage
+from dbtai.graph import DagIndex
+from dbtai.fluff import STATE_FILENAME as FLUFF_STATE_FILENAME, FluffState, code_checksum, fluff_files
+from dbtai.streaming import iter_content
+from dbtai.backends import get_backend
+from dbtai.clients import close_async_clients
+from dbtai.utils import atomic_write, estimate_tokens, get_config, target_path
 from dbtai.templates.prompts import (
     languages, 
     UNITTEST, 
@@ -8,26 +28,35 @@ from dbtai.templates.prompts import (
     FIX_MODEL_PROMPT,
     FIX_CODE_PROMPT
 )
-import appdirs
-import yaml
-from openai import OpenAI
-from mistralai.client import MistralClient
-from ruamel.yaml import YAML
-from ruamel.yaml.comments import CommentedMap
-import io
-import difflib
-import sqlfluff
+
+logger = logging.getLogger(__name__)
+
+
+def is_pattern(model_name):
+    """Whether a model name is a glob pattern, like `stg_*`, rather than a single model."""
+    return any(char in model_name for char in '*?[')
+
 
 class Manifest():
 
+    @tracing.traced('manifest.init')
     def __init__(
         self,
-        manifest_path = 'target/manifest.json'
+        manifest_path = 'target/manifest.json',
+        streaming = None,
+        cache = None,
+        response_cache = None
     ):
-        """Initialize the manifest object by loading the manifest, the user config and the OpenAI client.
+        """Initialize the manifest object by loading the manifest, the user config and the LLM backend.
         
         Args:
             manifest_path (str, optional): The path to the manifest. Defaults to 'target/manifest.json'.
+            streaming (bool, optional): Incrementally parse the manifest, keeping only the nodes, sources and
+                fields dbtai uses. Defaults to the `streaming_manifest` config setting, or False.
+            cache (bool, optional): Keep a cache of the parsed manifest in the dbtai data dir, invalidated
+                when the manifest changes. Defaults to the `manifest_cache` config setting, or True.
+            response_cache (bool, optional): Reuse LLM responses for identical requests from an on-disk cache.
+                Defaults to the `response_cache` config setting, or False.
         """
         self.manifest_path = manifest_path
 
@@ -37,91 +66,270 @@ class Manifest():
         if not os.path.exists(self.manifest_path):
             raise FileNotFoundError(f"dbt manifest not found. Have you run a dbt command such as `dbt run` or `dbt compile`?")
         
-        with open(self.manifest_path, 'r') as file:
-            self.manifest = json.load(file)
-
-        self.config = self._load_config()
-        if self.config['backend'] == "Mistral":
-            self.client = self._make_mistral_client()
-        elif self.config['backend'] == "Azure OpenAI":
-            raise NotImplementedError("Azure OpenAI not yet implemented")
-        else:
-            self.client = self._make_openai_client()
-    def _make_openai_client(self):
-        """Make the OpenAI client with auth."""
+        self.config = get_config()
+
+        if streaming is None:
+            streaming = self.config.get('streaming_manifest', False)
+        if cache is None:
+            cache = self.config.get('manifest_cache', True)
+
+        start = time.perf_counter()
+        with tracing.span('manifest.load', streaming=streaming, cache=cache):
+            self._load_manifest(streaming, cache)
+        logger.info("Loaded the manifest in %.0f ms", (time.perf_counter() - start) * 1000)
+
+        self.sql_usage_cache = sql_usage.SqlUsageCache(sql_usage.get_cache_path(self.manifest_path))
+
+        if response_cache is None:
+            response_cache = self.config.get('response_cache', False)
+        self.response_cache = None
+        if response_cache:
+            self.response_cache = ResponseCache(
+                max_size_mb=self.config.get('response_cache_max_size_mb', 100),
+                max_age_days=self.config.get('response_cache_max_age_days', 30)
+            )
 
-        if self.config['backend'] == "OpenAI":
-            api_key = self.config['api_key'] or os.getenv("OPENAI_API_KEY")
-            return OpenAI(api_key=api_key)
-        else:
-            raise NotImplementedError("Azure OpenAI not yet implemented")
+        self.backend = get_backend(self.config)
 
-    def _make_mistral_client(self):
-        """Make the Mistral client with auth."""
-        client = MistralClient(api_key=self.config['api_key'])
-        return client
+    def chat_completion(self, messages, response_format_type="json_object", stream=False):
+        """Convenience method to call the chat completion endpoint.
+        
+        Args:
+            messages (list): A list of messages to send to the chat API
+            response_format_type (str, optional): The response format. Defaults to "json_object".
+            stream (bool, optional): Stream the response. Defaults to False.
 
+        Returns:
+            Completion: The response from the chat API, or an iterator over the text of the response if streaming.
+        """
+        if stream:
+            return self.backend.stream(messages, response_format_type)
+        return self.backend.complete(messages, response_format_type)
 
-    def chat_completion(self, messages, response_format_type="json_object"):
-        """Convenience method to call the chat completion endpoint.
+    def _cached_response(self, messages, response_format_type):
+        """Look up a request in the response cache.
+
+        Args:
+            messages (list): A list of messages to send to the chat API
+            response_format_type (str): The response format.
+
+        Returns:
+            tuple: The cached content, or None on a miss or without a response cache, and a function
+                storing the content of the response in the cache.
+        """
+        if self.response_cache is None:
+            return None, lambda content: None
+        key = ResponseCache.make_key(self.config["backend"], self.backend.model_name, messages, response_format_type)
+        return self.response_cache.get(key), functools.partial(self.response_cache.put, key)
+
+    def _complete(self, messages, response_format_type="json_object"):
+        """Get the content of a chat completion, from the response cache if it is enabled.
         
         Args:
             messages (list): A list of messages to send to the chat API
             response_format_type (str, optional): The response format. Defaults to "json_object".
 
         Returns:
-            openai.ChatCompletion: The response from the chat API
+            str: The content of the response message.
         """
-        if self.config["backend"] == "OpenAI":
-            if not self.config.get("openai_model_name"):
-                raise ValueError("OpenAI model name not set in config")
+        cached, store = self._cached_response(messages, response_format_type)
+        if cached is not None:
+            return cached
 
-            return self.client.chat.completions.create(
-                model=self.config.get('openai_model_name', 'gpt-4-turbo-preview'), 
-                messages=messages,
-                response_format={"type": response_format_type}
-            )
-        elif self.config["backend"] == "Mistral":
+        start = time.perf_counter()
+        content = self.chat_completion(messages, response_format_type=response_format_type).content
+        logger.info("Response completed in %.0f ms", (time.perf_counter() - start) * 1000)
 
-            return self.client.chat(
-                model=self.config.get("mistral_model_name", "mistral-large-latest"),
-                messages=messages,
-                response_format={"type": response_format_type},
-            )
+        store(content)
+        return content
+
+    async def _acomplete(self, messages, response_format_type="json_object"):
+        """Get the content of a chat completion asynchronously, from the response cache if it is enabled.
+
+        Args:
+            messages (list): A list of messages to send to the chat API
+            response_format_type (str, optional): The response format. Defaults to "json_object".
+
+        Returns:
+            str: The content of the response message.
+        """
+        cached, store = self._cached_response(messages, response_format_type)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        content = (await self.backend.acomplete(messages, response_format_type)).content
+        logger.info("Response completed in %.0f ms", (time.perf_counter() - start) * 1000)
+
+        store(content)
+        return content
+
+    def _complete_stream(self, messages, response_format_type="text"):
+        """Stream the content of a chat completion as it arrives.
 
+        A cached response is yielded in one piece, and a streamed response is added to the
+        response cache (if enabled) once it is complete.
+        
+        Args:
+            messages (list): A list of messages to send to the chat API
+            response_format_type (str, optional): The response format. Defaults to "text".
+
+        Yields:
+            str: The content of the response, piece by piece.
+        """
+        cached, store = self._cached_response(messages, response_format_type)
+        if cached is not None:
+            yield cached
+            return
+
+        start = time.perf_counter()
+        pieces = []
+        for piece in iter_content(self.chat_completion(messages, response_format_type=response_format_type, stream=True), start):
+            pieces.append(piece)
+            yield piece
+
+        store(''.join(pieces))
+
+
+    def _load_manifest(self, streaming, cache):
+        """Load the manifest and build the lookup indexes, from the cache if it is up to date.
+        
+        Args:
+            streaming (bool): Incrementally parse the manifest.
+            cache (bool): Read and write the manifest cache.
+        """
+        if cache:
+            cache_path = get_cache_path(self.manifest_path)
+            fingerprint = manifest_fingerprint(
+                self.manifest_path,
+                use_hash=self.config.get('manifest_cache_hash', False)
+            )
+            cached = load_cache(cache_path, fingerprint)
+            if cached is not None:
+                self.manifest = cached['manifest']
+                self.nodes_by_id = cached['nodes_by_id']
+                self.ids_by_name = cached['ids_by_name']
+                self.graph = cached['graph']
+                return
+
+        if streaming:
+            self.manifest = stream_manifest(self.manifest_path)
         else:
-            raise NotImplementedError("Your backend is set to Azure OpenAI not yet implemented")
+            with open(self.manifest_path, 'r') as file:
+                self.manifest = json.load(file)
+
+        if cache:
+            # Only cache the parts of the manifest dbtai uses, so cache hits and misses see the same data
+            self.manifest = select_sections(self.manifest)
+
+        self._build_indexes()
+
+        if cache:
+            save_cache(cache_path, fingerprint, {
+                'manifest': self.manifest,
+                'nodes_by_id': self.nodes_by_id,
+                'ids_by_name': self.ids_by_name,
+                'graph': self.graph,
+            })
+
 
-    def _load_config(self):
-        """Convenience function to load the user config from the config file."""
-        configdir = appdirs.user_data_dir("dbtai", "dbtai")
+    def _build_indexes(self):
+        """Build the unique_id -> node and name -> unique_ids lookup indexes, and the DAG index.
 
-        if os.path.exists(os.path.join(configdir, "config.yaml")):
-            with open(os.path.join(configdir, "config.yaml"), "r") as f:
-                return yaml.load(f, Loader=yaml.FullLoader)
+        The indexes are built once, so that model lookups don't have to merge
+        and scan all the nodes and sources of the manifest on every call.
+        """
+        self.nodes_by_id = {**self.manifest['nodes'], **self.manifest['sources']}
+
+        self.ids_by_name = {}
+        for unique_id, node in self.nodes_by_id.items():
+            self.ids_by_name.setdefault(node['name'], []).append(unique_id)
 
-        return {'language': 'english', "backend": "OpenAI"}
+        # The DAG index replaces the parent map, which takes far more memory
+        self.graph = DagIndex.build(self.nodes_by_id, self.manifest.pop('parent_map', None))
 
 
     def get_nodes_and_sources(self):
         """Get the nodes and sources from the manifest."""
-        return {**self.manifest['nodes'], **self.manifest['sources']}
+        return self.nodes_by_id
 
 
     def get_model_from_name(self, model_name):
         """Get the model from the manifest.
+
+        The model can be given either by name or by its unique_id. A name that
+        matches more than one node (e.g. a source and a model with the same
+        name, or the same model name in two packages) is an error, use the
+        unique_id to pick one of them.
         
         Args:
-            model_name (str): The name of the model.
+            model_name (str): The name or unique_id of the model.
             
         Returns:
             dict: The model from the manifest.
         """
-        nodes_and_sources = self.get_nodes_and_sources()
-        for id, model in nodes_and_sources.items():
-            if model['name'] == model_name:
-                return model
-        raise ValueError(f"Model {model_name} not found in the manifest")
+        if model_name in self.nodes_by_id:
+            return self.nodes_by_id[model_name]
+
+        unique_ids = self.ids_by_name.get(model_name)
+        if not unique_ids:
+            raise ValueError(f"Model {model_name} not found in the manifest")
+        if len(unique_ids) > 1:
+            raise ValueError(
+                f"Model name {model_name} is ambiguous, it matches {', '.join(sorted(unique_ids))}. "
+                "Use the unique_id instead."
+            )
+        return self.nodes_by_id[unique_ids[0]]
+
+
+    def select_models(self, patterns, paths=()):
+        """Resolve a list of model names and glob patterns (e.g. `stg_*`) to models.
+
+        Patterns and paths select by unique_id, so a model that shares its name with a source or
+        a model in another package is not ambiguous.
+        
+        Args:
+            patterns (list[str]): Model names, unique_ids or glob patterns matching model names.
+            paths (list[str], optional): Directories, all models with files under them are selected.
+
+        Returns:
+            list[str]: The names and unique_ids given, and the unique_ids of the models the patterns
+                and paths match, in order and without duplicates.
+        """
+        selected = []
+        for path in paths:
+            prefix = os.path.normpath(path) + os.sep
+            matches = sorted(
+                (node['name'], node['unique_id']) for node in self.manifest['nodes'].values()
+                if node.get('resource_type') == 'model'
+                and os.path.normpath(node['original_file_path']).startswith(prefix)
+            )
+            if not matches:
+                raise ValueError(f"No models found under {path}")
+            selected.extend(unique_id for _, unique_id in matches)
+
+        for pattern in patterns:
+            if not is_pattern(pattern):
+                selected.append(pattern)
+                continue
+
+            matches = sorted(
+                (name, unique_id) for name, unique_ids in self.ids_by_name.items() if fnmatch(name, pattern)
+                for unique_id in unique_ids if self.nodes_by_id[unique_id].get('resource_type') == 'model'
+            )
+            if not matches:
+                raise ValueError(f"No models match {pattern}")
+            selected.extend(unique_id for _, unique_id in matches)
+
+        # A model given by name and matched by a pattern is selected once
+        unique = {}
+        for model_name in selected:
+            try:
+                key = self.get_model_from_name(model_name)['unique_id']
+            except ValueError:
+                key = model_name
+            unique.setdefault(key, model_name)
+        return list(unique.values())
 
 
     def get_upstream_models(self, model_name):
@@ -134,35 +342,187 @@ class Manifest():
             list[dict]: A list of upstream models (dictionaries).
         """
         model = self.get_model_from_name(model_name)
-        nodes_and_sources = self.get_nodes_and_sources()
 
         if model:
-            upstrea_models = [nodes_and_sources[model_id] for model_id in model['depends_on']['nodes']]
-            return upstrea_models
+            return [self.nodes_by_id[model_id] for model_id in model['depends_on']['nodes']]
         return []
 
 
-    def compile_upstream_description_markdown(self, model_name):
+    def get_ancestors(self, model_name, depth=None):
+        """Get the nodes upstream of a model, up to a number of levels up.
+
+        The ancestors are found with a walk of the DAG index, see `dbtai.graph.DagIndex`.
+
+        Args:
+            model_name (str): The name or unique_id of the model.
+            depth (int, optional): The number of levels upstream, 1 for the direct parents. Defaults to None, for all.
+
+        Returns:
+            dict: The unique_ids of the ancestors, mapped to their distance from the model, nearest first.
+        """
+        return self.graph.ancestors(self.get_model_from_name(model_name)['unique_id'], depth)
+
+    def get_descendants(self, model_name, depth=None):
+        """Get the nodes downstream of a model (including tests and exposures), e.g. to see what a change impacts.
+
+        Args:
+            model_name (str): The name or unique_id of the model.
+            depth (int, optional): The number of levels downstream, 1 for the direct children. Defaults to None, for all.
+
+        Returns:
+            dict: The unique_ids of the descendants, mapped to their distance from the model, nearest first.
+        """
+        return self.graph.descendants(self.get_model_from_name(model_name)['unique_id'], depth)
+
+    def get_topological_levels(self, model_names):
+        """Group models by topological level, so that every model comes after the models upstream of it.
+
+        Args:
+            model_names (list[str]): The names or unique_ids of the models.
+
+        Returns:
+            list[list[str]]: The model names of each level, upstream first.
+        """
+        names = {self.get_model_from_name(model_name)['unique_id']: model_name for model_name in model_names}
+        return [[names[unique_id] for unique_id in level] for level in self.graph.topological_levels(names)]
+
+    def get_lineage_path(self, upstream_name, downstream_name):
+        """Get the shortest lineage path from a model (or source) down to a model downstream of it.
+
+        Returns:
+            list[str] | None: The names of the nodes on the path, or None if there is no path.
+        """
+        path = self.graph.shortest_path(
+            self.get_model_from_name(upstream_name)['unique_id'],
+            self.get_model_from_name(downstream_name)['unique_id']
+        )
+        if path is None:
+            return None
+        return [self.nodes_by_id[unique_id]['name'] if unique_id in self.nodes_by_id else unique_id for unique_id in path]
+
+    def _lineage_depth(self, command):
+        """Get the number of levels of upstream models in the context of a command.
+
+        The `lineage_depth` config setting is either a single depth for all commands, or a mapping
+        from command to depth, like `context_token_budget`. Defaults to 1, the direct parents.
+        """
+        depth = self.config.get('lineage_depth', 1)
+        if isinstance(depth, dict):
+            return depth.get(command, 1)
+        return depth
+
+    def _context_budget(self, command):
+        """Get the token budget for the upstream context of a command.
+
+        The `context_token_budget` config setting is either a single budget for all commands,
+        or a mapping from command (doc, unit, fix, explain, chat, gen) to budget.
+
+        Args:
+            command (str): The name of the command.
+
+        Returns:
+            int | None: The token budget, or None for no limit.
+        """
+        budget = self.config.get('context_token_budget')
+        if isinstance(budget, dict):
+            return budget.get(command)
+        return budget
+
+
+    def get_column_usage(self, model_name):
+        """Get the upstream columns a model selects, joins or filters on, by parsing its code.
+
+        Results are cached by the checksum of the model code.
+        
+        Args:
+            model_name (str): The name of the model.
+
+        Returns:
+            dict: The column usage, see `dbtai.sql_usage.extract_column_usage`.
+        """
+        model = self.get_model_from_name(model_name)
+        dialect = self.config.get('sql_dialect', 'ansi')
+
+        checksum = (model.get('checksum') or {}).get('checksum')
+        key = (dialect, checksum) if checksum else None
+        if key is not None:
+            usage = self.sql_usage_cache.get(key)
+            if usage is not None:
+                return usage
+
+        with tracing.span('context.sql_parse', model=model_name):
+            usage = sql_usage.extract_column_usage(model.get('raw_code'), dialect)
+        logger.info(
+            "Found %d referenced columns in %s (%s)",
+            len(usage['columns']),
+            model_name,
+            usage['method']
+        )
+
+        if key is not None:
+            self.sql_usage_cache.put(key, usage)
+        return usage
+
+
+    @tracing.traced('context.upstream')
+    def compile_upstream_description_markdown(self, model_name, token_budget=None, lineage_depth=1):
         """Compile the documentation for upstream models into a markdown string.
+
+        Only the upstream columns the model references are included (unless the `prune_upstream_columns`
+        config setting is false, or the model has jinja that may select any column), and if the
+        documentation is over the token budget it is shortened further, see `dbtai.context.compile_upstream_context`.
+
+        With a lineage depth over 1, the models further upstream follow as one line summaries, in
+        what is left of the token budget, see `dbtai.context.compile_lineage_context`.
         
         Args:
             model_name (str): The name of the model to get upstream documentation for.
+            token_budget (int, optional): The maximum estimated number of tokens. Defaults to None, for no limit.
+            lineage_depth (int, optional): The number of levels upstream to include. Defaults to 1, the direct parents.
 
         Returns:
             str: A markdown string with the documentation for all upstream models.
         """
         upstream_models = self.get_upstream_models(model_name)
+        prune = self.config.get('prune_upstream_columns', True)
+        usage = self.get_column_usage(model_name) if prune or token_budget is not None else None
+
+        # Unresolved jinja, like `dbt_utils.star(...)`, may select any upstream column
+        if usage is not None and not usage['complete']:
+            logger.info("The column usage of %s is incomplete, including all upstream columns", model_name)
+            usage = None
+            prune = False
+
+        if usage is None:
+            context = compile_upstream_context(
+                upstream_models,
+                lambda upstream_model, column: True,
+                token_budget=token_budget
+            )
+        else:
+            columns = set(usage['columns'])
+            star_relations = set(usage['star_relations'])
+
+            context = compile_upstream_context(
+                upstream_models,
+                lambda upstream_model, column: upstream_model['name'] in star_relations or column.lower() in columns,
+                token_budget=token_budget,
+                prune=prune
+            )
 
-        all_models = []
-        if upstream_models:
-            for model in upstream_models:
-                top_level_description = f'{model["name"]}: {model.get("description") or "(no description)"}'
-                column_descriptions = '\n'.join(
-                    [f'* {column}: {content.get("description") or "(no description)"}' 
-                    for column, content in model['columns'].items()]
-                    ) or '(no columns defined)'
-                all_models.append(f'{top_level_description}\nColumns:\n{column_descriptions}')
-        return '\n\n'.join(all_models)
+        if lineage_depth <= 1:
+            return context
+
+        ancestors = [
+            (distance, self.nodes_by_id[unique_id])
+            for unique_id, distance in self.get_ancestors(model_name, lineage_depth).items()
+            if distance > 1 and unique_id in self.nodes_by_id
+        ]
+        remaining_budget = None if token_budget is None else token_budget - estimate_tokens(context)
+        lineage = compile_lineage_context(ancestors, remaining_budget)
+        if not lineage:
+            return context
+        return f'{context}\n\nFurther upstream:\n{lineage}'
 
 
     def get_model_description(self, model_name):
@@ -194,62 +554,223 @@ class Manifest():
         Returns:
             str: A markdown string with instructions for the model.
         """
-        model_description = self.compile_upstream_description_markdown(model_name)
+        model_description = self.compile_upstream_description_markdown(model_name, self._context_budget('doc'), self._lineage_depth('doc'))
 
-        raw_code = self.get_model_from_name(model_name)['raw_code']
+        model = self.get_model_from_name(model_name)
 
         REQUEST = languages[self.config['language']]['create_docs_prompt']
 
         return REQUEST.format(
             model_description=model_description, 
-            raw_code=raw_code, 
-            model_name=model_name)
+            raw_code=model['raw_code'], 
+            model_name=model['name'])
 
     def make_unittest_query(self, model_name, extra_instructions=''):
 
-        raw_code = self.get_model_from_name(model_name)['raw_code']
-        model_description = self.compile_upstream_description_markdown(model_name)
+        model = self.get_model_from_name(model_name)
+        model_description = self.compile_upstream_description_markdown(model_name, self._context_budget('unit'), self._lineage_depth('unit'))
 
         frm = UNITTEST.format(
-            model_name=model_name,
-            raw_code=raw_code,
+            model_name=model['name'],
+            raw_code=model['raw_code'],
             model_description=model_description,
             extra_instructions=extra_instructions or ' '
         )
 
         return frm
 
-    def generate_unittest(self, model_name, extra_instructions=None):
-        """Generate a unit test for the model."""
+    def unittest_messages(self, model_name, extra_instructions=None):
+        """The chat messages requesting a unit test for the model."""
         updoc = self.make_unittest_query(model_name, extra_instructions)
         prompt = languages[self.config['language']]['system_prompt']
 
-        response = self.chat_completion(
-            messages=[
-                {"role": "system", "content":prompt},
-                {"role": "user", "content": updoc}
-            ]
-        )
+        return [
+            {"role": "system", "content":prompt},
+            {"role": "user", "content": updoc}
+        ]
 
-        response_json = json.loads(response.choices[0].message.model_dump_json())
-        test_json = json.loads(response_json['content'])
+    @staticmethod
+    @tracing.traced('response.parse')
+    def parse_unittest(content):
+        """Parse the LLM response to a unit test request into the unit test and its explanation."""
+        test_json = json.loads(content)
         return test_json['unit_test'], test_json["explanation"]
 
-    def generate_docs(self, model_name):
-        """Generate documentation for the model."""
+    def generate_unittest(self, model_name, extra_instructions=None):
+        """Generate a unit test for the model."""
+        content = self._complete(messages=self.unittest_messages(model_name, extra_instructions))
+        return self.parse_unittest(content)
+
+    def docs_messages(self, model_name):
+        """The chat messages requesting documentation for the model."""
         updoc = self.create_documentation_instructions(model_name)
         prompt = languages[self.config['language']]['system_prompt']
 
-        response = self.chat_completion(
-            messages=[
-                {"role": "system", "content":prompt},
-                {"role": "user", "content": updoc}
-            ]
-        )
+        return [
+            {"role": "system", "content":prompt},
+            {"role": "user", "content": updoc}
+        ]
 
-        response_json = json.loads(response.choices[0].message.model_dump_json())
-        docs_json = json.loads(response_json['content'])
-        return docs_json
+    @staticmethod
+    @tracing.traced('response.parse')
+    def parse_docs(content):
+        """Parse the LLM response to a documentation request into the documentation in JSON format."""
+        return json.loads(content)
+
+    def generate_docs(self, model_name):
+        """Generate documentation for the model."""
+        content = self._complete(messages=self.docs_messages(model_name))
+        return self.parse_docs(content)
+
+    def generate_docs_bulk(self, model_names, concurrency=4, dag_order=False):
+        """Generate documentation for many models, with concurrent requests to the LLM.
+
+        The requests run on an asyncio event loop in a background thread, so many requests can be
+        in flight without a thread each. Results are yielded as soon as they arrive, so they can be
+        written while the remaining requests are still running. A failing model does not stop the others,
+        while an error outside of a single model ends the run, and is raised after the results before it.
+
+        In DAG order, the models are documented in waves, one topological level at a time, and the
+        generated documentation is applied to the models in memory (see `apply_docs`) before the
+        next wave starts. The prompts of downstream models then describe their upstream models with
+        the new documentation, without parsing the project again.
+        
+        Args:
+            model_names (list[str]): The names of the models to document.
+            concurrency (int, optional): The maximum number of concurrent requests. Defaults to 4.
+            dag_order (bool, optional): Document upstream models before the models downstream of
+                them. Defaults to False.
+
+        Yields:
+            tuple[str, dict | None, Exception | None]: The model name, and either the documentation
+                in JSON format or the error raised while generating it.
+        """
+        results = queue.Queue()
+        done = object()
+
+        async def generate(model_name, semaphore):
+            async with semaphore:
+                try:
+                    content = await self._acomplete(self.docs_messages(model_name))
+                    docs_json = self.parse_docs(content)
+                    if dag_order:
+                        self.apply_docs(model_name, docs_json)
+                    results.put((model_name, docs_json, None))
+                except Exception as e:
+                    results.put((model_name, None, e))
+
+        async def generate_all(waves):
+            semaphore = asyncio.Semaphore(concurrency)
+            try:
+                for level, wave in enumerate(waves):
+                    with tracing.span('docs.wave', level=level, models=len(wave)):
+                        await asyncio.gather(*(generate(model_name, semaphore) for model_name in wave))
+            finally:
+                await close_async_clients()
+
+        def run(waves):
+            # An error outside of a single model ends the run, and is raised again by the caller
+            try:
+                asyncio.run(generate_all(waves))
+                results.put(done)
+            except BaseException as e:
+                results.put(e)
+
+        waves = [model_names]
+        if dag_order:
+            # The models are resolved before the run starts, so that an unknown model fails on its own
+            resolved = []
+            for model_name in model_names:
+                try:
+                    self.get_model_from_name(model_name)
+                    resolved.append(model_name)
+                except ValueError as e:
+                    yield model_name, None, e
+            waves = self.get_topological_levels(resolved)
+
+        thread = threading.Thread(target=run, args=(waves,), daemon=True)
+        thread.start()
+        while (result := results.get()) is not done:
+            if isinstance(result, BaseException):
+                thread.join()
+                raise result
+            yield result
+        thread.join()
+
+    def apply_docs(self, model_name, docs_json):
+        """Apply generated documentation to the model in memory, so that the prompts of the models
+        downstream of it use the new descriptions. The manifest on disk is left as it is.
+
+        Args:
+            model_name (str): The name of the model.
+            docs_json (dict): The documentation in JSON format.
+        """
+        model = self.get_model_from_name(model_name)
+        if docs_json.get('description'):
+            model['description'] = docs_json['description']
+
+        columns = model.setdefault('columns', {})
+        names = {name.lower(): name for name in columns}
+        for column in docs_json.get('columns') or []:
+            if not column.get('name') or not column.get('description'):
+                continue
+            name = names.get(column['name'].lower(), column['name'])
+            columns.setdefault(name, {'name': name})['description'] = column['description']
+
+    def plan_incremental_docs(self, model_names):
+        """Decide which models need new documentation, comparing them with the documentation state.
+
+        A model is documented if its code (manifest checksum) or the set of upstream columns changed
+        since it was last documented, or if it was never documented by dbtai and is missing
+        descriptions. Otherwise it is skipped.
+        
+        Args:
+            model_names (list[str]): The names of the models.
+
+        Returns:
+            tuple[dict, dict]: The models to document and the models to skip, each mapped to the reason.
+        """
+        state = doc_state.DocState(target_path(self.manifest_path, doc_state.STATE_FILENAME))
+        document = {}
+        skip = {}
+
+        for model_name in model_names:
+            model = self.get_model_from_name(model_name)
+            checksum = (model.get('checksum') or {}).get('checksum')
+            upstream = doc_state.upstream_columns_checksum(self.get_upstream_models(model_name))
+            previous = state.get(model['unique_id'])
+
+            if previous is None:
+                if doc_state.missing_descriptions(model):
+                    document[model_name] = "missing descriptions"
+                else:
+                    skip[model_name] = "already documented"
+                    state.record(model['unique_id'], checksum, upstream)
+            elif previous['checksum'] != checksum:
+                document[model_name] = "SQL changed"
+            elif previous['upstream'] != upstream:
+                document[model_name] = "upstream columns changed"
+            else:
+                skip[model_name] = "unchanged since last documented"
+
+        state.save()
+        return document, skip
+
+    def record_documented(self, model_names):
+        """Record in the documentation state that the models were documented, for incremental runs.
+        
+        Args:
+            model_names (list[str]): The names of the documented models.
+        """
+        state = doc_state.DocState(target_path(self.manifest_path, doc_state.STATE_FILENAME))
+        for model_name in model_names:
+            model = self.get_model_from_name(model_name)
+            state.record(
+                model['unique_id'],
+                (model.get('checksum') or {}).get('checksum'),
+                doc_state.upstream_columns_checksum(self.get_upstream_models(model_name))
+            )
+        state.save()
 
     def get_model_location(self, model_name):
         """Get the file location of the model.
@@ -277,6 +798,7 @@ class Manifest():
         return model['original_file_path'].replace('.sql', '.yml')
     
     @staticmethod
+    @tracing.traced('docs.format')
     def format_docs(docs_json):
         """Format the documentation into a markdown string.
         
@@ -286,6 +808,8 @@ class Manifest():
         Returns:
             str: The documentation in markdown format, correctly ordered.
         """
+        from ruamel.yaml.comments import CommentedMap
+        from dbtai import sidecar
 
         ordered_data = CommentedMap()
         ordered_data['name'] = docs_json['name']
@@ -296,15 +820,7 @@ class Manifest():
         full_data['version'] = 2
         full_data['models'] = [ordered_data]
 
-        yaml = YAML()
-        yaml.indent(sequence=4, offset=2)
-        yaml.preserve_quotes = True
-        output_stream = io.StringIO()
-        yaml.dump(full_data, output_stream)
-        yaml_string = output_stream.getvalue()
-        output_stream.close()
-
-        return yaml_string
+        return sidecar.dumps(full_data)
 
 
     def generate_model(self, model_name, description, inputs=[]):
@@ -320,7 +836,7 @@ class Manifest():
         """
 
         if len(inputs) > 0:
-            inputs = [self.compile_upstream_description_markdown(model_name) for model_name in inputs]
+            inputs = [self.compile_upstream_description_markdown(model_name, self._context_budget('gen'), self._lineage_depth('gen')) for model_name in inputs]
             upstream_docs = '\n\n'.join(inputs)
         else:
             upstream_docs = None
@@ -331,15 +847,14 @@ class Manifest():
             upstream_docs=upstream_docs
         )
 
-        response = self.chat_completion(
+        content = self._complete(
             messages=[
                 {"role": "system", "content": GENERATE_MODEL_SYSTEM_PROMPT},
                 {"role": "user", "content":prompt}
             ]
         )
 
-        response_json = json.loads(response.choices[0].message.model_dump_json())
-        docs_json = json.loads(response_json['content'])
+        docs_json = json.loads(content)
         return docs_json
     
     def fix(self, model_name, description):
@@ -352,7 +867,7 @@ class Manifest():
         Returns:
             dict: The fixed model in JSON format with keys "code" and "explanation".
         """
-        upstream_docs = self.compile_upstream_description_markdown(model_name)
+        upstream_docs = self.compile_upstream_description_markdown(model_name, self._context_budget('fix'), self._lineage_depth('fix'))
 
         model_code = self.get_model_from_name(model_name)['raw_code']
 
@@ -362,15 +877,16 @@ class Manifest():
             tables = upstream_docs
         )
 
-        response = self.chat_completion(
+        content = self._complete(
             messages=[
                 {"role": "system", "content": GENERATE_MODEL_SYSTEM_PROMPT},
                 {"role": "user", "content":prompt}
             ]
         )
 
-        response_json = json.loads(response.choices[0].message.model_dump_json())
-        docs_json = json.loads(response_json['content'])
+        docs_json = json.loads(content)
+
+        import difflib
 
         new_code = docs_json['code']
         diff = difflib.unified_diff(model_code, new_code, fromfile='model_code', tofile='new_code')
@@ -379,9 +895,11 @@ class Manifest():
         return docs_json
     
     def fluff(self, model_name, rewrite=True):
+        import sqlfluff
+
         model_code = self.get_model_from_name(model_name)['raw_code']
 
-        linted_code = sqlfluff.fix(model_code)
+        linted_code = sqlfluff.fix(model_code, dialect=self.config.get('sql_dialect', 'ansi'))
 
         prompt = FIX_CODE_PROMPT.format(
             model_code=linted_code
@@ -390,21 +908,91 @@ class Manifest():
         if not rewrite:
             return {"code": linted_code, "explanation": "SQLFluffed code, no rewrite"}
 
-        response = self.chat_completion(
+        content = self._complete(
             messages=[
                 {"role": "system", "content":prompt}
             ]
         )
 
-        response_json = json.loads(response.choices[0].message.model_dump_json())
-        docs_json = json.loads(response_json['content'])
+        docs_json = json.loads(content)
 
         return docs_json
     
-    def explain(self, model_name):
+    def fluff_bulk(self, model_names, write=False, workers=None, incremental=False):
+        """Run sqlfluff on the files of many models in parallel, see `dbtai.fluff.fluff_files`.
+
+        The model files are read from disk rather than from the manifest, so that edits made
+        since the manifest was compiled are not overwritten.
+
+        In incremental mode, the last result for each model file is kept in a state file in the
+        target directory, with the checksum of the code, and models whose code hasn't changed
+        since are not run through sqlfluff again.
+        
+        Args:
+            model_names (list[str]): The names of the models.
+            write (bool, optional): Write the fixed code back to the model files. Defaults to False.
+            workers (int, optional): The number of worker processes. Defaults to the number of available cores.
+            incremental (bool, optional): Skip models whose code hasn't changed since the last run. Defaults to False.
+
+        Yields:
+            tuple[str, dict | None, Exception | None]: The model name, and either the fixed `code`, whether it
+                `changed` and whether it was `skipped`, or the error raised while fixing it.
+        """
+        dialect = self.config.get('sql_dialect', 'ansi')
+        paths = {model_name: self.get_model_location(model_name) for model_name in model_names}
+
+        state = None
+        if incremental:
+            state = FluffState(target_path(self.manifest_path, FLUFF_STATE_FILENAME), dialect)
+
+        pending = {}
+        for model_name, path in paths.items():
+            if state is None:
+                pending[model_name] = path
+                continue
+
+            try:
+                with open(path, 'r') as f:
+                    code = f.read()
+            except OSError as e:
+                yield model_name, None, e
+                continue
+
+            known = state.get(path, code_checksum(code))
+            if known is None:
+                pending[model_name] = path
+            elif known['clean']:
+                yield model_name, {"code": code, "changed": False, "skipped": True}, None
+            else:
+                if write:
+                    atomic_write(path, known['code'])
+                    state.record_clean(path, known['code'])
+                yield model_name, {"code": known['code'], "changed": True, "skipped": True}, None
+
+        try:
+            for model_name, result, error in fluff_files(pending, dialect=dialect, write=write, workers=workers):
+                if result is not None:
+                    result['skipped'] = False
+                    if state is not None:
+                        state.record(paths[model_name], result, written=write)
+                yield model_name, result, error
+        finally:
+            if state is not None:
+                state.save()
+
+    def explain(self, model_name, stream=False):
+        """Explain what a model does, and why.
+        
+        Args:
+            model_name (str): The name of the model.
+            stream (bool, optional): Return the explanation piece by piece as it is generated. Defaults to False.
+
+        Returns:
+            str | Iterator[str]: The explanation, or an iterator over its pieces if streaming.
+        """
         model_code = self.get_model_from_name(model_name)['raw_code']
-        upstream_docs = self.compile_upstream_description_markdown(model_name)
-        model_docs = self.compile_upstream_description_markdown(model_name)
+        upstream_docs = self.compile_upstream_description_markdown(model_name, self._context_budget('explain'), self._lineage_depth('explain'))
+        model_docs = self.get_model_description(model_name)
 
         prompt = languages[self.config['language']]['explain_prompt'].format(
             raw_code=model_code,
@@ -413,19 +1001,19 @@ class Manifest():
             model_description=model_docs
         )
 
-        response = self.chat_completion(
-            messages=[
-                {"role": "system", "content": languages[self.config['language']]['explain_system_prompt']},
-                {"role": "user", "content": prompt}
-            ],
-            response_format_type="text"
-        )
+        messages = [
+            {"role": "system", "content": languages[self.config['language']]['explain_system_prompt']},
+            {"role": "user", "content": prompt}
+        ]
+
+        if stream:
+            return self._complete_stream(messages, response_format_type="text")
 
-        return response.choices[0].message.content
+        return self._complete(messages, response_format_type="text")
     
     def generate_chatbot_prompt(self, model):
         model_docs = self.get_model_description(model)
-        upstream_docs = self.compile_upstream_description_markdown(model)
+        upstream_docs = self.compile_upstream_description_markdown(model, self._context_budget('chat'), self._lineage_depth('chat'))
         model_code = self.get_model_from_name(model)['raw_code']
         prompt = languages[self.config['language']]['chatbot_prompt'].format(
             model_name=model,
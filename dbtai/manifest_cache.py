@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import os
+import pickle
+from dbtai.utils import atomic_write, manifest_cache_path, paused_gc
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the cached data changes
+CACHE_VERSION = 3
+CACHE_FILENAME = 'dbtai_manifest.pickle'
+
+
+def get_cache_path(manifest_path):
+    """Get the path of the manifest cache, in the dbtai data dir, see `dbtai.utils.manifest_cache_path`."""
+    return manifest_cache_path(manifest_path, CACHE_FILENAME)
+
+
+def manifest_fingerprint(manifest_path, use_hash=False):
+    """Fingerprint the manifest file, used to invalidate the cache when dbt rewrites it.
+
+    Args:
+        manifest_path (str): The path to the manifest.
+        use_hash (bool, optional): Also hash the content of the manifest. Slower, but robust
+            against rewrites that keep the mtime and size. Defaults to False.
+
+    Returns:
+        dict: The fingerprint of the manifest.
+    """
+    stat = os.stat(manifest_path)
+    fingerprint = {
+        'version': CACHE_VERSION,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+    }
+
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(manifest_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        fingerprint['sha256'] = digest.hexdigest()
+
+    return fingerprint
+
+
+def load_cache(cache_path, fingerprint):
+    """Load the cached manifest data, if the cache exists and matches the fingerprint.
+
+    The fingerprint is pickled separately in front of the data, so a stale cache is
+    detected without loading the data.
+
+    Args:
+        cache_path (str): The path to the cache file.
+        fingerprint (dict): The fingerprint of the current manifest.
+
+    Returns:
+        dict | None: The cached data, or None on a cache miss.
+    """
+    if not os.path.exists(cache_path):
+        logger.info("Manifest cache miss: no cache at %s", cache_path)
+        return None
+
+    try:
+        with open(cache_path, 'rb') as f:
+            if pickle.load(f) != fingerprint:
+                logger.info("Manifest cache miss: the manifest has changed since the cache was written")
+                return None
+            with paused_gc():
+                data = pickle.load(f)
+    except Exception as e:
+        logger.info("Manifest cache miss: could not read %s (%s)", cache_path, e)
+        return None
+
+    logger.info("Manifest cache hit: %s", cache_path)
+    return data
+
+
+def save_cache(cache_path, fingerprint, data):
+    """Write the manifest data to the cache.
+
+    Failing to write the cache (e.g. a read-only data dir) is not an error.
+
+    Args:
+        cache_path (str): The path to the cache file.
+        fingerprint (dict): The fingerprint of the manifest the data was loaded from.
+        data (dict): The data to cache.
+    """
+    content = pickle.dumps(fingerprint, pickle.HIGHEST_PROTOCOL) + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        atomic_write(cache_path, content)
+    except OSError as e:
+        logger.info("Could not write the manifest cache to %s (%s)", cache_path, e)
+        return
+
+    logger.info("Wrote the manifest cache to %s", cache_path)
@@ -0,0 +1,197 @@
+import json
+from json.decoder import WHITESPACE
+from dbtai.utils import paused_gc
+
+# The fields of a node or source that dbtai actually reads
+NODE_FIELDS = (
+    'unique_id',
+    'resource_type',
+    'package_name',
+    'name',
+    'description',
+    'columns',
+    'raw_code',
+    'depends_on',
+    'original_file_path',
+    'checksum',
+)
+
+# The top level manifest sections to keep, and the fields to keep for each entry (None keeps everything)
+MANIFEST_SECTIONS = {
+    'nodes': NODE_FIELDS,
+    'sources': NODE_FIELDS,
+    'parent_map': None,
+}
+
+# The characters that can follow a complete JSON value
+DELIMITERS = frozenset(' \t\n\r,:]}')
+
+# Skipped sections whose entries can be large, these are decoded and dropped one entry at a time
+# rather than all at once. Other skipped sections are small and cheaper to decode in one go.
+LARGE_SECTIONS = ('macros', 'docs', 'disabled')
+
+
+class _StreamReader():
+    """Minimal incremental reader for a JSON document.
+
+    Values are decoded one at a time with the C accelerated `json` decoder, so
+    that only a single entry of the document needs to be held in memory at a time.
+    """
+
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size):
+        """Drop the consumed part of the buffer and read `size` more characters."""
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        """Skip whitespace and return the next character without consuming it."""
+        if self.pos < len(self.buffer) and self.buffer[self.pos] not in ' \t\n\r':
+            return self.buffer[self.pos]
+
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError("Unexpected end of the dbt manifest")
+            self._fill(self.chunk_size)
+
+    def expect(self, char):
+        """Consume `char`, failing if it is not the next character."""
+        if self.peek() != char:
+            raise ValueError(f"Malformed dbt manifest: expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """Decode and return the next JSON value."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                end = None
+
+            # A number that runs to the end of the buffer (`12`), or stops at a character that can't
+            # follow a value (`0.` of `0.5`), may be truncated
+            if end is None or (not self.eof and (end == len(self.buffer) or self.buffer[end] not in DELIMITERS)):
+                self._fill(size)
+                size *= 2
+                continue
+
+            self.pos = end
+            return value
+
+    def entries(self):
+        """Iterate over the keys of the next JSON object.
+
+        The caller must consume the value (with `value` or `skip`) of each key before
+        asking for the next one.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Malformed dbt manifest: unexpected {char!r} at offset {self.pos - 1}")
+
+    def skip(self, depth=1):
+        """Consume the next value without keeping it.
+
+        Objects are walked `depth` levels down, so that a large object (e.g. all the
+        macros) is decoded and thrown away one entry at a time.
+        """
+        if depth > 0 and self.peek() == '{':
+            for _ in self.entries():
+                self.skip(depth - 1)
+        else:
+            self.value()
+
+
+def select_fields(entry, fields):
+    """Keep only the given fields of a manifest entry."""
+    if fields is None or not isinstance(entry, dict):
+        return entry
+    return {field: entry[field] for field in fields if field in entry}
+
+
+def select_sections(manifest, sections=MANIFEST_SECTIONS):
+    """Keep only the given sections and fields of an already loaded manifest."""
+    return {
+        section: {
+            unique_id: select_fields(entry, fields)
+            for unique_id, entry in (manifest.get(section) or {}).items()
+        }
+        for section, fields in sections.items()
+    }
+
+
+def stream_manifest(manifest_path, sections=MANIFEST_SECTIONS, chunk_size=1 << 20):
+    """Incrementally parse a dbt manifest, keeping only the sections and fields dbtai uses.
+
+    Everything else (macros, docs, disabled nodes, compiled code etc.) is decoded
+    one entry at a time and dropped, so peak memory is bounded by the data that is
+    kept rather than the size of the manifest file.
+
+    Args:
+        manifest_path (str): The path to the manifest.
+        sections (dict, optional): The sections to keep, mapped to the fields to keep for each entry.
+        chunk_size (int, optional): The number of characters to read at a time. Defaults to 1M.
+
+    Returns:
+        dict: A manifest dict with only the selected sections.
+    """
+    manifest = {}
+
+    with paused_gc():
+        _read_sections(manifest_path, sections, manifest, chunk_size)
+
+    for section in sections:
+        manifest.setdefault(section, {})
+
+    return manifest
+
+
+def _read_sections(manifest_path, sections, manifest, chunk_size):
+    """Read the selected sections of the manifest file into `manifest`."""
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        reader = _StreamReader(file, chunk_size)
+        for section in reader.entries():
+            if section not in sections:
+                reader.skip(depth=1 if section in LARGE_SECTIONS else 0)
+                continue
+
+            if reader.peek() != '{':
+                manifest[section] = reader.value() or {}
+                continue
+
+            fields = sections[section]
+            manifest[section] = {
+                unique_id: select_fields(reader.value(), fields)
+                for unique_id in reader.entries()
+            }
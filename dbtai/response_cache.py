@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import appdirs
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILENAME = 'response_cache.sqlite'
+
+
+class ResponseCache():
+    """Content addressed cache of LLM responses, shared between dbtai processes.
+
+    Responses are stored in SQLite (in WAL mode, so concurrent processes can read and
+    write safely), keyed by a hash of everything that determines the response. Entries
+    are evicted when they are older than `max_age_days`, and least recently used entries
+    are evicted when the cache grows beyond `max_size_mb`.
+    """
+
+    def __init__(self, path=None, max_size_mb=100, max_age_days=30):
+        """Open (or create) the response cache.
+
+        Args:
+            path (str, optional): The path to the cache database. Defaults to a file in the dbtai data dir.
+            max_size_mb (float, optional): The maximum total size of the cached responses. Defaults to 100.
+            max_age_days (float, optional): The maximum age of a cached response. Defaults to 30.
+        """
+        if path is None:
+            datadir = appdirs.user_data_dir("dbtai", "dbtai")
+            os.makedirs(datadir, exist_ok=True)
+            path = os.path.join(datadir, CACHE_FILENAME)
+
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        """Get the SQLite connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def make_key(backend, model_name, messages, response_format_type):
+        """Hash everything that determines the response into a cache key."""
+        payload = json.dumps(
+            [backend, model_name, messages, response_format_type],
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, connection, name):
+        connection.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, key):
+        """Get a cached response.
+
+        Args:
+            key (str): The cache key, from `make_key`.
+
+        Returns:
+            str | None: The cached response content, or None on a cache miss.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT content FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.max_age)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                self._count(connection, 'misses')
+                logger.info("Response cache miss: %s", key[:12])
+                return None
+
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self._count(connection, 'hits')
+
+        logger.info("Response cache hit: %s", key[:12])
+        return row[0]
+
+    def put(self, key, content):
+        """Store a response, and evict expired and least recently used entries.
+
+        Args:
+            key (str): The cache key, from `make_key`.
+            content (str): The response content.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, content, len(content.encode('utf-8')), now, now)
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        """Remove expired entries, then the least recently used ones until the cache fits in `max_size`."""
+        connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        connection.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running_size
+                    FROM responses
+                )
+                WHERE running_size > ?
+            )
+        """, (self.max_size,))
+
+    def stats(self):
+        """Get the cache statistics.
+
+        Returns:
+            dict: The number of entries, their total size in bytes and the hit and miss counters.
+        """
+        with self._connect() as connection:
+            entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+
+        return {
+            'path': self.path,
+            'entries': entries,
+            'size': size,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+        }
+
+    def clear(self):
+        """Remove all cached responses and reset the counters."""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM responses")
+            connection.execute("DELETE FROM counters")
@@ -0,0 +1,345 @@
+import asyncio
+import email.utils
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Scheduler settings, overridable in the config file
+SCHEDULER_DEFAULTS = {
+    'rate_limit_rpm': None,
+    'rate_limit_tpm': None,
+    'max_retries': 5,
+    'retry_base_delay': 1,
+    'retry_max_delay': 60,
+    'max_concurrency': 16,
+}
+
+# Token buckets hold this many seconds worth of their rate, which bounds the size of bursts
+BURST_SECONDS = 10
+
+# How often asynchronous requests check for a free slot under the concurrency limit
+CONCURRENCY_POLL_SECONDS = 0.01
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+DURATION = re.compile(r'([\d.]+)(ms|s|m|h)')
+DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+_schedulers = {}
+_lock = threading.Lock()
+
+
+class TokenBucket():
+    """A token bucket limiting the rate of something (requests, tokens) per minute."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        """Take from the bucket, returning how many seconds to wait until the amount is available.
+
+        The bucket goes into debt, so later reservations wait for earlier ones. Amounts larger than
+        the bucket take all of it.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, amount=1):
+        """Take from the bucket, waiting until there is enough."""
+        time.sleep(self.reserve(amount))
+
+    def consume(self, amount):
+        """Take from the bucket without waiting, e.g. to correct an estimate. The bucket can go into debt."""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class AdaptiveLimit():
+    """A concurrency limit that halves when the backend throttles, and grows back slowly on success."""
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        """Take a slot if one is free, without waiting."""
+        with self._condition:
+            if self.in_flight >= max(1, int(self.limit)):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+                logger.info("Throttled, lowering the concurrency to %d", int(self.limit))
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def parse_duration(value):
+    """Parse a rate limit reset duration, like `1s`, `6m0s` or `250ms`, into seconds."""
+    seconds = sum(float(amount) * DURATION_SECONDS[unit] for amount, unit in DURATION.findall(value))
+    if seconds == 0:
+        try:
+            seconds = float(value)
+        except ValueError:
+            return None
+    return seconds
+
+
+def parse_retry_after(headers):
+    """Find how long the backend asks us to wait, from the `Retry-After` and rate limit headers.
+
+    Args:
+        headers (Mapping[str, str]): The response headers.
+
+    Returns:
+        float | None: The number of seconds to wait, or None if the headers don't say.
+    """
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+
+    if 'retry-after-ms' in headers:
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+
+    if 'retry-after' in headers:
+        try:
+            return max(0.0, float(headers['retry-after']))
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(headers['retry-after'])
+            if date is not None:
+                return max(0.0, date.timestamp() - time.time())
+
+    resets = [
+        parse_duration(headers[header])
+        for header in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+        if header in headers
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def classify_error(error):
+    """Decide whether a failed request should be retried.
+
+    Works with the exceptions of the OpenAI and Mistral SDKs and of httpx, without importing them.
+
+    Returns:
+        tuple[bool, bool, float | None]: Whether to retry, whether the backend is throttling us,
+            and how long the backend asks us to wait.
+    """
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None)
+
+    if status is not None:
+        retryable = status in RETRYABLE_STATUS_CODES or status >= 500
+        return retryable, status == 429, parse_retry_after(headers)
+
+    # Timeouts and connection errors, possibly wrapped by the SDK
+    while error is not None:
+        names = [cls.__name__ for cls in type(error).__mro__]
+        if any('Timeout' in name or 'Connect' in name or 'Protocol' in name for name in names):
+            return True, False, None
+        error = error.__cause__
+
+    return False, False, None
+
+
+def _primed(iterator):
+    """Start a streamed response, so errors while connecting are raised (and retried) before it is handed out."""
+    first = next(iterator, None)
+    if first is None:
+        return iter(())
+    return itertools.chain([first], iterator)
+
+
+class RequestScheduler():
+    """Runs LLM requests within the rate limits of the backend, retrying the ones that fail transiently.
+
+    Requests wait for a token bucket of requests per minute and one of tokens per minute (when the limits
+    are configured), and for a slot under an adaptive concurrency limit. Throttled, timed out and failed
+    (5xx) requests are retried with jittered exponential backoff, or after the delay the backend asks for
+    in its `Retry-After` or rate limit headers. When the backend throttles, all requests pause for the
+    delay and the concurrency limit halves.
+    """
+
+    def __init__(
+        self,
+        rate_limit_rpm=None,
+        rate_limit_tpm=None,
+        max_retries=5,
+        retry_base_delay=1,
+        retry_max_delay=60,
+        max_concurrency=16
+    ):
+        """Create the scheduler.
+
+        Args:
+            rate_limit_rpm (int, optional): The maximum number of requests per minute. Defaults to None, for no limit.
+            rate_limit_tpm (int, optional): The maximum number of tokens per minute. Defaults to None, for no limit.
+            max_retries (int, optional): The number of times a request is retried. Defaults to 5.
+            retry_base_delay (float, optional): The backoff before the first retry, in seconds. Defaults to 1.
+            retry_max_delay (float, optional): The maximum backoff, in seconds. Defaults to 60.
+            max_concurrency (int, optional): The maximum number of concurrent requests. Defaults to 16.
+        """
+        self.requests = TokenBucket(rate_limit_rpm) if rate_limit_rpm else None
+        self.tokens = TokenBucket(rate_limit_tpm) if rate_limit_tpm else None
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.concurrency = AdaptiveLimit(max_concurrency)
+        self.retries = 0
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            return min(self.retry_max_delay, retry_after) + random.uniform(0, self.retry_base_delay)
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    def _admission_delay(self, estimated_tokens):
+        """Reserve a request and its tokens from the rate limits, returning how long to wait before sending it."""
+        with self._lock:
+            wait = max(0.0, self._paused_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve())
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def _retry_delay(self, error, attempt):
+        """Decide whether to retry a failed request.
+
+        Returns:
+            tuple[float | None, bool]: The seconds to wait before retrying, or None to give up, and
+                whether the backend is throttling us.
+        """
+        retryable, throttled, retry_after = classify_error(error)
+        if not retryable or attempt >= self.max_retries:
+            return None, throttled
+
+        delay = self._backoff(attempt, retry_after)
+        with self._lock:
+            self.retries += 1
+            if throttled:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.info(
+            "Request failed (%s), retrying in %.1f s (retry %d of %d)",
+            type(error).__name__, delay, attempt + 1, self.max_retries
+        )
+        return delay, throttled
+
+    def run(self, request, estimated_tokens=0, stream=False):
+        """Run a request, waiting for the rate limits and retrying transient failures.
+
+        Args:
+            request (Callable[[], Any]): Sends the request and returns the response.
+            estimated_tokens (int, optional): The estimated number of prompt tokens. Defaults to 0.
+            stream (bool, optional): The response is an iterator over chunks, which is started before it
+                is returned. Defaults to False.
+
+        Returns:
+            The response.
+        """
+        for attempt in itertools.count():
+            time.sleep(self._admission_delay(estimated_tokens))
+            self.concurrency.acquire()
+            throttled = False
+            try:
+                response = request()
+                if stream:
+                    response = _primed(iter(response))
+                return self._account(response, estimated_tokens)
+            except Exception as e:
+                delay, throttled = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self.concurrency.release(throttled)
+
+            time.sleep(delay)
+
+    async def arun(self, request, estimated_tokens=0):
+        """Run an asynchronous request, waiting for the rate limits and retrying transient failures.
+
+        Args:
+            request (Callable[[], Awaitable]): Sends the request and returns the response.
+            estimated_tokens (int, optional): The estimated number of prompt tokens. Defaults to 0.
+
+        Returns:
+            The response.
+        """
+        for attempt in itertools.count():
+            await asyncio.sleep(self._admission_delay(estimated_tokens))
+            while not self.concurrency.try_acquire():
+                await asyncio.sleep(CONCURRENCY_POLL_SECONDS)
+            throttled = False
+            try:
+                return self._account(await request(), estimated_tokens)
+            except Exception as e:
+                delay, throttled = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self.concurrency.release(throttled)
+
+            await asyncio.sleep(delay)
+
+    def _account(self, response, estimated_tokens):
+        """Correct the tokens per minute bucket with the actual token usage of the response, if it has one."""
+        total_tokens = getattr(response, 'total_tokens', None)
+        if self.tokens is not None and total_tokens:
+            self.tokens.consume(total_tokens - estimated_tokens)
+        return response
+
+
+def get_scheduler(config):
+    """Get the shared request scheduler of the configured backend, creating it on first use.
+
+    The scheduler is shared by everything in the process that talks to the backend, so the rate limits
+    hold across concurrent requests.
+
+    Args:
+        config (dict): The dbtai config.
+
+    Returns:
+        RequestScheduler: The scheduler.
+    """
+    settings = {**SCHEDULER_DEFAULTS, **{key: config[key] for key in SCHEDULER_DEFAULTS if config.get(key) is not None}}
+    key = (config.get('backend', 'OpenAI'), *settings.values())
+    with _lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler(**settings)
+        return _schedulers[key]
@@ -0,0 +1,268 @@
+import builtins
+import functools
+import http.client
+import json
+import logging
+import os
+import secrets
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dbtai import usage
+from dbtai.clients import pool_stats
+from dbtai.manifest_cache import manifest_fingerprint
+from dbtai.utils import atomic_write, target_path
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = 'dbtai_server.json'
+HOST = '127.0.0.1'
+
+# The Manifest methods the server runs on behalf of the CLI
+SERVED_METHODS = {
+    'explain',
+    'generate_docs',
+    'generate_unittest',
+    'format_docs',
+    'get_doc_location',
+}
+
+
+class ManifestServer(ThreadingHTTPServer):
+    """A localhost HTTP server that keeps a loaded Manifest, and its LLM client, in memory.
+
+    The manifest is reloaded when dbt rewrites the manifest file. Requests must carry
+    the access token from the state file, so only users who can read the dbt target
+    directory can use the server.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, make_manifest, manifest_path, port=0):
+        """Start listening, and load the manifest.
+
+        Args:
+            make_manifest (Callable[[], Manifest]): Creates a Manifest.
+            manifest_path (str): The path to the manifest, watched for changes.
+            port (int, optional): The port to listen on. Defaults to 0, for any free port.
+        """
+        super().__init__((HOST, port), _Handler)
+        self.make_manifest = make_manifest
+        self.manifest_path = manifest_path
+        self.token = secrets.token_hex(16)
+        self.requests = 0
+        self.loads = 0
+        self._manifest = None
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self.get_manifest()
+
+    def get_manifest(self):
+        """Get the loaded manifest, reloading it first if the manifest file changed."""
+        fingerprint = manifest_fingerprint(self.manifest_path)
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._manifest is not None:
+                    logger.info("The manifest changed, reloading it")
+                self._manifest = self.make_manifest()
+                self._fingerprint = fingerprint
+                self.loads += 1
+            return self._manifest
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'port': self.server_address[1],
+            'manifest_path': os.path.abspath(self.manifest_path),
+            'requests': self.requests,
+            'loads': self.loads,
+            'connection_pools': pool_stats(),
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _authorized(self):
+        if self.headers.get('Authorization') == f'Bearer {self.server.token}':
+            return True
+        self._send_json(401, {'error': 'Invalid token', 'type': 'PermissionError'})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == '/status':
+            self._send_json(200, self.server.status())
+        else:
+            self._send_json(404, {'error': f'Not found: {self.path}', 'type': 'LookupError'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path == '/shutdown':
+            self._send_json(200, {})
+            threading.Thread(target=self.server.shutdown).start()
+        elif self.path == '/call':
+            self._call()
+        else:
+            self._send_json(404, {'error': f'Not found: {self.path}', 'type': 'LookupError'})
+
+    def _call(self):
+        """Run a Manifest method. Generators (streamed responses) are sent as one JSON line per piece."""
+        self.server.requests += 1
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        try:
+            if request['method'] not in SERVED_METHODS:
+                raise ValueError(f"The server does not run {request['method']}")
+            # LLM calls are recorded under the command of the client
+            usage.set_command(request.get('command') or 'serve')
+            method = getattr(self.server.get_manifest(), request['method'])
+            result = method(*request.get('args', []), **request.get('kwargs', {}))
+        except Exception as e:
+            logger.info("Request failed: %s", e)
+            self._send_json(500, {'error': str(e), 'type': type(e).__name__})
+            return
+
+        if not isinstance(result, types.GeneratorType):
+            self._send_json(200, {'result': result})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for piece in result:
+                self.wfile.write((json.dumps({'piece': piece}) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            line = {'done': True}
+        except Exception as e:
+            line = {'error': str(e), 'type': type(e).__name__}
+        self.wfile.write((json.dumps(line) + '\n').encode('utf-8'))
+
+
+def serve(make_manifest, manifest_path, port=0, ready=None):
+    """Run the server until it is shut down, advertising its port and token in the state file.
+
+    Args:
+        make_manifest (Callable[[], Manifest]): Creates a Manifest.
+        manifest_path (str): The path to the manifest.
+        port (int, optional): The port to listen on. Defaults to 0, for any free port.
+        ready (Callable[[ManifestServer], None], optional): Called once the server is listening.
+    """
+    server = ManifestServer(make_manifest, manifest_path, port)
+    state_path = target_path(manifest_path, STATE_FILENAME)
+    # The state file is only readable by the user, which protects the token
+    atomic_write(state_path, json.dumps({
+        'pid': os.getpid(),
+        'port': server.server_address[1],
+        'token': server.token,
+    }), private=True)
+
+    if ready is not None:
+        ready(server)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+
+def _raise_remote(body):
+    """Raise the exception the server reported, as the same builtin exception type where possible."""
+    error_type = getattr(builtins, body.get('type', ''), None)
+    if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+        error_type = RuntimeError
+    raise error_type(body.get('error'))
+
+
+class RemoteManifest():
+    """Runs Manifest methods on a running `dbtai serve` server, with the same signatures."""
+
+    def __init__(self, port, token):
+        self.port = port
+        self.token = token
+
+    @classmethod
+    def connect(cls, manifest_path='target/manifest.json', timeout=0.5):
+        """Connect to the server for a manifest, if one is running.
+
+        Returns:
+            RemoteManifest | None: The connection, or None if no server is running.
+        """
+        try:
+            with open(target_path(manifest_path, STATE_FILENAME), 'r') as f:
+                state = json.load(f)
+            remote = cls(state['port'], state['token'])
+            remote.status(timeout=timeout)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            logger.info("No dbtai server available (%s)", e)
+            return None
+        return remote
+
+    def _request(self, method, path, body=None, timeout=None):
+        connection = http.client.HTTPConnection(HOST, self.port, timeout=timeout)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=body, headers=headers)
+        return connection.getresponse()
+
+    def status(self, timeout=None):
+        """Get the status of the server: its pid, port, manifest and request counters."""
+        response = self._request('GET', '/status', timeout=timeout)
+        body = json.loads(response.read())
+        if response.status != 200:
+            _raise_remote(body)
+        return body
+
+    def shutdown(self):
+        """Stop the server."""
+        self._request('POST', '/shutdown').read()
+
+    def call(self, method, *args, **kwargs):
+        """Run a Manifest method on the server.
+
+        Returns:
+            The result of the method, or an iterator over the pieces of a streamed result.
+        """
+        response = self._request('POST', '/call', {
+            'method': method,
+            'args': args,
+            'kwargs': kwargs,
+            'command': usage.current_command(),
+        })
+        if response.getheader('Content-Type') == 'application/x-ndjson':
+            return self._iter_pieces(response)
+
+        body = json.loads(response.read())
+        if response.status != 200:
+            _raise_remote(body)
+        return body['result']
+
+    @staticmethod
+    def _iter_pieces(response):
+        with response:
+            for line in response:
+                body = json.loads(line)
+                if 'piece' in body:
+                    yield body['piece']
+                elif 'error' in body:
+                    _raise_remote(body)
+
+    def __getattr__(self, name):
+        if name in SERVED_METHODS:
+            return functools.partial(self.call, name)
+        raise AttributeError(name)
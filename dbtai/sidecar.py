@@ -0,0 +1,196 @@
+import io
+import os
+import threading
+from dbtai import tracing
+from dbtai.utils import atomic_write
+
+# Each thread (e.g. the request threads of `dbtai serve`) reuses one configured emitter
+_local = threading.local()
+
+
+def get_yaml():
+    """Get the round-trip YAML loader and emitter of the current thread, configured like dbt properties files."""
+    yaml = getattr(_local, 'yaml', None)
+    if yaml is None:
+        # ruamel.yaml is slow to import, so it is only loaded by the commands that write YAML
+        from ruamel.yaml import YAML
+
+        yaml = YAML()
+        yaml.indent(sequence=4, offset=2)
+        yaml.preserve_quotes = True
+        _local.yaml = yaml
+    return yaml
+
+
+def dumps(data):
+    """Dump data to a YAML string."""
+    output_stream = io.StringIO()
+    get_yaml().dump(data, output_stream)
+    return output_stream.getvalue()
+
+
+def loads(text):
+    """Load a YAML string, keeping comments, ordering and quotes."""
+    return get_yaml().load(text)
+
+
+def _find(items, name):
+    """Find the mapping with the name in a list of mappings, ignoring case."""
+    for item in items:
+        if isinstance(item, dict) and str(item.get('name', '')).lower() == name.lower():
+            return item
+    return None
+
+
+def _unit_tests(unit_test):
+    """The unit tests in a generated unit test, which is YAML with a `unit_tests` list, a list, or a single test."""
+    data = loads(unit_test) if isinstance(unit_test, str) else unit_test
+    if isinstance(data, dict) and 'unit_tests' in data:
+        data = data['unit_tests']
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or not all(isinstance(test, dict) and test.get('name') for test in data):
+        raise ValueError("The unit test is not a named unit test, or a list of them")
+    return data
+
+
+class Sidecar():
+    """A dbt properties (`.yml`) file, with generated documentation and unit tests merged into it.
+
+    The file is loaded once, round trip, and changed in place: existing descriptions are replaced,
+    but tests, constraints, other models and comments are kept, in their order.
+    """
+
+    def __init__(self, path):
+        """Load the file, or start an empty one if it does not exist.
+
+        Args:
+            path (str): The path to the properties file.
+        """
+        self.path = path
+        self.changed = False
+        self.data = None
+        if os.path.exists(path):
+            with tracing.span('sidecar.load', path=path):
+                with open(path) as f:
+                    self.data = loads(f.read())
+        if self.data is None:
+            from ruamel.yaml.comments import CommentedMap
+
+            self.data = CommentedMap()
+            self.data['version'] = 2
+
+    def _section(self, key):
+        from ruamel.yaml.comments import CommentedSeq
+
+        section = self.data.get(key)
+        if section is None:
+            section = self.data[key] = CommentedSeq()
+        return section
+
+    def merge_docs(self, docs_json):
+        """Merge generated documentation into the file.
+
+        The description of the model is replaced, as are the descriptions of its columns. Columns
+        that are new are added at the end, and columns missing from the documentation are kept.
+
+        Args:
+            docs_json (dict): The documentation in JSON format.
+        """
+        from ruamel.yaml.comments import CommentedMap, CommentedSeq
+
+        models = self._section('models')
+        model = _find(models, docs_json['name'])
+        if model is None:
+            model = CommentedMap()
+            model['name'] = docs_json['name']
+            models.append(model)
+
+        model['description'] = docs_json['description']
+        columns = model.get('columns')
+        if columns is None:
+            columns = model['columns'] = CommentedSeq()
+        for column_json in docs_json.get('columns') or []:
+            column = _find(columns, column_json['name'])
+            if column is None:
+                column = CommentedMap()
+                column['name'] = column_json['name']
+                columns.append(column)
+            column['description'] = column_json.get('description', '')
+        self.changed = True
+
+    def merge_unit_tests(self, unit_test):
+        """Merge generated unit tests into the file, replacing the existing unit tests with the same name.
+
+        Args:
+            unit_test (str | list | dict): The unit test YAML, or the loaded unit tests.
+        """
+        unit_tests = self._section('unit_tests')
+        for test in _unit_tests(unit_test):
+            existing = _find(unit_tests, test['name'])
+            if existing is None:
+                unit_tests.append(test)
+            else:
+                unit_tests[unit_tests.index(existing)] = test
+        self.changed = True
+
+    def save(self):
+        """Write the file atomically, if anything was merged into it."""
+        if self.changed:
+            atomic_write(self.path, dumps(self.data))
+            self.changed = False
+
+
+class SidecarWriter():
+    """Collects the writes of a bulk run per file, to load and write every file only once.
+
+    Use it as a context manager, so the files are written when the run ends, also if it fails:
+
+        with SidecarWriter() as writer:
+            for model_name, docs_json in results:
+                writer.merge_docs(manifest.get_doc_location(model_name), docs_json)
+    """
+
+    def __init__(self):
+        self.sidecars = {}
+        self.errors = {}
+
+    def get(self, path):
+        """Get the sidecar file at the path, loading it on first use."""
+        key = os.path.abspath(path)
+        if key not in self.sidecars:
+            self.sidecars[key] = Sidecar(path)
+        return self.sidecars[key]
+
+    def merge_docs(self, path, docs_json):
+        """Merge generated documentation into a file, see `Sidecar.merge_docs`."""
+        self.get(path).merge_docs(docs_json)
+
+    def merge_unit_tests(self, path, unit_test):
+        """Merge generated unit tests into a file, see `Sidecar.merge_unit_tests`."""
+        self.get(path).merge_unit_tests(unit_test)
+
+    def flush(self):
+        """Write the changed files. A file that can't be written does not stop the others, its error
+        is kept in `errors`, by path.
+
+        Returns:
+            int: The number of files written.
+        """
+        written = 0
+        with tracing.span('sidecar.flush', files=len(self.sidecars)):
+            for sidecar in self.sidecars.values():
+                if not sidecar.changed:
+                    continue
+                try:
+                    sidecar.save()
+                    written += 1
+                except OSError as e:
+                    self.errors[sidecar.path] = e
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.flush()
@@ -0,0 +1,257 @@
+import atexit
+import logging
+import os
+import pickle
+import re
+import threading
+from dbtai.utils import atomic_write, manifest_cache_path
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILENAME = 'dbtai_sql_usage.pickle'
+
+# Bump when the extraction logic changes, to invalidate cached results
+USAGE_VERSION = 2
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_$]*')
+RELATION_MACRO = re.compile(r'\{\{-?\s*(ref|source)\s*\(([^)]*)\)\s*-?\}\}')
+STRING_ARGUMENT = re.compile(r'''['"]([^'"]+)['"]''')
+JINJA_COMMENT = re.compile(r'\{#.*?#\}', re.DOTALL)
+JINJA_STATEMENT = re.compile(r'\{%.*?%\}', re.DOTALL)
+JINJA_EXPRESSION = re.compile(r'\{\{.*?\}\}', re.DOTALL)
+CONFIG_MACRO = re.compile(r'\{\{-?\s*config\s*\(.*?\)\s*-?\}\}', re.DOTALL)
+THIS_MACRO = re.compile(r'\{\{-?\s*this\s*-?\}\}')
+PLACEHOLDER = '__dbtai_relation_{}'
+
+
+def render_relations(raw_code):
+    """Replace the jinja in dbt model code with plain SQL that can be parsed.
+
+    `ref` and `source` calls are replaced with placeholder table names, `config` calls,
+    statements and comments are removed, and other expressions are replaced with `null`.
+
+    Args:
+        raw_code (str): The raw code of the model.
+
+    Returns:
+        tuple[str, dict, bool]: The SQL, the mapping from placeholder to the name of the
+            referenced model or source table, and whether all jinja was resolved. It is not if
+            expressions were replaced with `null`, as they may select any column, like
+            `dbt_utils.star(ref('orders'))`.
+    """
+    relations = {}
+    unresolved = []
+
+    def replace(match):
+        arguments = STRING_ARGUMENT.findall(match.group(2))
+        if not arguments:
+            unresolved.append(match.group(0))
+            return 'null'
+        placeholder = PLACEHOLDER.format(len(relations))
+        relations[placeholder] = arguments[-1]
+        return placeholder
+
+    sql = JINJA_COMMENT.sub('', raw_code)
+    sql = CONFIG_MACRO.sub('', sql)
+    sql = THIS_MACRO.sub('__dbtai_this', sql)
+    sql = RELATION_MACRO.sub(replace, sql)
+    sql = JINJA_STATEMENT.sub('', sql)
+    sql, expressions = JINJA_EXPRESSION.subn('null', sql)
+    return sql, relations, not unresolved and not expressions
+
+
+def _identifier(segment):
+    """The (lowercase, unquoted) name of an identifier segment."""
+    return segment.raw.strip('"`[]').lower()
+
+
+def _identifiers(segment):
+    """The identifiers of a (possibly qualified) reference, e.g. `a.id` -> ['a', 'id']."""
+    return [
+        _identifier(child) for child in segment.segments
+        if child.is_type('naked_identifier', 'quoted_identifier')
+    ]
+
+
+def _scopes(tree):
+    """Split a parsed statement into scopes: one per CTE, and the main query.
+
+    Returns:
+        list[tuple[str, BaseSegment]]: The name of each scope (`None` for the main query) and its segment.
+    """
+    scopes = []
+    for statement in tree.recursive_crawl('with_compound_statement', recurse_into=False):
+        for child in statement.segments:
+            if child.is_type('common_table_expression'):
+                names = [c for c in child.segments if c.is_type('naked_identifier', 'quoted_identifier')]
+                scopes.append((_identifier(names[0]) if names else None, child))
+            elif child.is_type('select_statement', 'set_expression'):
+                scopes.append((None, child))
+
+    if not scopes:
+        scopes.append((None, tree))
+    return scopes
+
+
+def _parse_usage(sql, relations, dialect):
+    """Extract the column usage of a query with the sqlfluff parser.
+
+    Returns:
+        dict | None: The column usage, or None if the query could not be parsed.
+    """
+    from sqlfluff.core import Linter
+
+    tree = Linter(dialect=dialect).parse_string(sql).tree
+    if tree is None or any(True for _ in tree.recursive_crawl('unparsable')):
+        return None
+
+    columns = set()
+    star_sources = {}
+    for scope, segment in _scopes(tree):
+        # Map the aliases in this scope to the relations (upstream placeholders or CTEs) they refer to
+        aliases = {}
+        for element in segment.recursive_crawl('from_expression_element', no_recursive_seg_type='common_table_expression'):
+            references = list(element.recursive_crawl('table_reference', no_recursive_seg_type='select_statement'))
+            if not references or not _identifiers(references[0]):
+                continue
+            relation = _identifiers(references[0])[-1]
+            aliases[relation] = relation
+            for alias_expression in element.recursive_crawl('alias_expression', no_recursive_seg_type='select_statement'):
+                alias = _identifiers(alias_expression)
+                if alias:
+                    aliases[alias[-1]] = relation
+
+        for reference in segment.recursive_crawl('column_reference', no_recursive_seg_type='common_table_expression'):
+            identifiers = _identifiers(reference)
+            if identifiers:
+                columns.add(identifiers[-1])
+
+        # `*` selects all columns of all relations in scope, `a.*` only those of `a`
+        for wildcard in segment.recursive_crawl('wildcard_identifier', no_recursive_seg_type='common_table_expression'):
+            qualifier = _identifiers(wildcard)
+            targets = {aliases.get(qualifier[-1], qualifier[-1])} if qualifier else set(aliases.values())
+            star_sources.setdefault(scope, set()).update(targets)
+
+    # Follow `select *` from the main query through the CTEs, to find the upstream relations
+    # whose columns are all passed through
+    star_relations = set()
+    seen = set()
+    pending = [None]
+    while pending:
+        scope = pending.pop()
+        for relation in star_sources.get(scope, ()):
+            if relation in relations:
+                star_relations.add(relations[relation])
+            elif relation not in seen:
+                seen.add(relation)
+                pending.append(relation)
+
+    return {
+        'method': 'sqlfluff',
+        'columns': sorted(columns),
+        'star_relations': sorted(star_relations),
+    }
+
+
+def _tokenize_usage(sql, relations):
+    """Extract the column usage of a query with a simple tokenizer, when it can't be parsed.
+
+    Every identifier in the query counts as a referenced column, and a query ending in
+    `select * from <upstream relation>` passes through all columns of that relation.
+    """
+    final_star = re.search(r'select\s+\*\s+from\s+(\w+)\s*;?\s*$', sql, re.IGNORECASE)
+    star_relations = set()
+    if final_star and final_star.group(1).lower() in relations:
+        star_relations.add(relations[final_star.group(1).lower()])
+
+    return {
+        'method': 'tokens',
+        'columns': sorted({identifier.lower() for identifier in IDENTIFIER.findall(sql)}),
+        'star_relations': sorted(star_relations),
+    }
+
+
+def extract_column_usage(raw_code, dialect='ansi'):
+    """Find the upstream columns a dbt model selects, joins or filters on.
+
+    The code is parsed with sqlfluff, and falls back to a simple tokenizer if it can't be parsed.
+
+    Args:
+        raw_code (str): The raw code of the model.
+        dialect (str, optional): The sqlfluff dialect. Defaults to 'ansi'.
+
+    Returns:
+        dict: The lowercase names of the referenced columns (`columns`), the names of the upstream
+            relations whose columns are all selected through `select *` (`star_relations`),
+            how the usage was found (`method`), and whether it is complete (`complete`). Usage is
+            incomplete when the code has jinja expressions that could not be resolved, or when no
+            columns were found at all, and then any upstream column may be used.
+    """
+    sql, relations, resolved = render_relations(raw_code or '')
+    relations = {placeholder.lower(): name for placeholder, name in relations.items()}
+
+    try:
+        usage = _parse_usage(sql, relations, dialect)
+    except Exception as e:
+        logger.info("Could not parse the model code with sqlfluff (%s)", e)
+        usage = None
+
+    usage = usage or _tokenize_usage(sql, relations)
+    usage['complete'] = resolved and bool(usage['columns'] or usage['star_relations'])
+    return usage
+
+
+def get_cache_path(manifest_path):
+    """Get the path of the SQL usage cache, in the dbtai data dir, see `dbtai.utils.manifest_cache_path`."""
+    return manifest_cache_path(manifest_path, CACHE_FILENAME)
+
+
+class SqlUsageCache():
+    """Cache of column usage, keyed by the checksum of the model code.
+
+    The cache is loaded on first use, and written back to disk when the process exits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.dirty = False
+        self._lock = threading.Lock()
+        atexit.register(self.save)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    cached = pickle.load(f)
+                if cached['version'] == USAGE_VERSION:
+                    self.entries = cached['entries']
+            except Exception as e:
+                logger.info("Could not read the SQL usage cache %s (%s)", self.path, e)
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            return self.entries.get(key)
+
+    def put(self, key, usage):
+        with self._lock:
+            self._load()
+            self.entries[key] = usage
+            self.dirty = True
+
+    def save(self):
+        """Write the cache to disk, if it has changed."""
+        with self._lock:
+            if not self.dirty:
+                return
+            try:
+                content = pickle.dumps({'version': USAGE_VERSION, 'entries': self.entries}, pickle.HIGHEST_PROTOCOL)
+                os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+                atomic_write(self.path, content)
+            except OSError as e:
+                logger.info("Could not write the SQL usage cache %s (%s)", self.path, e)
+            self.dirty = False
@@ -0,0 +1,37 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def iter_content(pieces, start=None):
+    """Yield the text of a streamed chat completion as it arrives.
+
+    Passes on the text pieces of a backend stream, logging the time to first token and the
+    total time when the stream is exhausted.
+
+    Args:
+        pieces (Iterable[str]): The streamed text of the completion.
+        start (float, optional): The `time.perf_counter()` when the request was sent. Defaults to now.
+
+    Yields:
+        str: The text of each piece.
+    """
+    if start is None:
+        start = time.perf_counter()
+    first_token = None
+
+    for piece in pieces:
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        yield piece
+
+    total = time.perf_counter() - start
+    if first_token is None:
+        logger.info("Streamed response was empty, completed in %.0f ms", total * 1000)
+    else:
+        logger.info(
+            "Streamed response: first token after %.0f ms, completed in %.0f ms",
+            first_token * 1000,
+            total * 1000
+        )
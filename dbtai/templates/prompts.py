@@ -528,3 +528,16 @@ In-model configurations should be specified like this for maximum readability:
 The output should be a JSON containing a key "code" with the dbt model code, and a key "explanation" with a string explaining the changes made.
 """
 
+
+
+SUMMARIZE_CHAT_PROMPT = """
+You are summarizing an ongoing conversation about the dbt model {model_name}, so that it can continue without the full chat history.
+
+The summary of the conversation so far:
+{summary}
+
+The messages to add to the summary:
+{messages}
+
+Write a concise summary of the whole conversation, keeping the questions asked, the facts established about the model and any conclusions or decisions. Leave out pleasantries. Reply with the summary only.
+"""
@@ -0,0 +1,172 @@
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Set to 1 to print a timing summary at the end of each command, or to a .json path to also write a Chrome trace
+TRACE_ENV = 'DBTAI_TRACE'
+
+# Span attributes summed up in the summary table
+SUMMED_ATTRIBUTES = ['prompt_tokens', 'completion_tokens']
+
+_tracer = None
+
+
+class Span():
+    """A timed phase of a command, with attributes such as token counts."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        # Concurrent spans of asyncio tasks share a thread, so they get a track of their own
+        self.thread = threading.get_ident()
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            self.thread = id(task)
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        """Add attributes to the span, e.g. once the response of a request is in."""
+        self.attributes.update(attributes)
+
+
+class _NoSpan():
+    """Stands in for a span when tracing is off, so instrumented code costs next to nothing."""
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer():
+    """Records the spans of a command, from any thread."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def finish(self, span):
+        span.duration = time.perf_counter() - span.start
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Aggregate the spans by name.
+
+        Returns:
+            list[dict]: Per span name, in order of first appearance: the count, the total, mean and
+                maximum seconds, and the sums of the token counts.
+        """
+        rows = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            row = rows.setdefault(span.name, {'name': span.name, 'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+            row['count'] += 1
+            row['total_s'] += span.duration
+            row['max_s'] = max(row['max_s'], span.duration)
+            for attribute in SUMMED_ATTRIBUTES:
+                if span.attributes.get(attribute) is not None:
+                    row[attribute] = row.get(attribute, 0) + span.attributes[attribute]
+        for row in rows.values():
+            row['mean_s'] = row['total_s'] / row['count']
+        return list(rows.values())
+
+    def format_summary(self):
+        """Format the summary as a table."""
+        wall = time.perf_counter() - self.start
+        lines = [
+            f"{'Span':<32} {'Count':>6} {'Total ms':>10} {'Mean ms':>10} {'Max ms':>10} {'Prompt tok':>11} {'Compl. tok':>11}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['name']:<32} {row['count']:>6} {row['total_s'] * 1000:>10.1f} {row['mean_s'] * 1000:>10.1f} "
+                f"{row['max_s'] * 1000:>10.1f} {row.get('prompt_tokens', ''):>11} {row.get('completion_tokens', ''):>11}"
+            )
+        lines.append(f"Wall time {wall * 1000:.1f} ms. Concurrent spans overlap, so totals can add up to more.")
+        return '\n'.join(lines)
+
+    def write_chrome_trace(self, path):
+        """Write the spans in the Chrome trace event format, to open in chrome://tracing or ui.perfetto.dev.
+
+        Args:
+            path (str): The JSON file to write.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                'name': span.name,
+                'ph': 'X',
+                'ts': (span.start - self.start) * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': pid,
+                'tid': span.thread,
+                'args': span.attributes,
+            }
+            for span in self.spans
+        ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+def enable():
+    """Start recording spans, returning the tracer."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def get_tracer():
+    """The tracer, or None if tracing is off."""
+    return _tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def _record(tracer, name, attributes):
+    span = Span(name, attributes)
+    try:
+        yield span
+    finally:
+        tracer.finish(span)
+
+
+def span(name, **attributes):
+    """Time a phase of the command, when tracing is on.
+
+    Use as a context manager, which gives the span to add attributes to:
+
+        with tracing.span('llm.complete', model=model_name) as span:
+            completion = ...
+            span.set(prompt_tokens=completion.prompt_tokens)
+
+    Args:
+        name (str): The name of the span, spans with the same name are aggregated in the summary.
+        **attributes: Attributes of the span, written to the trace file.
+    """
+    if _tracer is None:
+        return contextlib.nullcontext(_NO_SPAN)
+    return _record(_tracer, name, attributes)
+
+
+def traced(name):
+    """Decorate a function to run in a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
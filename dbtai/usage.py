@@ -0,0 +1,213 @@
+import atexit
+import contextvars
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import appdirs
+
+logger = logging.getLogger(__name__)
+
+USAGE_FILENAME = 'usage.sqlite'
+
+# Calls are kept in memory and written in one transaction when this many are waiting, or at exit
+FLUSH_SIZE = 200
+
+# Long running processes, like `dbtai serve`, also write the waiting calls after this many seconds
+FLUSH_SECONDS = 30
+
+GROUPS = {
+    'command': "command",
+    'model': "backend || ' ' || model",
+    'day': "date(ts, 'unixepoch', 'localtime')",
+}
+
+_default_command = None
+_command = contextvars.ContextVar('dbtai_usage_command', default=None)
+_store = None
+_lock = threading.Lock()
+
+
+class UsageStore():
+    """Append only log of LLM calls, with their token usage and latency, shared between dbtai processes.
+
+    Calls are stored in SQLite in the dbtai data dir (in WAL mode, like the response cache). Recording
+    a call only appends it to a buffer; the buffer is written in a single transaction when it fills
+    up, and when the process exits.
+    """
+
+    def __init__(self, path=None):
+        """Open (or create) the usage store.
+
+        Args:
+            path (str, optional): The path to the usage database. Defaults to a file in the dbtai data dir.
+        """
+        if path is None:
+            datadir = appdirs.user_data_dir("dbtai", "dbtai")
+            os.makedirs(datadir, exist_ok=True)
+            path = os.path.join(datadir, USAGE_FILENAME)
+
+        self.path = path
+        self._pending = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS calls (
+                ts REAL NOT NULL,
+                command TEXT,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                latency_ms REAL NOT NULL,
+                estimated INTEGER NOT NULL,
+                ok INTEGER NOT NULL
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS calls_ts ON calls (ts)")
+        return connection
+
+    def record(self, command, backend, model, prompt_tokens, completion_tokens, latency, estimated=False, ok=True):
+        """Record an LLM call.
+
+        Args:
+            command (str | None): The dbtai command that made the call.
+            backend (str): The backend.
+            model (str): The LLM model.
+            prompt_tokens (int | None): The prompt tokens, if known.
+            completion_tokens (int | None): The completion tokens, if known.
+            latency (float): The seconds from sending the request to the complete response.
+            estimated (bool, optional): The token counts are estimates. Defaults to False.
+            ok (bool, optional): The call succeeded. Defaults to True.
+        """
+        row = (
+            time.time(), command, backend, model, prompt_tokens, completion_tokens,
+            latency * 1000, int(estimated), int(ok)
+        )
+        with self._lock:
+            self._pending.append(row)
+            due = len(self._pending) >= FLUSH_SIZE or time.monotonic() - self._flushed > FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered calls."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._flushed = time.monotonic()
+        if not rows:
+            return
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            connection.close()
+
+    def stats(self, by='command', days=None):
+        """Aggregate the recorded calls.
+
+        Args:
+            by (str, optional): Group by `command`, `model` or `day`. Defaults to 'command'.
+            days (float, optional): Only include the calls of the last days. Defaults to None, for all calls.
+
+        Returns:
+            list[dict]: Per group: the number of calls and failed calls, the prompt and completion tokens,
+                and the median (p50) and 95th percentile (p95) latency in milliseconds.
+        """
+        self.flush()
+        since = time.time() - days * 24 * 3600 if days else 0
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(f"""
+                SELECT {GROUPS[by]} AS key, latency_ms, prompt_tokens, completion_tokens, ok
+                FROM calls
+                WHERE ts >= ?
+                ORDER BY key, latency_ms
+            """, (since,)).fetchall()
+        finally:
+            connection.close()
+
+        groups = {}
+        for key, latency, prompt_tokens, completion_tokens, ok in rows:
+            group = groups.setdefault(key, {
+                by: key, 'calls': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latencies': []
+            })
+            group['calls'] += 1
+            group['errors'] += 0 if ok else 1
+            group['prompt_tokens'] += prompt_tokens or 0
+            group['completion_tokens'] += completion_tokens or 0
+            group['latencies'].append(latency)
+
+        for group in groups.values():
+            latencies = group.pop('latencies')
+            group['p50_ms'] = percentile(latencies, 0.5)
+            group['p95_ms'] = percentile(latencies, 0.95)
+        return list(groups.values())
+
+    def clear(self):
+        """Remove all recorded calls."""
+        with self._lock:
+            self._pending = []
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM calls")
+        finally:
+            connection.close()
+
+
+def percentile(values, share):
+    """The nearest rank percentile of sorted values."""
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+def set_command(command, default=False):
+    """Set the dbtai command that LLM calls are recorded under.
+
+    Args:
+        command (str): The command, e.g. `doc`.
+        default (bool, optional): Set it for the whole process, including threads started later, instead
+            of the current thread (or asyncio task) only. Defaults to False.
+    """
+    global _default_command
+    if default:
+        _default_command = command
+    else:
+        _command.set(command)
+
+
+def current_command():
+    """The dbtai command that LLM calls are recorded under."""
+    return _command.get() or _default_command
+
+
+def get_store():
+    """Get the usage store of the process, opening it on first use."""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = UsageStore()
+            atexit.register(_flush_at_exit, _store)
+        return _store
+
+
+def record(backend, model, prompt_tokens, completion_tokens, latency, estimated=False, ok=True):
+    """Record an LLM call in the usage store, under the current command. See `UsageStore.record`."""
+    get_store().record(current_command(), backend, model, prompt_tokens, completion_tokens, latency, estimated, ok)
+
+
+def _flush_at_exit(store):
+    try:
+        store.flush()
+    except sqlite3.Error as e:
+        logger.info("Could not write the usage store: %s", e)
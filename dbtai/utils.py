@@ -1,10 +1,155 @@
+import contextlib
+import gc
+import hashlib
+import json
+import logging
 import yaml
 import os
+import stat
+import tempfile
 import appdirs
+from dbtai import tracing
+
+logger = logging.getLogger(__name__)
+
+# The umask can only be read by setting it, so it is read once, before any threads start
+_umask = os.umask(0)
+os.umask(_umask)
 
 def get_config():
+    """Load the user config from the config file, or the default config if there is none."""
     configdir = appdirs.user_data_dir("dbtai", "dbtai")
 
-    with open(os.path.join(configdir, "config.yaml"), "r") as f:
-        return yaml.load(f, Loader=yaml.FullLoader)
-    
+    with tracing.span('config.load'):
+        if os.path.exists(os.path.join(configdir, "config.yaml")):
+            with open(os.path.join(configdir, "config.yaml"), "r") as f:
+                return yaml.load(f, Loader=yaml.FullLoader)
+
+    return {'language': 'english', "backend": "OpenAI"}
+
+
+def target_path(manifest_path, filename):
+    """Get the path of a dbtai file that lives next to the manifest in the target directory."""
+    return os.path.join(os.path.dirname(manifest_path), filename)
+
+
+def manifest_cache_path(manifest_path, filename):
+    """Get the path of a cache file of a dbt manifest, in a directory per manifest in the dbtai data dir.
+
+    Pickled caches live there rather than in the target directory of the project, since loading a
+    pickle can run code, and only the user can write to their data dir.
+
+    Args:
+        manifest_path (str): The path to the manifest.
+        filename (str): The name of the cache file.
+
+    Returns:
+        str: The path of the cache file. Its directory may not exist yet.
+    """
+    key = hashlib.sha256(os.path.abspath(manifest_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(appdirs.user_data_dir("dbtai", "dbtai"), 'manifests', key, filename)
+
+
+def atomic_write(path, content, private=False):
+    """Write a file atomically, by writing to a temporary file in the same directory and renaming it.
+
+    Readers (and concurrent dbtai processes) see either the old or the new file, never a partial one.
+    The file keeps the permissions of the file it replaces, and new files get the default permissions.
+
+    Args:
+        path (str): The file to write.
+        content (str | bytes): The content of the file.
+        private (bool, optional): Make the file readable and writable by the owner only, e.g. for
+            access tokens, whatever the permissions of the file it replaces. Defaults to False.
+    """
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    directory = os.path.dirname(os.path.abspath(path))
+    with tracing.span('file.write', path=path):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode) as f:
+                f.write(content)
+            # mkstemp creates the file readable by the owner only
+            if private:
+                permissions = 0o600
+            else:
+                try:
+                    permissions = stat.S_IMODE(os.stat(path).st_mode)
+                except FileNotFoundError:
+                    permissions = 0o666 & ~_umask
+            os.chmod(tmp_path, permissions)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class JsonState():
+    """Entries kept between runs in a JSON file, next to a header with e.g. the version of the file
+    layout. The entries are discarded when the header changes.
+
+    Subclasses set `description`, the name of the state in log messages.
+    """
+
+    description = 'state'
+
+    def __init__(self, path, header):
+        """Load the state.
+
+        Args:
+            path (str): The path to the state file.
+            header (dict): The header the state must have been written with.
+        """
+        self.path = path
+        self.header = header
+        self.entries = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    state = json.load(f)
+                if {key: state.get(key) for key in header} == header:
+                    self.entries = state['entries']
+                else:
+                    logger.info("Discarding the %s %s, it was written by another version or config", self.description, path)
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                logger.info("Could not read the %s %s (%s)", self.description, path, e)
+
+    def save(self):
+        """Write the state to its file. Failing to write it is not an error."""
+        try:
+            atomic_write(self.path, json.dumps({**self.header, 'entries': self.entries}))
+        except OSError as e:
+            logger.info("Could not write the %s %s (%s)", self.description, self.path, e)
+
+
+def estimate_tokens(text):
+    """Estimate the number of LLM tokens in a text, without a tokenizer.
+
+    Uses the rule of thumb of about 4 characters per token for English text and code.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + 3) // 4
+
+
+def estimate_message_tokens(messages):
+    """Estimate the number of prompt tokens of a list of chat messages, including a small per message overhead."""
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+
+@contextlib.contextmanager
+def paused_gc():
+    """Pause the cyclic garbage collector, e.g. while building many small acyclic containers
+    when parsing or unpickling the manifest."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -0,0 +1,93 @@
+import json
+import os
+import pickle
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_llm_server import FakeLLMServer
+from synthetic_manifest import generate_project
+
+# Size of the synthetic project the tests run on
+PROJECT_NODES = 200
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path_factory, monkeypatch):
+    """Point the dbtai data dir (and the caches kept in it) at a temporary directory."""
+    path = tmp_path_factory.mktemp('data')
+    monkeypatch.setenv('XDG_DATA_HOME', str(path))
+    return path
+
+
+@pytest.fixture
+def config():
+    """A dbtai config that never reaches the network or writes to the dbtai data dir."""
+    return {
+        'language': 'english',
+        'backend': 'OpenAI',
+        'api_key': 'test',
+        'openai_model_name': 'fake',
+        'base_url': 'http://127.0.0.1:9/v1',
+        'response_cache': False,
+        'usage_tracking': False,
+        'max_retries': 0,
+    }
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch, config):
+    """Run in a synthetic dbt project, with the model files written, and dbtai using the test config."""
+    manifest = generate_project(str(tmp_path), PROJECT_NODES, write_models=True)
+    monkeypatch.chdir(tmp_path)
+    for module in ('dbtai.utils', 'dbtai.manifest', 'dbtai.chatbot'):
+        monkeypatch.setattr(f'{module}.get_config', lambda: config)
+    return manifest
+
+
+@pytest.fixture
+def share_name_with_source(project):
+    """Rename a source of the project to the name of a model, so that the name is ambiguous."""
+    def rename(name):
+        with open('target/manifest.json') as f:
+            manifest = json.load(f)
+        source = next(iter(manifest['sources'].values()))
+        source['name'] = name
+        with open('target/manifest.json', 'w') as f:
+            json.dump(manifest, f)
+    return rename
+
+
+class Planted():
+    """Creates a file when unpickled, to detect a pickle that was loaded."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (open, (self.path, 'w'))
+
+
+@pytest.fixture
+def plant_pickle(tmp_path):
+    """Write a pickle that creates a file when loaded, returning the path of that file."""
+    def plant(path):
+        marker = tmp_path / 'unpickled'
+        with open(path, 'wb') as f:
+            pickle.dump(Planted(str(marker)), f)
+        return marker
+    return plant
+
+
+@pytest.fixture
+def llm_server(config):
+    """A fake LLM API on a free port, with the test config pointing at it."""
+    server = FakeLLMServer(port=0, latency_ms=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    config['base_url'] = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    yield server
+    server.shutdown()
+    server.server_close()
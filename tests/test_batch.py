@@ -0,0 +1,101 @@
+import json
+import os
+from click.testing import CliRunner
+from fake_llm_server import make_content
+from dbtai.cli import dbtai
+from dbtai.sidecar import Sidecar
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'batch_results.jsonl')
+
+
+def run(*args):
+    result = CliRunner().invoke(dbtai, ['--no-server', *args], catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_export(project):
+    run('batch', 'export', 'doc', '--select', 'stg_*', '--output', 'batch.jsonl')
+
+    requests = read_jsonl('batch.jsonl')
+    staging = [node for node in project['nodes'].values() if node['name'].startswith('stg_')]
+    assert len(requests) == len(staging)
+    assert {request['custom_id'] for request in requests} == {f"doc:{node['unique_id']}" for node in staging}
+    for request in requests:
+        assert request['url'] == '/v1/chat/completions'
+        assert request['body']['model'] == 'fake'
+        assert request['body']['response_format'] == {'type': 'json_object'}
+        assert request['body']['messages'][-1]['role'] == 'user'
+
+
+def test_import(project):
+    result = CliRunner().invoke(dbtai, ['--no-server', 'batch', 'import', RESULTS, '-w'])
+
+    assert result.exit_code == 1
+    assert "Imported 3 of 5 results" in result.output
+    assert "Failed to import doc:model.synthetic.stg_2: " in result.output
+    assert "Failed to import doc:model.synthetic.stg_3: status code 500" in result.output
+
+    sidecar = Sidecar('models/staging/stg_0.yml').data
+    assert sidecar['models'][0]['description'] == 'Staged orders.'
+    assert [test['name'] for test in sidecar['unit_tests']] == ['test_stg_0']
+    assert Sidecar('models/staging/stg_1.yml').data['models'][0]['description'] == 'Staged customers.'
+    assert not os.path.exists('models/staging/stg_2.yml')
+
+    # Imported docs are recorded for incremental runs
+    with open('target/dbtai_doc_state.json') as f:
+        assert set(json.load(f)['entries']) == {'model.synthetic.stg_0', 'model.synthetic.stg_1'}
+
+
+def test_import_with_ambiguous_name(project, share_name_with_source):
+    share_name_with_source('stg_0')
+
+    result = CliRunner().invoke(dbtai, ['--no-server', 'batch', 'import', RESULTS, '-w'])
+
+    assert isinstance(result.exception, SystemExit)
+    assert "Imported 3 of 5 results" in result.output
+    assert Sidecar('models/staging/stg_0.yml').data['models'][0]['description'] == 'Staged orders.'
+    with open('target/dbtai_doc_state.json') as f:
+        assert 'model.synthetic.stg_0' in json.load(f)['entries']
+
+
+def test_import_prints_without_write(project):
+    result = CliRunner().invoke(dbtai, ['--no-server', 'batch', 'import', RESULTS])
+
+    assert "description: Staged orders." in result.output
+    assert "name: test_stg_0" in result.output
+    assert not os.path.exists('models/staging/stg_0.yml')
+
+
+def test_export_import_round_trip(project):
+    run('batch', 'export', 'doc', 'stg_0', 'stg_1', 'int_0', '--output', 'batch.jsonl')
+
+    # Answer the requests like the batch API would, with the responses of the fake LLM server
+    with open('results.jsonl', 'w') as f:
+        for request in read_jsonl('batch.jsonl'):
+            message = {'role': 'assistant', 'content': make_content(request['body'])}
+            f.write(json.dumps({
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': {'choices': [{'index': 0, 'message': message}]}},
+            }) + '\n')
+    result = run('batch', 'import', 'results.jsonl', '-w')
+
+    assert "Imported 3 of 3 results" in result.output
+    for model_name in ['stg_0', 'stg_1', 'int_0']:
+        node = project['nodes'][f'model.synthetic.{model_name}']
+        model = Sidecar(node['original_file_path'].replace('.sql', '.yml')).data['models'][0]
+        assert model['name'] == model_name
+        assert model['description'] == 'A generated description.'
+
+
+def test_export_with_ambiguous_name(project, share_name_with_source):
+    share_name_with_source('stg_0')
+
+    run('batch', 'export', 'doc', '--select', 'stg_0*', '--output', 'batch.jsonl')
+
+    assert 'doc:model.synthetic.stg_0' in {request['custom_id'] for request in read_jsonl('batch.jsonl')}
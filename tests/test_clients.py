@@ -0,0 +1,25 @@
+import sys
+import pytest
+from dbtai.clients import _make_client
+
+
+def test_native_azure_authentication_names_the_missing_package(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'azure.identity', None)
+    config = {
+        'backend': 'Azure OpenAI',
+        'auth_type': 'Native Authentication (DefaultAzureCredential)',
+        'azure_endpoint': 'https://example.openai.azure.com',
+    }
+
+    with pytest.raises(ImportError, match="azure-identity"):
+        _make_client(config)
+
+
+@pytest.mark.parametrize('backend', ["OpenAI", "OpenAI compatible", "Mistral"])
+def test_sdk_retries_are_off(config, backend):
+    client = _make_client({**config, 'backend': backend})
+
+    if backend == "Mistral":
+        assert client._max_retries == 1
+    else:
+        assert client.max_retries == 0
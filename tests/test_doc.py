@@ -0,0 +1,123 @@
+import json
+import re
+from click.testing import CliRunner
+from dbtai.cli import dbtai
+from dbtai.doc_state import missing_descriptions
+from dbtai.manifest import Manifest
+from dbtai.sidecar import Sidecar
+
+
+def test_doc_dag_order(project, monkeypatch):
+    prompts = {}
+
+    def docs_messages(self, model_name):
+        messages = original(self, model_name)
+        prompts[model_name] = messages[-1]['content']
+        return messages
+
+    async def acomplete(self, messages, response_format_type="json_object"):
+        name = re.search(r'`(\w+)`', messages[-1]['content']).group(1)
+        return f'{{"name": "{name}", "description": "Generated description of {name}.", "columns": []}}'
+
+    original = Manifest.docs_messages
+    monkeypatch.setattr(Manifest, 'docs_messages', docs_messages)
+    monkeypatch.setattr(Manifest, '_acomplete', acomplete)
+
+    # A mart and its upstream models, listed downstream first
+    nodes = project['nodes']
+    mart = next(node for node in nodes.values() if node['name'].startswith('fct_') and len(node['depends_on']['nodes']) > 1)
+    upstream = [nodes[unique_id]['name'] for unique_id in mart['depends_on']['nodes'] if unique_id in nodes]
+    assert upstream
+
+    result = CliRunner().invoke(dbtai, ['--no-server', 'doc', mart['name'], *upstream, '--dag-order', '-p'], catch_exceptions=False)
+
+    assert result.exit_code == 0, result.output
+    order = list(prompts)
+    assert order[-1] == mart['name']
+    assert set(order) == {mart['name'], *upstream}
+    for name in upstream:
+        assert f"Generated description of {name}." in prompts[mart['name']]
+    assert f"Documented {len(upstream) + 1} of {len(upstream) + 1} models" in result.output
+
+
+def test_doc_dag_order_unknown_model(project, monkeypatch):
+    async def acomplete(self, messages, response_format_type="json_object"):
+        return '{"name": "stg_0", "description": "Generated.", "columns": []}'
+
+    monkeypatch.setattr(Manifest, '_acomplete', acomplete)
+
+    result = CliRunner().invoke(dbtai, ['--no-server', 'doc', 'stg_0', 'no_such_model', '--dag-order', '-p'])
+
+    assert result.exit_code == 1
+    assert "Failed to document no_such_model: Model no_such_model not found in the manifest" in result.output
+    assert "Documented 1 of 2 models" in result.output
+
+
+def test_doc_bulk_error_ends_the_run(project, monkeypatch):
+    async def acomplete(self, messages, response_format_type="json_object"):
+        return '{"name": "stg_0", "description": "Generated.", "columns": []}'
+
+    async def close_async_clients():
+        raise RuntimeError("The clients could not be closed")
+
+    monkeypatch.setattr(Manifest, '_acomplete', acomplete)
+    monkeypatch.setattr('dbtai.manifest.close_async_clients', close_async_clients)
+
+    result = CliRunner().invoke(dbtai, ['--no-server', 'doc', 'stg_0', 'stg_1', '--dag-order', '-p'])
+
+    assert result.exit_code == 1
+    assert isinstance(result.exception, RuntimeError)
+    assert "Documented" not in result.output
+
+
+def test_select_models(project):
+    manifest = Manifest()
+    staging = sorted(node['unique_id'] for node in project['nodes'].values() if node['name'].startswith('stg_'))
+
+    assert sorted(manifest.select_models(['stg_*'])) == staging
+    assert sorted(manifest.select_models([], paths=['models/staging'])) == staging
+    assert manifest.select_models(['stg_0', 'stg_0*']) == ['stg_0']
+
+
+def test_doc_pattern_with_ambiguous_name(project, share_name_with_source, monkeypatch):
+    async def acomplete(self, messages, response_format_type="json_object"):
+        name = re.search(r'`(\w+)`', messages[-1]['content']).group(1)
+        return f'{{"name": "{name}", "description": "Generated.", "columns": []}}'
+
+    monkeypatch.setattr(Manifest, '_acomplete', acomplete)
+    share_name_with_source('stg_0')
+
+    result = CliRunner().invoke(dbtai, ['--no-server', 'doc', 'stg_0*', '-w'], catch_exceptions=False)
+
+    assert result.exit_code == 0, result.output
+    assert "Documented model.synthetic.stg_0 in models/staging/stg_0.yml" in result.output
+    assert Sidecar('models/staging/stg_0.yml').data['models'][0]['name'] == 'stg_0'
+
+
+def test_incremental_docs(project):
+    models = [node for node in project['nodes'].values() if node['name'].startswith('int_')]
+    documented = next(model for model in models if not missing_descriptions(model))
+    undocumented = next(model for model in models if missing_descriptions(model))
+    names = [documented['name'], undocumented['name']]
+
+    document, skip = Manifest().plan_incremental_docs(names)
+    assert document == {undocumented['name']: "missing descriptions"}
+    assert skip == {documented['name']: "already documented"}
+
+    Manifest().record_documented([undocumented['name']])
+    document, skip = Manifest().plan_incremental_docs(names)
+    assert document == {}
+    assert skip == dict.fromkeys(names, "unchanged since last documented")
+
+    # Change the code of one model, and add a column upstream of the other
+    with open('target/manifest.json') as f:
+        manifest = json.load(f)
+    manifest['nodes'][undocumented['unique_id']]['checksum']['checksum'] = 'changed'
+    parent = manifest['nodes'][documented['depends_on']['nodes'][0]]
+    parent['columns']['added'] = {'name': 'added', 'description': ''}
+    with open('target/manifest.json', 'w') as f:
+        json.dump(manifest, f)
+
+    document, skip = Manifest(cache=False).plan_incremental_docs(names)
+    assert document == {undocumented['name']: "SQL changed", documented['name']: "upstream columns changed"}
+    assert skip == {}
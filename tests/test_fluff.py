@@ -0,0 +1,68 @@
+import json
+from click.testing import CliRunner
+from dbtai.cli import dbtai
+from dbtai.fluff import FluffState, code_checksum
+
+
+def result(code, fixed):
+    return {'code': fixed, 'changed': fixed != code, 'checksum': code_checksum(code)}
+
+
+def test_fluff_state_keeps_the_last_result_per_file(tmp_path):
+    path = str(tmp_path / 'dbtai_fluff_state.json')
+    state = FluffState(path, 'ansi')
+    state.record('models/a.sql', result('SELECT 1', 'select 1\n'))
+    state.record('models/a.sql', result('select 2', 'select 2\n'))
+    state.record('models/b.sql', result('select 3\n', 'select 3\n'))
+    state.save()
+
+    state = FluffState(path, 'ansi')
+    assert state.get('models/a.sql', code_checksum('SELECT 1')) is None
+    assert state.get('models/a.sql', code_checksum('select 2'))['code'] == 'select 2\n'
+    assert state.get('models/b.sql', code_checksum('select 3\n'))['clean']
+    assert state.get('models/b.sql', code_checksum('select 4\n')) is None
+    with open(path) as f:
+        assert sorted(json.load(f)['entries']) == ['models/a.sql', 'models/b.sql']
+
+
+def test_fluff_state_is_discarded_for_another_dialect(tmp_path):
+    path = str(tmp_path / 'dbtai_fluff_state.json')
+    state = FluffState(path, 'ansi')
+    state.record('models/a.sql', result('select 1\n', 'select 1\n'))
+    state.save()
+
+    assert FluffState(path, 'snowflake').get('models/a.sql', code_checksum('select 1\n')) is None
+
+
+def fluff(*args):
+    return CliRunner().invoke(dbtai, ['fluff', 'stg_0', 'stg_1', 'stg_2', *args])
+
+
+def make_dirty(project, names):
+    for node in project['nodes'].values():
+        if node['name'] in names:
+            with open(node['original_file_path'], 'w') as f:
+                f.write("select  id,name   from {{ source('raw', 'src_0') }}\n")
+
+
+def test_fluff_write_records_the_fixed_code_as_clean(project):
+    make_dirty(project, {'stg_0', 'stg_1'})
+
+    result = fluff('-w')
+    assert result.exit_code == 0, result.output
+    assert "2 fixed, 1 already clean, 0 failed (0 unchanged since the last run)" in result.output
+
+    result = fluff('-w')
+    assert result.exit_code == 0, result.output
+    assert "0 fixed, 3 already clean, 0 failed (3 unchanged since the last run)" in result.output
+
+
+def test_fluff_write_of_a_known_fix_records_it_as_clean(project):
+    make_dirty(project, {'stg_0'})
+
+    assert "1 to fix" in fluff().output
+    result = fluff('-w')
+    assert "1 fixed, 2 already clean, 0 failed (3 unchanged since the last run)" in result.output
+
+    result = fluff('-w')
+    assert "0 fixed, 3 already clean, 0 failed (3 unchanged since the last run)" in result.output
@@ -0,0 +1,54 @@
+import pytest
+from dbtai.graph import DagIndex
+
+
+def walk(edges, start, depth=None):
+    distances = {}
+    frontier = [start]
+    distance = 0
+    while frontier and (depth is None or distance < depth):
+        distance += 1
+        next_frontier = []
+        for node in frontier:
+            for neighbour in edges.get(node, []):
+                if neighbour not in distances:
+                    distances[neighbour] = distance
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return distances
+
+
+def test_lineage_matches_a_walk_of_the_manifest(project):
+    nodes = {**project['nodes'], **project['sources']}
+    graph = DagIndex.build(nodes, project['parent_map'])
+    for depth in (None, 1, 2):
+        for unique_id in nodes:
+            ancestors = graph.ancestors(unique_id, depth)
+            assert ancestors == walk(project['parent_map'], unique_id, depth)
+            assert list(ancestors.values()) == sorted(ancestors.values())
+            assert graph.descendants(unique_id, depth) == walk(project['child_map'], unique_id, depth)
+
+
+def test_lineage_keeps_the_shortest_distance():
+    parent_map = {'a': [], 'b': ['a'], 'c': ['b'], 'd': ['c', 'a']}
+    graph = DagIndex.build({}, parent_map)
+    assert graph.ancestors('d') == {'c': 1, 'a': 1, 'b': 2}
+    assert graph.ancestors('d', 1) == {'c': 1, 'a': 1}
+    assert graph.descendants('a') == {'b': 1, 'd': 1, 'c': 2}
+    assert graph.ancestors('d', 0) == {}
+
+
+def test_lineage_reuses_the_marks(monkeypatch):
+    monkeypatch.setattr('dbtai.graph._MAX_WALKS', 2)
+    graph = DagIndex.build({}, {'a': [], 'b': ['a'], 'c': ['b']})
+    for _ in range(3):
+        assert graph.descendants('a', 1) == {'b': 1}
+        assert graph.descendants('a') == {'b': 1, 'c': 2}
+        assert graph.ancestors('c') == {'b': 1, 'a': 2}
+
+
+def test_cycle():
+    graph = DagIndex.build({}, {'a': ['c'], 'b': ['a'], 'c': ['b']})
+    assert graph.ancestors('a') == {'c': 1, 'b': 2}
+    with pytest.raises(ValueError, match="cycle"):
+        graph.levels()
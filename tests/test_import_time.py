@@ -0,0 +1,17 @@
+import pytest
+from import_time import BUDGET_MS, LIGHT_COMMANDS, heavy_modules, measure, temporary_data_dir
+
+
+@pytest.fixture(scope='module')
+def env():
+    with temporary_data_dir() as env:
+        yield env
+
+
+@pytest.mark.parametrize('command', LIGHT_COMMANDS, ids=' '.join)
+def test_light_command_imports(env, command):
+    # The best of a few runs, so that a busy machine doesn't fail the budget
+    runs = [measure(command, env) for _ in range(3)]
+
+    assert heavy_modules(runs[0][2]) == []
+    assert min(total for total, _, _ in runs) < BUDGET_MS
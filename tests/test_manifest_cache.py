@@ -0,0 +1,23 @@
+import os
+from dbtai.manifest import Manifest
+from dbtai.manifest_cache import CACHE_FILENAME, get_cache_path
+
+
+def test_cache_lives_in_the_data_dir(project, data_dir):
+    Manifest()
+
+    cache_path = get_cache_path('target/manifest.json')
+    assert os.path.exists(cache_path)
+    assert cache_path.startswith(str(data_dir))
+    assert not os.path.exists(os.path.join('target', CACHE_FILENAME))
+    assert get_cache_path('target/manifest.json') != get_cache_path('other/target/manifest.json')
+
+    cached = Manifest()
+    assert len(cached.nodes_by_id) == len(Manifest(cache=False).nodes_by_id)
+
+
+def test_cache_in_the_target_directory_is_not_loaded(project, plant_pickle):
+    marker = plant_pickle(os.path.join('target', CACHE_FILENAME))
+
+    Manifest()
+    assert not marker.exists()
@@ -0,0 +1,64 @@
+import json
+import pytest
+from synthetic_manifest import generate_manifest
+from dbtai.manifest_parser import select_sections, stream_manifest
+
+CHUNK_SIZES = [1, 2, 3, 5, 8, 13, 64, 1 << 20]
+
+# Scalars of every kind, which the small chunk sizes split at every offset
+EDGE_CASES = {
+    'metadata': {'dbt_version': '1.8.0', 'generated_at': None},
+    'nodes': {
+        'model.p.a': {
+            'unique_id': 'model.p.a',
+            'name': 'a',
+            'description': 'Quotes " and escapes \\ and unicode é中',
+            'columns': {},
+            'checksum': {'name': 'sha256', 'checksum': '0'},
+            'depends_on': {'nodes': [], 'macros': []},
+            'config': {'enabled': True, 'weight': 0.5, 'limit': -12, 'ratio': 1.5e-07, 'ok': False},
+        },
+    },
+    'sources': {},
+    'macros': {'macro.p.m': {'arguments': [], 'version': 1.0, 'sizes': [0, 0.25, 100, -3.5e3]}},
+    'parent_map': {'model.p.a': []},
+    'number': 0.125,
+    'scores': {'a': 0.5, 'b': 12.75, 'c': -1e-3, 'd': 10, 'e': True, 'f': None, 'g': 'text'},
+    'exponent': 2E+10,
+}
+
+
+def write(tmp_path, manifest, indent=None):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(manifest, indent=indent))
+    return str(path)
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_stream_manifest_edge_cases(tmp_path, chunk_size, indent):
+    path = write(tmp_path, EDGE_CASES, indent)
+
+    with open(path) as f:
+        expected = select_sections(json.load(f))
+    assert stream_manifest(path, chunk_size=chunk_size) == expected
+
+    sections = {'scores': None, 'macros': None}
+    assert stream_manifest(path, sections, chunk_size=chunk_size) == {'scores': EDGE_CASES['scores'], 'macros': EDGE_CASES['macros']}
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_stream_manifest_matches_json_load(tmp_path, chunk_size):
+    path = write(tmp_path, generate_manifest(100))
+
+    with open(path) as f:
+        expected = select_sections(json.load(f))
+    assert stream_manifest(path, chunk_size=chunk_size) == expected
+
+
+def test_stream_manifest_truncated(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(EDGE_CASES)[:-20])
+
+    with pytest.raises(ValueError):
+        stream_manifest(str(path), chunk_size=7)
@@ -0,0 +1,96 @@
+import sqlite3
+import types
+import pytest
+from click.testing import CliRunner
+from dbtai.cli import dbtai
+from dbtai.manifest import Manifest
+from dbtai.response_cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time the response cache sees."""
+    now = types.SimpleNamespace(time=1000.0)
+    monkeypatch.setattr('dbtai.response_cache.time.time', lambda: now.time)
+    return now
+
+
+def cached_keys(cache):
+    connection = sqlite3.connect(cache.path)
+    try:
+        return sorted(key for key, in connection.execute("SELECT key FROM responses"))
+    finally:
+        connection.close()
+
+
+def test_counts_hits_and_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    key = ResponseCache.make_key('OpenAI', 'fake', [{'role': 'user', 'content': 'Hi'}], 'text')
+
+    assert cache.get(key) is None
+    cache.put(key, 'Hello')
+    assert cache.get(key) == 'Hello'
+    assert cache.get(key) == 'Hello'
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # The counters in the database are shared between processes, and cleared with the cache
+    stats = ResponseCache(cache.path).stats()
+    assert (stats['entries'], stats['size'], stats['hits'], stats['misses']) == (1, 5, 2, 1)
+    cache.clear()
+    assert ResponseCache(cache.path).stats() == {'path': cache.path, 'entries': 0, 'size': 0, 'hits': 0, 'misses': 0}
+
+
+def test_evicts_expired_entries(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_age_days=1)
+    cache.put('old', 'Old response')
+
+    clock.time += 24 * 3600 + 1
+    assert cache.get('old') is None
+    assert cached_keys(cache) == ['old']
+
+    cache.put('new', 'New response')
+    assert cached_keys(cache) == ['new']
+
+
+def test_evicts_least_recently_used_entries(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_size_mb=30 / (1024 * 1024))
+    for key in ('a', 'b', 'c'):
+        clock.time += 1
+        cache.put(key, '0123456789')
+    assert cached_keys(cache) == ['a', 'b', 'c']
+
+    # Reading an entry makes it the most recently used, so the next put evicts the oldest unread one
+    clock.time += 1
+    cache.get('a')
+    clock.time += 1
+    cache.put('d', '0123456789')
+    assert cached_keys(cache) == ['a', 'c', 'd']
+
+    # An entry larger than the cache evicts everything, itself included
+    clock.time += 1
+    cache.put('e', '0' * 31)
+    assert cached_keys(cache) == []
+
+
+def test_no_cache_option(project, config, monkeypatch):
+    config['response_cache'] = True
+    calls = []
+
+    def chat_completion(self, messages, response_format_type="json_object", stream=False):
+        calls.append(messages)
+        return types.SimpleNamespace(content="It stages the orders.")
+
+    monkeypatch.setattr(Manifest, 'chat_completion', chat_completion)
+
+    def explain(*options):
+        result = CliRunner().invoke(dbtai, ['--no-server', *options, 'explain', 'stg_0', '--no-stream'], catch_exceptions=False)
+        assert "It stages the orders." in result.output
+
+    explain()
+    explain()
+    assert len(calls) == 1
+
+    explain('--no-cache')
+    assert len(calls) == 2
+    stats = ResponseCache().stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 1)
@@ -0,0 +1,51 @@
+import json
+import time
+import openai
+import pytest
+from dbtai.backends import get_backend
+
+MESSAGES = [{'role': 'user', 'content': 'Document the model `orders`'}]
+
+
+@pytest.fixture
+def backend(config, llm_server):
+    config.update(max_retries=2, retry_base_delay=0.01, retry_max_delay=5)
+    return get_backend(config)
+
+
+def test_retries_after_throttling(backend, llm_server):
+    llm_server.failures.extend([429])
+    llm_server.retry_after = 0.3
+
+    start = time.perf_counter()
+    completion = backend.complete(MESSAGES, 'json_object')
+
+    assert time.perf_counter() - start >= 0.3
+    assert json.loads(completion.content)['name'] == 'orders'
+    assert llm_server.counts == {'throttled': 1, 'ok': 1}
+
+
+def test_retries_server_errors(backend, llm_server):
+    llm_server.failures.extend([500, 503])
+
+    backend.complete(MESSAGES, 'json_object')
+
+    assert llm_server.counts == {'error': 2, 'ok': 1}
+
+
+def test_gives_up_after_max_retries(backend, llm_server):
+    llm_server.failures.extend([500, 500, 500, 500])
+
+    with pytest.raises(openai.InternalServerError):
+        backend.complete(MESSAGES, 'json_object')
+
+    assert llm_server.counts == {'error': 3}
+
+
+def test_does_not_retry_bad_requests(backend, llm_server):
+    llm_server.failures.extend([400])
+
+    with pytest.raises(openai.BadRequestError):
+        backend.complete(MESSAGES, 'json_object')
+
+    assert llm_server.counts == {'error': 1}
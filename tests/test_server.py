@@ -0,0 +1,31 @@
+import json
+import os
+import stat
+import threading
+from dbtai.server import STATE_FILENAME, serve
+from dbtai.utils import target_path
+
+
+def test_server_state_is_private(tmp_path):
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text('{}')
+    manifest_path = str(manifest_path)
+    started = threading.Event()
+    servers = []
+
+    def ready(server):
+        servers.append(server)
+        started.set()
+
+    thread = threading.Thread(target=serve, args=(lambda: None, manifest_path), kwargs={'ready': ready}, daemon=True)
+    thread.start()
+    assert started.wait(10)
+    try:
+        state_path = target_path(manifest_path, STATE_FILENAME)
+        assert stat.S_IMODE(os.stat(state_path).st_mode) == 0o600
+        with open(state_path) as f:
+            assert json.load(f)['token'] == servers[0].token
+    finally:
+        servers[0].shutdown()
+        thread.join(10)
+    assert not os.path.exists(state_path)
@@ -0,0 +1,85 @@
+import os
+from click.testing import CliRunner
+from dbtai.cli import dbtai
+from dbtai.sidecar import Sidecar, SidecarWriter
+
+EXISTING = """version: 2
+
+models:
+  # Written by hand
+  - name: orders
+    description: Old description
+    config:
+      tags: [finance]
+    columns:
+      - name: ID
+        description: Old id
+        tests:
+          - unique
+      - name: amount
+        description: The amount # in cents
+unit_tests:
+  - name: test_orders
+    model: orders
+"""
+
+
+def test_merge_docs_keeps_the_rest_of_the_file(tmp_path):
+    path = tmp_path / 'orders.yml'
+    path.write_text(EXISTING)
+
+    sidecar = Sidecar(str(path))
+    sidecar.merge_docs({
+        'name': 'orders',
+        'description': 'New description',
+        'columns': [{'name': 'id', 'description': 'New id'}, {'name': 'status', 'description': 'The status'}],
+    })
+    sidecar.save()
+
+    text = path.read_text()
+    assert text == EXISTING.replace('Old description', 'New description').replace('Old id', 'New id').replace(
+        "unit_tests:", "      - name: status\n        description: The status\nunit_tests:"
+    )
+
+
+def test_merge_unit_tests_replaces_by_name(tmp_path):
+    path = tmp_path / 'orders.yml'
+    path.write_text(EXISTING)
+
+    sidecar = Sidecar(str(path))
+    sidecar.merge_unit_tests("unit_tests:\n  - name: test_orders\n    model: orders\n    given: []\n  - name: test_new\n    model: orders\n")
+    sidecar.save()
+
+    unit_tests = Sidecar(str(path)).data['unit_tests']
+    assert [test['name'] for test in unit_tests] == ['test_orders', 'test_new']
+    assert unit_tests[0]['given'] == []
+
+
+def test_writer_writes_each_file_once(tmp_path):
+    path = str(tmp_path / 'new.yml')
+    with SidecarWriter() as writer:
+        writer.merge_docs(path, {'name': 'a', 'description': 'A', 'columns': []})
+        writer.merge_unit_tests(path, [{'name': 'test_a', 'model': 'a'}])
+        assert not os.path.exists(path)
+
+    data = Sidecar(path).data
+    assert data['version'] == 2
+    assert [model['name'] for model in data['models']] == ['a']
+    assert [test['name'] for test in data['unit_tests']] == ['test_a']
+
+
+def test_doc_reports_malformed_sidecar(project, llm_server):
+    models = sorted(node['name'] for node in project['nodes'].values() if node['name'].startswith('stg_'))[:3]
+    broken = project['nodes'][f'model.synthetic.{models[0]}']['original_file_path'].replace('.sql', '.yml')
+    with open(broken, 'w') as f:
+        f.write('models: [\n')
+
+    result = CliRunner().invoke(dbtai, ['--no-server', 'doc', *models, '-w'])
+
+    assert result.exit_code == 1
+    assert f"Failed to document {models[0]}" in result.output
+    assert f"Documented 2 of 3 models" in result.output
+    for model_name in models[1:]:
+        assert f"Documented {model_name} in" in result.output
+    with open(broken) as f:
+        assert f.read() == 'models: [\n'
@@ -0,0 +1,55 @@
+import os
+from dbtai.manifest import Manifest
+from dbtai.sql_usage import CACHE_FILENAME, extract_column_usage, get_cache_path
+
+
+def test_column_usage():
+    usage = extract_column_usage("select o.id, o.amount from {{ ref('orders') }} as o where o.status = 'paid'")
+
+    assert usage['method'] == 'sqlfluff'
+    assert usage['columns'] == ['amount', 'id', 'status']
+    assert usage['star_relations'] == []
+    assert usage['complete']
+
+
+def test_select_star_passes_through_columns():
+    usage = extract_column_usage("with orders as (select * from {{ ref('orders') }}) select * from orders")
+
+    assert usage['star_relations'] == ['orders']
+    assert usage['complete']
+
+
+def test_unresolved_jinja_is_incomplete():
+    usage = extract_column_usage("select {{ dbt_utils.star(ref('orders')) }} from {{ ref('orders') }}")
+
+    assert usage['columns'] == []
+    assert usage['star_relations'] == []
+    assert not usage['complete']
+
+
+def test_upstream_context_keeps_columns_of_unresolved_jinja(project):
+    manifest = Manifest()
+    model = next(node for node in project['nodes'].values() if node['name'].startswith('int_'))
+    parent = manifest.get_upstream_models(model['name'])[0]
+    manifest.get_model_from_name(model['name'])['raw_code'] = (
+        f"select {{{{ dbt_utils.star(ref('{parent['name']}')) }}}} from {{{{ ref('{parent['name']}') }}}}"
+    )
+
+    context = manifest.compile_upstream_description_markdown(model['name'])
+
+    assert 'not used by the model' not in context
+    for column in parent['columns']:
+        assert f'* {column}:' in context
+
+
+def test_cache_in_the_target_directory_is_not_loaded(project, plant_pickle, data_dir):
+    marker = plant_pickle(os.path.join('target', CACHE_FILENAME))
+    manifest = Manifest()
+    model = next(node for node in project['nodes'].values() if node['name'].startswith('int_'))
+
+    manifest.compile_upstream_description_markdown(model['name'])
+    manifest.sql_usage_cache.save()
+
+    assert not marker.exists()
+    assert get_cache_path('target/manifest.json').startswith(str(data_dir))
+    assert os.path.exists(get_cache_path('target/manifest.json'))
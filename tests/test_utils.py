@@ -0,0 +1,45 @@
+import os
+import stat
+from dbtai.utils import atomic_write
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'model.sql'
+    atomic_write(str(path), 'select 1')
+    atomic_write(str(path), 'select 2')
+
+    assert path.read_text() == 'select 2'
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+
+def test_atomic_write_new_file_permissions(tmp_path):
+    umask = os.umask(0)
+    os.umask(umask)
+
+    atomic_write(str(tmp_path / 'new.yml'), 'version: 2\n')
+
+    assert mode(tmp_path / 'new.yml') == 0o666 & ~umask
+
+
+def test_atomic_write_keeps_permissions(tmp_path):
+    path = tmp_path / 'stg_2.sql'
+    path.write_text('select 1')
+    os.chmod(path, 0o640)
+
+    atomic_write(str(path), 'select 2')
+
+    assert mode(path) == 0o640
+
+
+def test_atomic_write_private(tmp_path):
+    path = tmp_path / 'dbtai_server.json'
+    path.write_text('{}')
+    os.chmod(path, 0o644)
+
+    atomic_write(str(path), '{"token": "secret"}', private=True)
+
+    assert mode(path) == 0o600